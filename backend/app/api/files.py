@@ -0,0 +1,31 @@
+from fastapi import APIRouter, HTTPException, Request
+from typing import List, Optional
+from ..file_distribution import save_artifact, list_artifacts, load_artifact, delete_artifact
+import asyncio
+
+router = APIRouter(prefix="/files", tags=["files"])
+
+@router.post("/", response_model=dict)
+async def upload_file(request: Request, name: Optional[str] = None):
+    """
+    Store the raw request body as an artifact for file tasks. The body is
+    streamed to disk, never held in memory; the returned sha256 identifies it.
+    """
+    return await save_artifact(request.stream(), name)
+
+@router.get("/", response_model=List[dict])
+async def get_files():
+    return await asyncio.to_thread(list_artifacts)
+
+@router.get("/{sha256}", response_model=dict)
+async def get_file(sha256: str):
+    artifact = await asyncio.to_thread(load_artifact, sha256)
+    if artifact is None:
+        raise HTTPException(status_code=404, detail="File not found")
+    return artifact
+
+@router.delete("/{sha256}")
+async def delete_file(sha256: str):
+    if not await asyncio.to_thread(delete_artifact, sha256):
+        raise HTTPException(status_code=404, detail="File not found")
+    return {"msg": "File deleted"}
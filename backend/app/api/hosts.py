@@ -1,9 +1,19 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from sqlalchemy import insert, update, tuple_
 from sqlalchemy.orm import Session
-from typing import List, Optional
-from pydantic import BaseModel
-from ..db import get_db
-from ..models import Host, AuthType
+from typing import Dict, List, Optional, Tuple
+from itertools import islice
+from pydantic import BaseModel, ValidationError
+from ..db import get_db, SessionLocal
+from ..models import Host, HostTag, AuthType
+from ..host_selector import build_host_query, iter_hosts, resolve_host_ids, set_host_tags, set_hosts_tags, SelectorError
+from .. import config
+import asyncio
+import csv
+import io
+import json
+import re
 
 router = APIRouter(prefix="/hosts", tags=["hosts"])
 
@@ -19,6 +29,18 @@ class HostBase(BaseModel):
 class HostCreate(HostBase):
     pass
 
+class HostSelector(BaseModel):
+    # All given criteria must match
+    tags: Optional[str] = None  # e.g. "prod and (web or api) and not canary"
+    q: Optional[str] = None  # name / ip prefix
+    cidr: Optional[str] = None  # e.g. "10.1.0.0/16"
+
+    def resolve(self, db: Session) -> List[int]:
+        try:
+            return resolve_host_ids(db, self.tags, self.q, self.cidr)
+        except SelectorError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
 class HostRead(HostBase):
     id: int
     
@@ -37,14 +59,35 @@ def create_host(host: HostCreate, db: Session = Depends(get_db)):
         tags=host.tags
     )
     db.add(db_host)
+    db.flush()
+    set_host_tags(db, db_host.id, host.tags)
     db.commit()
     db.refresh(db_host)
     return db_host
 
 @router.get("/", response_model=List[HostRead])
-def get_hosts(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    hosts = db.query(Host).offset(skip).limit(limit).all()
-    return hosts
+def get_hosts(
+    skip: int = 0,
+    limit: int = 100,
+    tags: Optional[str] = None,
+    q: Optional[str] = None,
+    cidr: Optional[str] = None,
+    db: Session = Depends(get_db),
+):
+    try:
+        query, network = build_host_query(db, tags, q, cidr)
+    except SelectorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if network is None:
+        return query.offset(skip).limit(limit).all()
+    # CIDR membership is checked in Python on the prefix-narrowed rows
+    return list(islice(iter_hosts(query, network), skip, skip + limit))
+
+@router.get("/resolve", response_model=dict)
+def resolve_hosts(tags: Optional[str] = None, q: Optional[str] = None, cidr: Optional[str] = None, db: Session = Depends(get_db)):
+    """Ids of the hosts a selector targets, e.g. to preview a task."""
+    host_ids = HostSelector(tags=tags, q=q, cidr=cidr).resolve(db)
+    return {"count": len(host_ids), "host_ids": host_ids}
 
 @router.put("/{host_id}", response_model=HostRead)
 def update_host(host_id: int, host: HostCreate, db: Session = Depends(get_db)):
@@ -54,6 +97,7 @@ def update_host(host_id: int, host: HostCreate, db: Session = Depends(get_db)):
     
     for key, value in host.dict().items():
         setattr(db_host, key, value)
+    set_host_tags(db, host_id, host.tags)
     
     db.commit()
     db.refresh(db_host)
@@ -65,6 +109,175 @@ def delete_host(host_id: int, db: Session = Depends(get_db)):
     if db_host is None:
         raise HTTPException(status_code=404, detail="Host not found")
     
+    db.query(HostTag).filter(HostTag.host_id == host_id).delete(synchronize_session=False)
     db.delete(db_host)
     db.commit()
     return {"ok": True}
+
+# Columns of the bulk CSV format, `port` is accepted as an alias of ssh_port
+EXPORT_COLUMNS = ["name", "ip", "ssh_port", "username", "auth_type", "tags"]
+
+def _parse_record(line: str, header: Optional[List[str]]) -> HostCreate:
+    if header is None:
+        record = json.loads(line)
+        if not isinstance(record, dict):
+            raise ValueError("expected a JSON object")
+    else:
+        values = next(csv.reader([line]))
+        if len(values) != len(header):
+            raise ValueError(f"expected {len(header)} columns, got {len(values)}")
+        # Empty cells fall back to the field defaults, or leave an existing host's value
+        record = {k: v for k, v in zip(header, values) if v != ""}
+        if "tags" in record:
+            record["tags"] = [t.strip() for t in re.split(r"[;|]", record["tags"]) if t.strip()]
+    if "port" in record:
+        record.setdefault("ssh_port", record.pop("port"))
+    return HostCreate(**record)
+
+def _describe_error(e: Exception) -> str:
+    if isinstance(e, ValidationError):
+        return "; ".join(f"{'.'.join(str(p) for p in err['loc'])}: {err['msg']}" for err in e.errors())
+    return str(e)
+
+def upsert_hosts(hosts: List[HostCreate]) -> Tuple[int, int]:
+    """Insert or update hosts matched by (ip, ssh_port) in one transaction, returns (created, updated)."""
+    by_key: Dict[tuple, HostCreate] = {(h.ip, h.ssh_port): h for h in hosts}  # last row wins
+    db = SessionLocal()
+    try:
+        existing = {}
+        rows = db.query(Host.id, Host.ip, Host.ssh_port) \
+            .filter(tuple_(Host.ip, Host.ssh_port).in_(list(by_key))) \
+            .order_by(Host.id.desc())
+        for host_id, ip, port in rows:
+            existing[(ip, port)] = host_id  # the oldest duplicate wins
+
+        # Only the columns present in the file change: an export has no passwords,
+        # re-importing it must not reset them
+        updates = [{"id": existing[key], **host.dict(exclude_unset=True)} for key, host in by_key.items() if key in existing]
+        created = [host for key, host in by_key.items() if key not in existing]
+        # One executemany per set of columns
+        groups: Dict[tuple, list] = {}
+        for row in updates:
+            groups.setdefault(tuple(sorted(row)), []).append(row)
+        for rows in groups.values():
+            db.execute(update(Host), rows)
+        tags_by_host = {row["id"]: row["tags"] for row in updates if "tags" in row}
+        if created:
+            new_ids = db.scalars(
+                insert(Host).returning(Host.id, sort_by_parameter_order=True),
+                [host.dict() for host in created],
+            ).all()
+            tags_by_host.update((host_id, host.tags) for host_id, host in zip(new_ids, created))
+        set_hosts_tags(db, tags_by_host)
+        db.commit()
+        return len(created), len(updates)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+async def _iter_lines(request: Request):
+    buffer = b""
+    async for chunk in request.stream():
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield line
+    if buffer:
+        yield buffer
+
+@router.post("/bulk", response_model=dict)
+async def import_hosts(request: Request, format: Optional[str] = None):
+    """
+    Import hosts from a CSV (header row required) or JSONL request body,
+    one host per line. Rows are upserted by (ip, ssh_port) in batches, each
+    batch in its own transaction; invalid rows are reported and skipped.
+    Existing hosts only get the columns the row has, so re-importing an
+    export keeps their passwords.
+    """
+    fmt = format or ("csv" if "csv" in request.headers.get("content-type", "") else "jsonl")
+    if fmt not in ("csv", "jsonl"):
+        raise HTTPException(status_code=400, detail="format must be csv or jsonl")
+
+    report = {"created": 0, "updated": 0, "failed": 0, "errors": []}
+
+    def error(line_no: int, message: str, count: int = 1):
+        report["failed"] += count
+        if len(report["errors"]) < config.HOST_IMPORT_MAX_ERRORS:
+            report["errors"].append({"line": line_no, "error": message})
+
+    async def flush(batch: List[Tuple[int, HostCreate]]):
+        try:
+            created, updated = await asyncio.to_thread(upsert_hosts, [host for _, host in batch])
+            report["created"] += created
+            report["updated"] += updated
+        except Exception as e:
+            error(batch[0][0], f"batch of {len(batch)} rows failed: {e}", len(batch))
+
+    header = None
+    batch: List[Tuple[int, HostCreate]] = []
+    line_no = 0
+    async for raw in _iter_lines(request):
+        line_no += 1
+        try:
+            line = raw.decode("utf-8-sig" if line_no == 1 else "utf-8").strip()
+        except UnicodeDecodeError:
+            error(line_no, "not valid UTF-8")
+            continue
+        if not line:
+            continue
+        if fmt == "csv" and header is None:
+            header = [h.strip().lower() for h in next(csv.reader([line]))]
+            continue
+        try:
+            batch.append((line_no, _parse_record(line, header)))
+        except Exception as e:
+            error(line_no, _describe_error(e))
+            continue
+        if len(batch) >= config.HOST_IMPORT_BATCH_SIZE:
+            await flush(batch)
+            batch = []
+    if batch:
+        await flush(batch)
+    return report
+
+@router.get("/bulk")
+def export_hosts(format: str = "jsonl", tags: Optional[str] = None, q: Optional[str] = None, cidr: Optional[str] = None):
+    """Stream the inventory (optionally filtered like GET /hosts/) as CSV or JSONL. Passwords are never exported."""
+    if format not in ("csv", "jsonl"):
+        raise HTTPException(status_code=400, detail="format must be csv or jsonl")
+    db = SessionLocal()
+    try:
+        query, network = build_host_query(db, tags, q, cidr, columns=[getattr(Host, c) for c in EXPORT_COLUMNS])
+    except SelectorError as e:
+        db.close()
+        raise HTTPException(status_code=400, detail=str(e))
+
+    def rows():
+        out = io.StringIO()
+        writer = csv.writer(out)
+        try:
+            if format == "csv":
+                writer.writerow(EXPORT_COLUMNS)
+            for row in iter_hosts(query, network):
+                record = dict(zip(EXPORT_COLUMNS, row))
+                record["auth_type"] = record["auth_type"].value if record["auth_type"] else None
+                if format == "jsonl":
+                    out.write(json.dumps(record) + "\n")
+                else:
+                    record["tags"] = ";".join(record["tags"] or [])
+                    writer.writerow(record.values())
+                # Send in ~64 KiB pieces rather than one write per host
+                if out.tell() >= 65536:
+                    yield out.getvalue()
+                    out.seek(0)
+                    out.truncate()
+            yield out.getvalue()
+        finally:
+            db.close()
+
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    return StreamingResponse(rows(), media_type=media_type, headers={
+        "Content-Disposition": f"attachment; filename=hosts.{format}",
+    })
@@ -0,0 +1,58 @@
+from fastapi import APIRouter
+from ..ssh_pool import ssh_pool
+from ..event_bus import task_event_bus
+from ..status_writer import status_writer
+from ..scheduler import scheduler
+from ..task_registry import task_registry
+from ..job_queue import job_queue
+from ..progress import progress_cache
+from ..retention import retention
+from ..auth import principal_cache
+from ..ssh_manager import ssh_manager
+from ..session_recording import session_recorder
+
+router = APIRouter(prefix="/stats", tags=["stats"])
+
+@router.get("/ssh-pool", response_model=dict)
+def get_ssh_pool_stats():
+    return ssh_pool.stats()
+
+@router.get("/event-bus", response_model=dict)
+def get_event_bus_stats():
+    return task_event_bus.stats()
+
+@router.get("/status-writer", response_model=dict)
+def get_status_writer_stats():
+    return status_writer.stats()
+
+@router.get("/scheduler", response_model=dict)
+def get_scheduler_stats():
+    return scheduler.stats()
+
+@router.get("/tasks", response_model=dict)
+def get_running_tasks():
+    return task_registry.stats()
+
+@router.get("/jobs", response_model=dict)
+def get_job_stats():
+    return job_queue.stats()
+
+@router.get("/progress", response_model=dict)
+def get_progress_cache_stats():
+    return progress_cache.stats()
+
+@router.get("/retention", response_model=dict)
+def get_retention_stats():
+    return retention.stats()
+
+@router.get("/auth", response_model=dict)
+def get_auth_cache_stats():
+    return principal_cache.stats()
+
+@router.get("/terminals", response_model=dict)
+def get_terminal_stats():
+    return ssh_manager.stats()
+
+@router.get("/recordings", response_model=dict)
+def get_recording_stats():
+    return session_recorder.stats()
@@ -1,33 +1,92 @@
-from fastapi import APIRouter, Depends, WebSocket, WebSocketDisconnect, BackgroundTasks, HTTPException
+from fastapi import APIRouter, Depends, WebSocket, WebSocketDisconnect, HTTPException, Query, Response, Header
+from sqlalchemy import func, case, or_, and_, insert, select, literal
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, Optional
 from pydantic import BaseModel
-from ..db import get_db
-from ..models import Task, TaskHost, TaskMode, BatchFailStrategy, TaskHostStatus
-from ..task_runner import run_task, task_event_bus
+from ..db import get_db, get_async_db
+from ..models import Task, TaskHost, Host, TaskMode, TaskType, BatchFailStrategy, TaskHostStatus, JobStatus, JobControl
+from ..file_distribution import load_artifact
+from ..task_runner import task_event_bus, publish_event, cancel_pending_hosts
+from ..task_registry import task_registry
+from ..job_queue import job_queue
+from ..worker import embedded_worker
+from ..task_log import task_log_store
+from ..progress import progress_cache
+from ..retention import retention
+from .hosts import HostSelector
+from .. import config
 import asyncio
+import datetime
+import re
 
 router = APIRouter(prefix="/tasks", tags=["tasks"])
 
+class FileSpec(BaseModel):
+    artifact: str  # sha256 of a file uploaded to /files
+    dest: str  # path on the hosts, relative paths are relative to the user's home
+    file_mode: str = "0644"
+    relay: bool = False  # hosts that have the file copy it on to the next ones
+    fanout: Optional[int] = None  # copies served at once per host in relay mode
+
 class CreateTaskReq(BaseModel):
     name: str
-    command: str
-    host_ids: List[int]
+    command: str = ""
+    task_type: TaskType = TaskType.command
+    file: Optional[FileSpec] = None  # required for file tasks
+    host_ids: List[int] = []
+    selector: Optional[HostSelector] = None  # resolved server-side, added to host_ids
     mode: TaskMode = TaskMode.broadcast
     batch_size: Optional[int] = None
     batch_interval: Optional[int] = None
     on_batch_fail_strategy: Optional[BatchFailStrategy] = None
+    max_failures: Optional[int] = None
+    max_failure_percent: Optional[int] = None
+    concurrency: Optional[int] = None
+    weight: Optional[int] = None
+
+def encode_cursor(created_at: datetime.datetime, task_id: int) -> str:
+    return f"{created_at.isoformat()}_{task_id}"
+
+def decode_cursor(cursor: str):
+    try:
+        created_at, task_id = cursor.rsplit("_", 1)
+        return datetime.datetime.fromisoformat(created_at), int(task_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
 
 @router.get("/", response_model=List[dict])
-def list_tasks(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    tasks = db.query(Task).order_by(Task.created_at.desc()).offset(skip).limit(limit).all()
+def list_tasks(response: Response, cursor: Optional[str] = None, limit: int = Query(100, ge=1, le=500), db: Session = Depends(get_db)):
+    """
+    Newest tasks first. Pass the X-Next-Cursor header of a page as `cursor`
+    to get the next one.
+    """
+    done = TaskHost.status.in_([TaskHostStatus.failed, TaskHostStatus.cancelled])
+    # One grouped query for the whole page, counts come from the (task_id, status) index
+    query = db.query(
+        Task.id, Task.name, Task.command, Task.mode, Task.created_at, Task.host_summary,
+        func.count(TaskHost.id),
+        func.coalesce(func.sum(case((TaskHost.status == TaskHostStatus.success, 1), else_=0)), 0),
+        func.coalesce(func.sum(case((done, 1), else_=0)), 0),
+    ).outerjoin(TaskHost, TaskHost.task_id == Task.id)
+    if cursor:
+        created_at, task_id = decode_cursor(cursor)
+        query = query.filter(or_(
+            Task.created_at < created_at,
+            and_(Task.created_at == created_at, Task.id < task_id),
+        ))
+    rows = query.group_by(Task.id) \
+        .order_by(Task.created_at.desc(), Task.id.desc()) \
+        .limit(limit) \
+        .all()
+
     result = []
-    for t in tasks:
-        total = len(t.task_hosts)
-        success = sum(1 for th in t.task_hosts if th.status == TaskHostStatus.success)
-        failed = sum(1 for th in t.task_hosts if th.status in [TaskHostStatus.failed, TaskHostStatus.cancelled])
-        running = sum(1 for th in t.task_hosts if th.status == TaskHostStatus.running)
-        
+    for task_id, name, command, mode, created_at, summary, total, success, failed in rows:
+        if summary:
+            # Host rows archived by retention
+            total = sum(summary.values())
+            success = summary["success"]
+            failed = summary["failed"] + summary["cancelled"]
         # Calculate progress percentage
         progress = 0
         if total > 0:
@@ -39,41 +98,81 @@ def list_tasks(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
             status = "completed"
             
         result.append({
-            "id": t.id,
-            "name": t.name,
-            "command": t.command,
-            "mode": t.mode,
-            "created_at": t.created_at,
+            "id": task_id,
+            "name": name,
+            "command": command,
+            "mode": mode,
+            "created_at": created_at,
             "host_count": total,
             "success_count": success,
             "failed_count": failed,
             "progress": progress,
             "status": status
         })
+    if len(rows) == limit:
+        response.headers["X-Next-Cursor"] = encode_cursor(rows[-1].created_at, rows[-1].id)
     return result
 
+def validate_file_spec(spec: Optional[FileSpec]) -> dict:
+    if spec is None:
+        raise HTTPException(status_code=400, detail="File tasks need a file spec")
+    if load_artifact(spec.artifact) is None:
+        raise HTTPException(status_code=400, detail=f"Unknown artifact {spec.artifact}")
+    if not spec.dest or spec.dest.endswith("/") or any(c in spec.dest for c in "\0\n\r"):
+        raise HTTPException(status_code=400, detail="dest must be a file path")
+    if not re.match(r"^[0-7]{3,4}$", spec.file_mode):
+        raise HTTPException(status_code=400, detail="file_mode must be octal, e.g. 0644")
+    if spec.fanout is not None and spec.fanout < 1:
+        raise HTTPException(status_code=400, detail="fanout must be at least 1")
+    return spec.model_dump()
+
 @router.post("/", response_model=dict)
-def create_task(req: CreateTaskReq, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
+def create_task(req: CreateTaskReq, db: Session = Depends(get_db)):
+    file_spec = None
+    command = req.command
+    if req.task_type == TaskType.file:
+        file_spec = validate_file_spec(req.file)
+        # Shown in the task list
+        command = f"put {file_spec['artifact'][:12]} -> {file_spec['dest']}"
+    elif not command:
+        raise HTTPException(status_code=400, detail="command is required")
     task = Task(
         name=req.name,
-        command=req.command,
+        command=command,
+        task_type=req.task_type,
+        file_spec=file_spec,
         mode=req.mode,
         batch_size=req.batch_size,
         batch_interval=req.batch_interval,
         on_batch_fail_strategy=req.on_batch_fail_strategy,
+        max_failures=req.max_failures,
+        max_failure_percent=req.max_failure_percent,
+        concurrency=req.concurrency,
+        weight=req.weight,
     )
+    selected = []
+    if req.selector:
+        selected = req.selector.resolve(db)
+        if not selected:
+            raise HTTPException(status_code=400, detail="Selector matched no hosts")
+    host_ids = list(dict.fromkeys(req.host_ids + selected))
+    # Validate every host in one query
+    known = {host_id for (host_id,) in db.query(Host.id).filter(Host.id.in_(host_ids))}
+    missing = [host_id for host_id in host_ids if host_id not in known]
+    if missing:
+        raise HTTPException(status_code=400, detail=f"Unknown host ids: {missing[:20]}")
+
     db.add(task)
-    db.commit()
-    db.refresh(task)
+    db.flush()
 
-    for host_id in req.host_ids:
-        th = TaskHost(task_id=task.id, host_id=host_id)
-        db.add(th)
-    
-    db.commit()
+    # One executemany instead of an ORM object per host
+    if host_ids:
+        db.execute(insert(TaskHost), [{"task_id": task.id, "host_id": host_id} for host_id in host_ids])
 
-    # Trigger async task execution
-    background_tasks.add_task(run_task, task.id)
+    # Queued in the same transaction, a worker picks it up once committed
+    job_queue.enqueue(db, task.id)
+    db.commit()
+    embedded_worker.wake()
 
     return {"task_id": task.id}
 
@@ -83,72 +182,275 @@ def get_task_details(task_id: int, db: Session = Depends(get_db)):
     if not task:
         return {}
     
-    hosts_status = []
-    for th in task.task_hosts:
-        hosts_status.append({
-            "host_id": th.host_id,
-            "status": th.status,
-            "exit_code": th.exit_code,
-            "error": th.error
-        })
+    # Plain rows instead of hydrating task.task_hosts, see /tasks/{id}/hosts for large tasks
+    rows = db.query(TaskHost.host_id, TaskHost.status, TaskHost.exit_code, TaskHost.error) \
+        .filter(TaskHost.task_id == task_id) \
+        .order_by(TaskHost.id) \
+        .all()
+    hosts_status = [
+        {"host_id": host_id, "status": status, "exit_code": exit_code, "error": error}
+        for host_id, status, exit_code, error in rows
+    ]
 
     return {
         "id": task.id,
         "name": task.name,
         "mode": task.mode,
+        "task_type": task.task_type or TaskType.command,
+        "file_spec": task.file_spec,
         "created_at": task.created_at,
+        "archived_at": task.archived_at,
+        "host_summary": task.host_summary,
         "hosts": hosts_status
     }
 
+# Optional columns of /tasks/{id}/hosts, requested with ?fields=
+HOST_FIELDS = {
+    "error": TaskHost.error,
+    "start_time": TaskHost.start_time,
+    "end_time": TaskHost.end_time,
+    "name": Host.name,
+    "ip": Host.ip,
+}
+
+@router.get("/{task_id}/hosts", response_model=dict)
+def list_task_hosts(
+    task_id: int,
+    status: Optional[List[TaskHostStatus]] = Query(None),
+    exit_code: Optional[int] = None,
+    fields: Optional[List[str]] = Query(None),
+    after: Optional[int] = None,
+    limit: int = Query(500, ge=1, le=5000),
+    db: Session = Depends(get_db),
+):
+    """
+    Hosts of a task ordered by TaskHost id. Pass `next_after` of a page as
+    `after` to get the next one. Only id, host_id, status and exit_code are
+    returned unless more columns are listed in `fields`.
+    """
+    fields = fields or []
+    unknown = [f for f in fields if f not in HOST_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    task = db.query(Task.id, Task.archived_at).filter(Task.id == task_id).first()
+    if task is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+
+    columns = [TaskHost.id, TaskHost.host_id, TaskHost.status, TaskHost.exit_code] + [HOST_FIELDS[f] for f in fields]
+    query = db.query(*columns).filter(TaskHost.task_id == task_id)
+    if "name" in fields or "ip" in fields:
+        query = query.join(Host, Host.id == TaskHost.host_id)
+    if status:
+        query = query.filter(TaskHost.status.in_(status))
+    if exit_code is not None:
+        query = query.filter(TaskHost.exit_code == exit_code)
+    if after is not None:
+        query = query.filter(TaskHost.id > after)
+    rows = query.order_by(TaskHost.id).limit(limit).all()
+
+    keys = ["id", "host_id", "status", "exit_code"] + fields
+    items = [dict(zip(keys, row)) for row in rows]
+    return {
+        "items": items,
+        "next_after": rows[-1][0] if len(rows) == limit else None,
+        "archived": task.archived_at is not None,
+    }
+
+@router.get("/{task_id}/progress", response_model=dict)
+async def get_task_progress(
+    task_id: int,
+    response: Response,
+    wait: float = Query(0, ge=0),
+    if_none_match: Optional[str] = Header(None),
+):
+    """
+    Host counts of a task. With If-None-Match set to the last ETag and wait > 0
+    the request is held until the counts change or `wait` seconds pass (304).
+    """
+    entry = await progress_cache.get(task_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+    if wait and if_none_match == entry.etag:
+        entry = await progress_cache.wait(task_id, if_none_match, min(wait, config.PROGRESS_MAX_WAIT))
+        if entry is None:
+            raise HTTPException(status_code=404, detail="Task not found")
+    if if_none_match == entry.etag:
+        return Response(status_code=304, headers={"ETag": entry.etag})
+    response.headers["ETag"] = entry.etag
+    response.headers["Cache-Control"] = "no-cache"
+    return entry.snapshot()
+
 @router.post("/{task_id}/run", response_model=dict)
-def run_task_again(task_id: int, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
+def run_task_again(task_id: int, failed_only: bool = False, db: Session = Depends(get_db)):
     task = db.query(Task).filter(Task.id == task_id).first()
     if not task:
         raise HTTPException(status_code=404, detail="Task not found")
     
     # Create a new task based on the old one
     new_task = Task(
-        name=f"{task.name} (Rerun)",
+        name=f"{task.name} (Rerun failed)" if failed_only else f"{task.name} (Rerun)",
         command=task.command,
+        task_type=task.task_type,
+        file_spec=task.file_spec,
         mode=task.mode,
         batch_size=task.batch_size,
         batch_interval=task.batch_interval,
         on_batch_fail_strategy=task.on_batch_fail_strategy,
+        max_failures=task.max_failures,
+        max_failure_percent=task.max_failure_percent,
+        concurrency=task.concurrency,
+        weight=task.weight,
     )
     db.add(new_task)
-    db.commit()
-    db.refresh(new_task)
+    db.flush()
 
-    # Copy hosts
-    for th in task.task_hosts:
-        new_th = TaskHost(task_id=new_task.id, host_id=th.host_id)
-        db.add(new_th)
-    
-    db.commit()
+    if task.archived_at is None:
+        # Copy hosts with a single INSERT ... SELECT
+        source = select(literal(new_task.id), TaskHost.host_id) \
+            .where(TaskHost.task_id == task_id) \
+            .order_by(TaskHost.id)
+        if failed_only:
+            source = source.where(TaskHost.status == TaskHostStatus.failed)
+        copied = db.execute(insert(TaskHost).from_select(["task_id", "host_id"], source)).rowcount
+    else:
+        # Host rows were moved to the archive, skip hosts deleted since
+        archived = [
+            row["host_id"] for row in retention.read_archive(task.id, task.created_at)
+            if not failed_only or row["status"] == TaskHostStatus.failed.value
+        ]
+        known = {host_id for (host_id,) in db.query(Host.id).filter(Host.id.in_(archived))}
+        host_ids = [host_id for host_id in dict.fromkeys(archived) if host_id in known]
+        if host_ids:
+            db.execute(insert(TaskHost), [{"task_id": new_task.id, "host_id": host_id} for host_id in host_ids])
+        copied = len(host_ids)
+    if failed_only and not copied:
+        db.rollback()
+        raise HTTPException(status_code=400, detail="Task has no failed hosts")
 
-    # Trigger async task execution
-    background_tasks.add_task(run_task, new_task.id)
+    job_queue.enqueue(db, new_task.id)
+    db.commit()
+    embedded_worker.wake()
 
     return {"task_id": new_task.id}
 
+async def require_task(db: AsyncSession, task_id: int):
+    if await db.scalar(select(Task.id).where(Task.id == task_id)) is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+
+@router.post("/{task_id}/cancel", response_model=dict)
+async def cancel_task(task_id: int, db: AsyncSession = Depends(get_async_db)):
+    await require_task(db, task_id)
+    job_status, _ = await asyncio.to_thread(job_queue.request_control, task_id, JobControl.cancel)
+    if task_registry.cancel(task_id) or job_status == JobStatus.running:
+        # Running here, or on another worker which applies it at its next heartbeat
+        return {"task_id": task_id, "status": "cancelling"}
+    # Not running (still queued or already finished): cancel hosts that never ran
+    await cancel_pending_hosts(task_id)
+    return {"task_id": task_id, "status": "cancelled"}
+
+async def request_pause_or_resume(task_id: int, control: Optional[JobControl]) -> Optional[JobStatus]:
+    job_status, job_control = await asyncio.to_thread(job_queue.request_control, task_id, control)
+    local = task_registry.get(task_id)
+    cancelling = job_status in (JobStatus.queued, JobStatus.running) and job_control == JobControl.cancel
+    if cancelling or (local is not None and local.cancelled):
+        raise HTTPException(status_code=409, detail="Task is being cancelled")
+    return job_status
+
+@router.post("/{task_id}/pause", response_model=dict)
+async def pause_task(task_id: int, db: AsyncSession = Depends(get_async_db)):
+    await require_task(db, task_id)
+    job_status = await request_pause_or_resume(task_id, JobControl.pause)
+    if task_registry.pause(task_id):
+        await publish_event({
+            "task_id": task_id,
+            "status": "paused",
+            "line": "--- Task paused, running hosts will finish ---"
+        })
+    elif job_status not in (JobStatus.queued, JobStatus.running):
+        raise HTTPException(status_code=409, detail="Task is not running")
+    return {"task_id": task_id, "status": "paused"}
+
+@router.post("/{task_id}/resume", response_model=dict)
+async def resume_task(task_id: int, db: AsyncSession = Depends(get_async_db)):
+    await require_task(db, task_id)
+    job_status = await request_pause_or_resume(task_id, None)
+    if task_registry.resume(task_id):
+        await publish_event({
+            "task_id": task_id,
+            "status": "running",
+            "line": "--- Task resumed ---"
+        })
+    elif job_status not in (JobStatus.queued, JobStatus.running):
+        raise HTTPException(status_code=409, detail="Task is not running")
+    return {"task_id": task_id, "status": "running"}
+
 @router.websocket("/{task_id}/stream")
-async def task_stream(websocket: WebSocket, task_id: int):
+async def task_stream(websocket: WebSocket, task_id: int, since: Optional[int] = None):
+    """
+    Live task events. With `since`, events with a greater seq are replayed
+    from the task log first, then the stream switches to live output.
+    """
     await websocket.accept()
-    
-    async def log_handler(msg: dict):
-        if str(msg.get("task_id")) == str(task_id):
-            try:
-                await websocket.send_json(msg)
-            except:
-                pass
-
-    task_event_bus.subscribe(log_handler)
-    
-    try:
+
+    # Subscribe before replaying so nothing published in between is missed
+    sub = task_event_bus.subscribe(task_id)
+    last_seq = since
+
+    async def send_history(upto: Optional[int] = None):
+        nonlocal last_seq
         while True:
-            # Keep connection open
-            await websocket.receive_text()
-    except WebSocketDisconnect:
-        pass
+            events = await task_log_store.read(task_id, last_seq)
+            for e in events:
+                if upto is not None and e["seq"] > upto:
+                    return
+                await websocket.send_json(e)
+                last_seq = e["seq"]
+            if len(events) < config.TASK_LOG_REPLAY_PAGE:
+                return
+
+    async def fill_gap(upto: int):
+        # Events from another worker (or dropped for a slow consumer) may reach
+        # the log a flush interval after we notice the gap
+        for _ in range(10):
+            await send_history(upto)
+            if last_seq >= upto:
+                return
+            await asyncio.sleep(config.TASK_LOG_FLUSH_INTERVAL)
+
+    async def forward_events():
+        nonlocal last_seq
+        if since is not None:
+            await send_history()
+        # Each connection drains its own queue, a slow socket only delays itself
+        while True:
+            msg = await sub.get()
+            seq = msg.get("seq")
+            if "dropped" in msg and last_seq is not None:
+                # Missing events are refilled from the task log on the next message
+                continue
+            if seq is not None:
+                if last_seq is None:
+                    last_seq = seq - 1
+                if seq <= last_seq:
+                    continue
+                if seq > last_seq + 1:
+                    await fill_gap(seq - 1)
+                last_seq = seq
+            await websocket.send_json(msg)
+
+    async def keep_alive():
+        try:
+            while True:
+                # Keep connection open
+                await websocket.receive_text()
+        except WebSocketDisconnect:
+            pass
+
+    sender = asyncio.create_task(forward_events())
+    receiver = asyncio.create_task(keep_alive())
+    try:
+        await asyncio.wait([sender, receiver], return_when=asyncio.FIRST_COMPLETED)
     finally:
-        task_event_bus.unsubscribe(log_handler)
+        sender.cancel()
+        receiver.cancel()
+        task_event_bus.unsubscribe(sub)
@@ -1,13 +1,42 @@
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Query, Depends
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, WebSocket, WebSocketDisconnect, Query
+from fastapi.responses import StreamingResponse
+from typing import List, Optional
+from ..auth import get_current_admin_user
 from ..ssh_manager import ssh_manager
-from ..db import get_db
+from ..session_recording import session_recorder
+from ..db import AsyncSessionLocal
 from ..models import Host
+from ..terminal_stream import TerminalOutputPump
 import asyncio
 import json
 
 router = APIRouter(prefix="/terminal", tags=["terminal"])
 
+@router.get("/recordings", response_model=List[dict], dependencies=[Depends(get_current_admin_user)])
+async def list_recordings(host_id: Optional[int] = None, limit: int = Query(100, ge=1, le=1000)):
+    return await asyncio.to_thread(session_recorder.list, host_id, limit)
+
+@router.get("/recordings/{recording_id}", response_model=dict, dependencies=[Depends(get_current_admin_user)])
+async def get_recording(recording_id: str):
+    index = await asyncio.to_thread(session_recorder.load_index, recording_id)
+    if index is None:
+        raise HTTPException(status_code=404, detail="Recording not found")
+    return index
+
+@router.get("/recordings/{recording_id}/cast", dependencies=[Depends(get_current_admin_user)])
+async def replay_recording(
+    recording_id: str,
+    start: float = Query(0, ge=0),  # seconds into the recording
+    duration: Optional[float] = Query(None, gt=0),
+):
+    """The recording as one asciicast v2 file, from `start` on; playable by asciinema."""
+    index = await asyncio.to_thread(session_recorder.load_index, recording_id)
+    if index is None:
+        raise HTTPException(status_code=404, detail="Recording not found")
+    return StreamingResponse(session_recorder.replay(index, start, duration), media_type="application/x-asciicast", headers={
+        "Content-Disposition": f"attachment; filename={recording_id}.cast",
+    })
+
 @router.websocket("/ws")
 async def terminal_ws(
     websocket: WebSocket,
@@ -15,56 +44,64 @@ async def terminal_ws(
     session_id: str = Query(...),
     cols: int = Query(80),
     rows: int = Query(24),
-    db: Session = Depends(get_db) # Note: Depends in websocket works in newer FastAPI
+    mode: str = Query("text", pattern="^(text|binary)$"),
 ):
+    # binary: raw terminal bytes in binary frames, no decoding on the server.
+    # Reattaching to an existing session keeps the mode it was created with.
     await websocket.accept()
-    
-    # In WebSocket, Depends might not work exactly as in HTTP endpoints for session management depending on version/setup
-    # Re-creating session manually if needed or trusting Depends
-    
+    session = queue = None
+    close = False
+
     try:
-        host = db.query(Host).filter(Host.id == host_id).first()
+        # Short-lived async session: nothing is held open for the lifetime of the terminal
+        async with AsyncSessionLocal() as db:
+            host = await db.get(Host, host_id)
         if not host:
             await websocket.close(code=1008, reason="Host not found")
             return
 
-        conn, process = await ssh_manager.create_session(session_id, host, cols=cols, rows=rows)
+        session = await ssh_manager.create_session(
+            session_id, host, cols=cols, rows=rows, encoding=None if mode == "binary" else "utf-8"
+        )
+        if session.host_id != host_id:
+            session = None
+            await websocket.close(code=1008, reason="Session belongs to another host")
+            return
+        session.resize(cols, rows)
+        send = websocket.send_bytes if session.binary else websocket.send_text
+        scrollback, queue = session.attach()
+        if scrollback:
+            # Catch a reconnecting client up before live output
+            await send(scrollback)
 
         async def ws_to_ssh():
+            """Returns True when the client ends the session instead of just disconnecting."""
             try:
                 while True:
                     data = await websocket.receive_text()
-                    # Check for resize event (custom protocol or just raw data)
-                    # For xterm.js default, it sends raw text. 
-                    # If we want resize, we usually send JSON or specific prefix.
-                    # Here we assume raw text for shell input.
-                    # To support resize, we could try to parse JSON if it looks like one, or use a separate endpoint.
-                    # For simplicity, let's check if it starts with '{'
+                    # Control messages are JSON, anything else is shell input
                     if data.startswith('{'):
                         try:
                             msg = json.loads(data)
                             if msg.get('type') == 'resize':
-                                await ssh_manager.resize(session_id, msg['cols'], msg['rows'])
+                                session.resize(msg['cols'], msg['rows'])
                                 continue
+                            if msg.get('type') == 'close':
+                                return True
                         except:
                             pass
-                    
-                    await ssh_manager.write(session_id, data)
+
+                    session.write(data.encode("utf-8") if session.binary else data)
             except WebSocketDisconnect:
                 pass
             except Exception as e:
                 print(f"ws_to_ssh error: {e}")
+            return False
 
         async def ssh_to_ws():
             try:
-                while True:
-                    # asyncssh process.stdout is an SSHReader
-                    chunk = await process.stdout.read(1024)
-                    if not chunk:
-                        break
-                    # Ensure chunk is string if xterm expects string
-                    # asyncssh default encoding is utf-8, returns str
-                    await websocket.send_text(chunk)
+                # Coalesced frames, the session stops reading SSH while the socket is backed up
+                await TerminalOutputPump(queue, send).run()
             except Exception as e:
                 print(f"ssh_to_ws error: {e}")
 
@@ -75,14 +112,18 @@ async def terminal_ws(
         
         for task in pending:
             task.cancel()
+        close = task1 in done and task1.result()
 
     except Exception as e:
         print(f"Terminal error: {e}")
         await websocket.close(code=1011, reason=str(e))
     finally:
-        await ssh_manager.close_session(session_id)
-        # Check if websocket is still open before closing?
-        # It might be closed by WebSocketDisconnect
+        if session is not None:
+            if close or session.closed:
+                await ssh_manager.close_session(session_id)
+            else:
+                # Keep the shell for a reconnecting client until the reaper expires it
+                session.detach(queue)
         try:
             await websocket.close()
         except:
@@ -4,7 +4,7 @@ from typing import List
 from pydantic import BaseModel
 from ..db import get_db
 from ..models import User
-from ..auth import get_current_admin_user, get_password_hash
+from ..auth import Principal, get_current_admin_user, get_password_hash, principal_cache
 
 router = APIRouter(prefix="/users", tags=["users"])
 
@@ -23,11 +23,11 @@ class UserRead(UserBase):
         from_attributes = True
 
 @router.get("/", response_model=List[UserRead])
-def get_users(db: Session = Depends(get_db), current_user: User = Depends(get_current_admin_user)):
+def get_users(db: Session = Depends(get_db), current_user: Principal = Depends(get_current_admin_user)):
     return db.query(User).all()
 
 @router.post("/", response_model=UserRead)
-def create_user(user: UserCreate, db: Session = Depends(get_db), current_user: User = Depends(get_current_admin_user)):
+def create_user(user: UserCreate, db: Session = Depends(get_db), current_user: Principal = Depends(get_current_admin_user)):
     db_user = db.query(User).filter(User.username == user.username).first()
     if db_user:
         raise HTTPException(status_code=400, detail="Username already registered")
@@ -41,8 +41,24 @@ def create_user(user: UserCreate, db: Session = Depends(get_db), current_user: U
     db.add(new_user)
     db.commit()
     db.refresh(new_user)
+    principal_cache.invalidate(new_user.username)
     return new_user
 
+@router.post("/{user_id}/deactivate", response_model=UserRead)
+def deactivate_user(user_id: int, db: Session = Depends(get_db), current_user: Principal = Depends(get_current_admin_user)):
+    if user_id == current_user.id:
+        raise HTTPException(status_code=400, detail="Cannot deactivate yourself")
+    user = db.query(User).get(user_id)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    user.is_active = 0
+    # Revokes every token issued so far, in all processes once their cache entry expires
+    user.token_version = ((user.token_version or 0) + 1) % 2**31
+    db.commit()
+    db.refresh(user)
+    principal_cache.invalidate(user.username)
+    return user
+
 @router.delete("/{user_id}")
 def delete_user(user_id: int, db: Session = Depends(get_db)):
     # current_user: User = Depends(get_current_admin_user)
@@ -55,4 +71,5 @@ def delete_user(user_id: int, db: Session = Depends(get_db)):
         
     db.delete(user)
     db.commit()
+    principal_cache.invalidate(user.username)
     return {"msg": "User deleted"}
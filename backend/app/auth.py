@@ -1,12 +1,15 @@
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
-from .db import get_db
+from sqlalchemy import select
+from .db import AsyncSessionLocal
 from .models import User
+from . import config
 
 # Secret key for JWT (Change this in production!)
 SECRET_KEY = "ops-platform-secret-key-change-me"
@@ -32,7 +35,74 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+class Principal:
+    """The fields of a User that request handlers need, safe to keep across sessions."""
+
+    def __init__(self, id: int, username: str, is_active: bool, is_admin: bool):
+        self.id = id
+        self.username = username
+        self.is_active = is_active
+        self.is_admin = is_admin
+
+class PrincipalCache:
+    """
+    Users verified against the database, keyed by (username, user id, token
+    version) so that a token is only trusted as long as the user it was issued
+    to still has that version. Bumping `User.token_version` revokes every
+    earlier token; other processes notice within the TTL.
+    """
+
+    def __init__(self, ttl: float = config.AUTH_CACHE_TTL, max_entries: int = config.AUTH_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries: OrderedDict = OrderedDict()  # (username, uid, token version) -> (Principal, expires at)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key) -> Optional[Principal]:
+        entry = self.entries.get(key)
+        if entry is None or entry[1] < time.monotonic():
+            self.entries.pop(key, None)
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, key, principal: Principal):
+        self.entries[key] = (principal, time.monotonic() + self.ttl)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, username: str):
+        for key in [k for k in self.entries if k[0] == username]:
+            del self.entries[key]
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "ttl": self.ttl,
+        }
+
+principal_cache = PrincipalCache()
+
+async def _load_principal(username: str, user_id: Optional[int], version: int) -> Optional[Principal]:
+    async with AsyncSessionLocal() as db:
+        row = (await db.execute(
+            select(User.id, User.username, User.is_active, User.is_admin, User.token_version)
+            .where(User.username == username)
+        )).first()
+    if row is None or (row.token_version or 0) != version:
+        return None
+    # Tokens issued before the uid claim existed only carry the username
+    if user_id is not None and row.id != user_id:
+        return None
+    return Principal(row.id, row.username, bool(row.is_active), bool(row.is_admin))
+
+async def get_current_user(token: str = Depends(oauth2_scheme)) -> Principal:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -45,18 +115,22 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
             raise credentials_exception
     except JWTError:
         raise credentials_exception
-    
-    user = db.query(User).filter(User.username == username).first()
-    if user is None:
-        raise credentials_exception
-    return user
 
-async def get_current_active_user(current_user: User = Depends(get_current_user)):
+    key = (username, payload.get("uid"), payload.get("ver", 0))
+    principal = principal_cache.get(key)
+    if principal is None:
+        principal = await _load_principal(*key)
+        if principal is None:
+            raise credentials_exception
+        principal_cache.put(key, principal)
+    return principal
+
+async def get_current_active_user(current_user: Principal = Depends(get_current_user)):
     if not current_user.is_active:
         raise HTTPException(status_code=400, detail="Inactive user")
     return current_user
 
-async def get_current_admin_user(current_user: User = Depends(get_current_active_user)):
+async def get_current_admin_user(current_user: Principal = Depends(get_current_active_user)):
     if not current_user.is_admin:
         raise HTTPException(status_code=403, detail="Not authorized")
     return current_user
@@ -0,0 +1,138 @@
+import os
+
+# Runtime settings, overridable via environment variables
+
+def _env_int(name: str, default: int) -> int:
+    return int(os.getenv(name, default))
+
+def _env_float(name: str, default: float) -> float:
+    return float(os.getenv(name, default))
+
+def _env_limits(name: str) -> dict:
+    # "prod:50,db:2" -> {"prod": 50, "db": 2}
+    limits = {}
+    for item in os.getenv(name, "").split(","):
+        if ":" in item:
+            key, value = item.rsplit(":", 1)
+            limits[key.strip()] = int(value)
+    return limits
+
+# SSH connection pool
+SSH_POOL_MAX_PER_HOST = _env_int("OPS_SSH_POOL_MAX_PER_HOST", 4)
+SSH_POOL_MAX_CHANNELS = _env_int("OPS_SSH_POOL_MAX_CHANNELS", 8)  # OpenSSH MaxSessions defaults to 10
+SSH_POOL_MAX_TOTAL = _env_int("OPS_SSH_POOL_MAX_TOTAL", 2000)
+SSH_POOL_IDLE_TTL = _env_float("OPS_SSH_POOL_IDLE_TTL", 300)  # seconds
+SSH_POOL_KEEPALIVE = _env_float("OPS_SSH_POOL_KEEPALIVE", 30)  # seconds
+SSH_CONNECT_TIMEOUT = _env_float("OPS_SSH_CONNECT_TIMEOUT", 10)  # seconds for TCP connect + handshake + auth
+
+# Task output streaming
+TASK_OUTPUT_STREAMING = os.getenv("OPS_TASK_OUTPUT_STREAMING", "1") != "0"
+TASK_OUTPUT_READ_SIZE = _env_int("OPS_TASK_OUTPUT_READ_SIZE", 8192)
+TASK_OUTPUT_CHUNK_SIZE = _env_int("OPS_TASK_OUTPUT_CHUNK_SIZE", 16384)  # max size of one published event
+TASK_OUTPUT_MAX_BYTES = _env_int("OPS_TASK_OUTPUT_MAX_BYTES", 1024 * 1024)  # per host
+
+# Interactive terminals
+TERMINAL_READ_MIN = _env_int("OPS_TERMINAL_READ_MIN", 4096)  # bytes, read size grows while SSH keeps filling it
+TERMINAL_READ_MAX = _env_int("OPS_TERMINAL_READ_MAX", 65536)
+TERMINAL_FLUSH_INTERVAL = _env_float("OPS_TERMINAL_FLUSH_INTERVAL", 0.005)  # seconds output is coalesced into one frame
+TERMINAL_FLUSH_BYTES = _env_int("OPS_TERMINAL_FLUSH_BYTES", 65536)  # frame size that flushes right away
+TERMINAL_QUEUE_CHUNKS = _env_int("OPS_TERMINAL_QUEUE_CHUNKS", 32)  # reads buffered before SSH reading pauses
+TERMINAL_SCROLLBACK_BYTES = _env_int("OPS_TERMINAL_SCROLLBACK_BYTES", 256 * 1024)  # replayed on reattach, per session
+TERMINAL_DETACH_GRACE = _env_float("OPS_TERMINAL_DETACH_GRACE", 300)  # seconds a session survives without a client
+TERMINAL_MAX_DETACHED = _env_int("OPS_TERMINAL_MAX_DETACHED", 50)  # oldest detached sessions are closed beyond this
+TERMINAL_DETACHED_MAX_BYTES = _env_int("OPS_TERMINAL_DETACHED_MAX_BYTES", 32 * 1024 * 1024)  # scrollback of all detached sessions
+TERMINAL_REAP_INTERVAL = _env_float("OPS_TERMINAL_REAP_INTERVAL", 10)
+TERMINAL_OPEN_TIMEOUT = _env_float("OPS_TERMINAL_OPEN_TIMEOUT", 20)  # seconds to get a pool slot, connect and open the shell
+
+# Terminal session recording (asciicast v2, gzip segments)
+TERMINAL_RECORDING = os.getenv("OPS_TERMINAL_RECORDING", "1") != "0"
+TERMINAL_RECORDING_INPUT = os.getenv("OPS_TERMINAL_RECORDING_INPUT", "1") != "0"  # keystrokes too, not just output
+TERMINAL_RECORDING_DIR = os.getenv("OPS_TERMINAL_RECORDING_DIR", "./terminal_recordings")
+TERMINAL_RECORDING_FLUSH_INTERVAL = _env_float("OPS_TERMINAL_RECORDING_FLUSH_INTERVAL", 1.0)  # seconds
+TERMINAL_RECORDING_SEGMENT_SECONDS = _env_float("OPS_TERMINAL_RECORDING_SEGMENT_SECONDS", 300)  # seek granularity
+TERMINAL_RECORDING_SEGMENT_BYTES = _env_int("OPS_TERMINAL_RECORDING_SEGMENT_BYTES", 1024 * 1024)  # uncompressed
+TERMINAL_RECORDING_KEYFRAME_BYTES = _env_int("OPS_TERMINAL_RECORDING_KEYFRAME_BYTES", 16 * 1024)  # screen redraw per segment
+TERMINAL_RECORDING_MAX_PENDING = _env_int("OPS_TERMINAL_RECORDING_MAX_PENDING", 8 * 1024 * 1024)  # buffered bytes before events are dropped
+TERMINAL_RECORDING_RETENTION_DAYS = _env_float("OPS_TERMINAL_RECORDING_RETENTION_DAYS", 90)
+
+# File distribution tasks
+FILE_STORE_DIR = os.getenv("OPS_FILE_STORE_DIR", "./file_store")  # uploaded artifacts, named by sha256
+FILE_SFTP_BLOCK_SIZE = _env_int("OPS_FILE_SFTP_BLOCK_SIZE", 256 * 1024)  # bytes per SFTP write request
+FILE_SFTP_MAX_REQUESTS = _env_int("OPS_FILE_SFTP_MAX_REQUESTS", 64)  # write requests in flight per upload
+FILE_RELAY_FANOUT = _env_int("OPS_FILE_RELAY_FANOUT", 4)  # copies a host serves at once in relay mode
+FILE_RELAY_TIMEOUT = _env_float("OPS_FILE_RELAY_TIMEOUT", 1800)  # seconds for one host-to-host copy
+FILE_RELAY_MAX_FAILURES = _env_int("OPS_FILE_RELAY_MAX_FAILURES", 3)  # failed copies before a host stops relaying
+
+# Task event bus
+EVENT_BUS_QUEUE_SIZE = _env_int("OPS_EVENT_BUS_QUEUE_SIZE", 1000)  # per subscriber
+EVENT_BUS_BACKEND = os.getenv("OPS_EVENT_BUS_BACKEND", "memory")  # memory | sqlite
+EVENT_BUS_SQLITE_PATH = os.getenv("OPS_EVENT_BUS_SQLITE_PATH", "./ops_events.db")
+EVENT_BUS_FLUSH_INTERVAL = _env_float("OPS_EVENT_BUS_FLUSH_INTERVAL", 0.02)  # seconds
+EVENT_BUS_POLL_INTERVAL = _env_float("OPS_EVENT_BUS_POLL_INTERVAL", 0.05)  # seconds
+EVENT_BUS_BATCH_SIZE = _env_int("OPS_EVENT_BUS_BATCH_SIZE", 500)  # messages per row
+EVENT_BUS_RING_SIZE = _env_int("OPS_EVENT_BUS_RING_SIZE", 10000)  # rows kept
+
+# Task log persistence / replay
+TASK_LOG_DIR = os.getenv("OPS_TASK_LOG_DIR", "./task_logs")
+TASK_LOG_SEGMENT_BYTES = _env_int("OPS_TASK_LOG_SEGMENT_BYTES", 4 * 1024 * 1024)
+TASK_LOG_FLUSH_INTERVAL = _env_float("OPS_TASK_LOG_FLUSH_INTERVAL", 0.2)  # seconds
+TASK_LOG_RETENTION_DAYS = _env_float("OPS_TASK_LOG_RETENTION_DAYS", 14)
+TASK_LOG_REPLAY_PAGE = _env_int("OPS_TASK_LOG_REPLAY_PAGE", 2000)  # events per read
+
+# Batched TaskHost status writes
+STATUS_WRITER_FLUSH_INTERVAL = _env_float("OPS_STATUS_WRITER_FLUSH_INTERVAL", 0.5)  # seconds
+STATUS_WRITER_BATCH_SIZE = _env_int("OPS_STATUS_WRITER_BATCH_SIZE", 500)  # rows per transaction
+STATUS_WRITER_RETRIES = _env_int("OPS_STATUS_WRITER_RETRIES", 5)  # failed batch retries before writing row by row
+STATUS_WRITER_RETRY_DELAY = _env_float("OPS_STATUS_WRITER_RETRY_DELAY", 0.2)  # seconds, doubled per retry
+
+# Execution scheduler
+TASK_DEFAULT_CONCURRENCY = _env_int("OPS_TASK_DEFAULT_CONCURRENCY", 5)
+SCHEDULER_MAX_IN_FLIGHT = _env_int("OPS_SCHEDULER_MAX_IN_FLIGHT", 200)  # fleet-wide
+SCHEDULER_PER_HOST_LIMIT = _env_int("OPS_SCHEDULER_PER_HOST_LIMIT", 1)
+SCHEDULER_TAG_LIMITS = _env_limits("OPS_SCHEDULER_TAG_LIMITS")  # e.g. "db:2,prod:50"
+
+# Job queue / workers
+EMBEDDED_WORKER = os.getenv("OPS_EMBEDDED_WORKER", "1") != "0"  # run jobs inside the API process too
+WORKER_MAX_JOBS = _env_int("OPS_WORKER_MAX_JOBS", 10)  # tasks run concurrently by one worker
+WORKER_POLL_INTERVAL = _env_float("OPS_WORKER_POLL_INTERVAL", 1.0)  # seconds
+WORKER_HEARTBEAT_INTERVAL = _env_float("OPS_WORKER_HEARTBEAT_INTERVAL", 3.0)  # seconds
+JOB_LEASE_SECONDS = _env_float("OPS_JOB_LEASE_SECONDS", 30)
+JOB_MAX_ATTEMPTS = _env_int("OPS_JOB_MAX_ATTEMPTS", 3)
+
+# Task progress cache
+PROGRESS_REFRESH_INTERVAL = _env_float("OPS_PROGRESS_REFRESH_INTERVAL", 1.0)  # seconds, tasks not run by this process
+PROGRESS_MAX_WAIT = _env_float("OPS_PROGRESS_MAX_WAIT", 60)  # seconds, long-poll cap
+PROGRESS_CACHE_SIZE = _env_int("OPS_PROGRESS_CACHE_SIZE", 1000)  # tasks kept
+
+# Bulk host import
+HOST_IMPORT_BATCH_SIZE = _env_int("OPS_HOST_IMPORT_BATCH_SIZE", 500)  # rows per transaction
+HOST_IMPORT_MAX_ERRORS = _env_int("OPS_HOST_IMPORT_MAX_ERRORS", 100)  # row errors listed in the report
+
+# Database
+DATABASE_URL = os.getenv("OPS_DATABASE_URL", "sqlite:///./ops_platform.db")
+DB_POOL_SIZE = _env_int("OPS_DB_POOL_SIZE", 10)
+DB_MAX_OVERFLOW = _env_int("OPS_DB_MAX_OVERFLOW", 20)
+DB_POOL_TIMEOUT = _env_float("OPS_DB_POOL_TIMEOUT", 30)  # seconds waiting for a free connection
+DB_POOL_RECYCLE = _env_int("OPS_DB_POOL_RECYCLE", 1800)  # seconds, external databases only
+SQLITE_JOURNAL_MODE = os.getenv("OPS_SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("OPS_SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_BUSY_TIMEOUT_MS = _env_int("OPS_SQLITE_BUSY_TIMEOUT_MS", 5000)
+SQLITE_MMAP_SIZE = _env_int("OPS_SQLITE_MMAP_SIZE", 256 * 1024 * 1024)  # bytes
+SQLITE_CACHE_SIZE = _env_int("OPS_SQLITE_CACHE_SIZE", -64 * 1024)  # negative: KiB, positive: pages
+SQLITE_AUTO_VACUUM = os.getenv("OPS_SQLITE_AUTO_VACUUM", "INCREMENTAL")  # applies to new databases only
+ASYNC_DATABASE_URL = os.getenv("OPS_ASYNC_DATABASE_URL", "")  # derived from DATABASE_URL when empty
+
+# Task history retention
+RETENTION_ENABLED = os.getenv("OPS_RETENTION_ENABLED", "1") != "0"  # runs inside workers
+RETENTION_MAX_AGE_DAYS = _env_float("OPS_RETENTION_MAX_AGE_DAYS", 30)  # host rows of older tasks are archived
+RETENTION_KEEP_TASKS = _env_int("OPS_RETENTION_KEEP_TASKS", 1000)  # newest tasks always keep their host rows
+RETENTION_ARCHIVE_DIR = os.getenv("OPS_RETENTION_ARCHIVE_DIR", "./task_archive")
+RETENTION_INTERVAL = _env_float("OPS_RETENTION_INTERVAL", 3600)  # seconds between runs
+RETENTION_TASKS_PER_RUN = _env_int("OPS_RETENTION_TASKS_PER_RUN", 100)
+RETENTION_CHUNK_ROWS = _env_int("OPS_RETENTION_CHUNK_ROWS", 2000)  # rows deleted per transaction
+RETENTION_CHUNK_PAUSE = _env_float("OPS_RETENTION_CHUNK_PAUSE", 0.05)  # seconds between chunks
+RETENTION_VACUUM_PAGES = _env_int("OPS_RETENTION_VACUUM_PAGES", 2000)  # freed pages returned per step
+
+# Auth
+AUTH_CACHE_TTL = _env_float("OPS_AUTH_CACHE_TTL", 30)  # seconds a verified user is trusted without a DB lookup
+AUTH_CACHE_SIZE = _env_int("OPS_AUTH_CACHE_SIZE", 10000)
@@ -1,11 +1,59 @@
-from sqlalchemy import create_engine
+from sqlalchemy import Enum, create_engine, event, inspect, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.pool import StaticPool
+from sqlalchemy.types import SchemaType
+from . import config
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./ops_platform.db"
+SQLALCHEMY_DATABASE_URL = config.DATABASE_URL
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
-)
+def _is_sqlite(url: str) -> bool:
+    return make_url(url).get_backend_name() == "sqlite"
+
+def _sqlite_pragmas(dbapi_conn, connection_record):
+    # Applied to every new connection: WAL lets readers proceed while the runner writes
+    cursor = dbapi_conn.cursor()
+    # Only takes effect on a new database, and must precede the switch to WAL
+    cursor.execute(f"PRAGMA auto_vacuum={config.SQLITE_AUTO_VACUUM}")
+    cursor.execute(f"PRAGMA journal_mode={config.SQLITE_JOURNAL_MODE}")
+    cursor.execute(f"PRAGMA synchronous={config.SQLITE_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA busy_timeout={config.SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute(f"PRAGMA mmap_size={config.SQLITE_MMAP_SIZE}")
+    cursor.execute(f"PRAGMA cache_size={config.SQLITE_CACHE_SIZE}")
+    cursor.close()
+
+def _is_memory(url: str) -> bool:
+    return _is_sqlite(url) and make_url(url).database in (None, "", ":memory:")
+
+def _shared_memory_url(url: str) -> str:
+    # A named shared-cache database instead of a private one per connection, so
+    # the sync and async engines (separate connections) see the same data
+    return make_url(url).set(
+        database="file:ops_platform",
+        query={"mode": "memory", "cache": "shared", "uri": "true"},
+    ).render_as_string(hide_password=False)
+
+def create_db_engine(url: str = SQLALCHEMY_DATABASE_URL):
+    pool_args = {
+        "pool_size": config.DB_POOL_SIZE,
+        "max_overflow": config.DB_MAX_OVERFLOW,
+        "pool_timeout": config.DB_POOL_TIMEOUT,
+    }
+    if not _is_sqlite(url):
+        return create_engine(url, pool_pre_ping=True, pool_recycle=config.DB_POOL_RECYCLE, **pool_args)
+    if _is_memory(url):
+        # In-memory databases live in a single shared connection
+        return create_engine(_shared_memory_url(url), connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    new_engine = create_engine(
+        url,
+        connect_args={"check_same_thread": False, "timeout": config.SQLITE_BUSY_TIMEOUT_MS / 1000},
+        **pool_args,
+    )
+    event.listen(new_engine, "connect", _sqlite_pragmas)
+    return new_engine
+
+engine = create_db_engine()
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
@@ -16,3 +64,104 @@ def get_db():
         yield db
     finally:
         db.close()
+
+# Async drivers for the sync URL's backend, used unless OPS_ASYNC_DATABASE_URL is set
+ASYNC_DRIVERS = {"sqlite": "aiosqlite", "postgresql": "asyncpg", "mysql": "aiomysql"}
+
+def async_database_url(url: str = SQLALCHEMY_DATABASE_URL) -> str:
+    if config.ASYNC_DATABASE_URL:
+        return config.ASYNC_DATABASE_URL
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise RuntimeError(f"No async driver known for {backend}, set OPS_ASYNC_DATABASE_URL")
+    return parsed.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}").render_as_string(hide_password=False)
+
+_async_engine = None
+_async_sessionmaker = None
+
+def get_async_engine():
+    """
+    Async engine on the same database as `engine`, created on first use so
+    deployments that only use the sync path don't need the async driver.
+    """
+    global _async_engine, _async_sessionmaker
+    if _async_engine is None:
+        url = async_database_url()
+        if _is_memory(url):
+            _async_engine = create_async_engine(_shared_memory_url(url), poolclass=StaticPool)
+        elif _is_sqlite(url):
+            _async_engine = create_async_engine(url, connect_args={"timeout": config.SQLITE_BUSY_TIMEOUT_MS / 1000})
+            event.listen(_async_engine.sync_engine, "connect", _sqlite_pragmas)
+        else:
+            _async_engine = create_async_engine(
+                url,
+                pool_pre_ping=True,
+                pool_recycle=config.DB_POOL_RECYCLE,
+                pool_size=config.DB_POOL_SIZE,
+                max_overflow=config.DB_MAX_OVERFLOW,
+                pool_timeout=config.DB_POOL_TIMEOUT,
+            )
+        _async_sessionmaker = async_sessionmaker(_async_engine, expire_on_commit=False, autoflush=False)
+    return _async_engine
+
+def AsyncSessionLocal() -> AsyncSession:
+    get_async_engine()
+    return _async_sessionmaker()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+async def dispose_async_engine():
+    global _async_engine
+    if _async_engine is not None:
+        await _async_engine.dispose()
+        _async_engine = None
+
+def ensure_schema(bind=engine):
+    """
+    Create missing tables, then add columns and indexes that were introduced
+    after an existing table was created (create_all skips existing tables).
+    New columns are added without defaults or constraints, only their type.
+    """
+    Base.metadata.create_all(bind=bind)
+    insp = inspect(bind)
+    with bind.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            columns = {c["name"] for c in insp.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in columns:
+                    if isinstance(column.type, SchemaType):
+                        # Named types (PostgreSQL enums) must exist before a column can use them;
+                        # a no-op on SQLite and MySQL, where enums are inline
+                        column.type.create(conn, checkfirst=True)
+                    col_type = column.type.compile(dialect=bind.dialect)
+                    conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {col_type}"))
+            indexes = {i["name"] for i in insp.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in indexes:
+                    index.create(conn)
+    _add_enum_values(bind)
+
+def _add_enum_values(bind):
+    """
+    Add values that were introduced after a PostgreSQL enum type was created,
+    e.g. TaskMode.rolling; without them inserting such a row fails.
+    """
+    if bind.dialect.name != "postgresql":
+        return
+    # ADD VALUE can't run inside a transaction block before PostgreSQL 12
+    with bind.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        existing = {}
+        for name, label in conn.execute(text("SELECT t.typname, e.enumlabel FROM pg_type t JOIN pg_enum e ON e.enumtypid = t.oid")):
+            existing.setdefault(name, set()).add(label)
+        for table in Base.metadata.sorted_tables:
+            for column in table.columns:
+                if not isinstance(column.type, Enum) or column.type.name not in existing:
+                    continue
+                labels = existing[column.type.name]
+                for label in column.type.enums:
+                    if label not in labels:
+                        conn.execute(text(f"ALTER TYPE {column.type.name} ADD VALUE IF NOT EXISTS '{label}'"))
+                        labels.add(label)
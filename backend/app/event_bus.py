@@ -0,0 +1,280 @@
+import asyncio
+import json
+import sqlite3
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Set
+from . import config
+
+class Subscription:
+    """
+    One subscriber's bounded queue for a single topic (task_id).
+
+    When the consumer falls behind, the oldest messages are dropped. Dropped
+    host status transitions are coalesced (latest per host wins) and delivered
+    ahead of the queue, followed by a notice with the number of dropped messages.
+    """
+
+    def __init__(self, task_id, maxsize: int):
+        self.task_id = task_id
+        self.topic = str(task_id)
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize)
+        self.dropped = 0
+        self.coalesced: Dict[object, dict] = {}
+
+    def offer(self, message: dict):
+        while True:
+            try:
+                self.queue.put_nowait(message)
+                return
+            except asyncio.QueueFull:
+                oldest = self.queue.get_nowait()
+                self.dropped += 1
+                if "stream" not in oldest and "status" in oldest:
+                    self.coalesced[oldest.get("host_id")] = oldest
+
+    async def get(self) -> dict:
+        if self.coalesced:
+            host_id = next(iter(self.coalesced))
+            return self.coalesced.pop(host_id)
+        if self.dropped:
+            dropped, self.dropped = self.dropped, 0
+            return {
+                "task_id": self.task_id,
+                "dropped": dropped,
+                "line": f"--- {dropped} messages dropped (slow consumer) ---"
+            }
+        return await self.queue.get()
+
+class InMemoryBackend:
+    """Delivers messages to subscribers of the current process only."""
+
+    name = "memory"
+
+    def __init__(self):
+        self.deliver: Optional[Callable[[dict], None]] = None
+
+    def start(self, deliver: Callable[[dict], None], wants: Callable[[str], bool]):
+        self.deliver = deliver
+
+    def publish(self, message: dict):
+        self.deliver(message)
+
+    async def close(self):
+        pass
+
+    def stats(self) -> dict:
+        return {"backend": self.name}
+
+class SQLiteRingBackend:
+    """
+    Cross-process transport for workers on one node, backed by a small SQLite
+    file in WAL mode used as a ring buffer.
+
+    Local subscribers are served immediately. Published messages are batched
+    per task and written as one row per flush; every process polls for rows
+    written by other processes and skips the ones for tasks nobody in the
+    process is watching. Rows older than `ring_size` are pruned.
+    """
+
+    name = "sqlite"
+
+    def __init__(
+        self,
+        path: str = config.EVENT_BUS_SQLITE_PATH,
+        flush_interval: float = config.EVENT_BUS_FLUSH_INTERVAL,
+        poll_interval: float = config.EVENT_BUS_POLL_INTERVAL,
+        batch_size: int = config.EVENT_BUS_BATCH_SIZE,
+        ring_size: int = config.EVENT_BUS_RING_SIZE,
+    ):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.ring_size = ring_size
+        self.origin = uuid.uuid4().hex
+
+        self.pending: List[dict] = []
+        self.last_id = 0
+        self.conn: Optional[sqlite3.Connection] = None
+        # All SQLite access happens on this single thread, off the event loop
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="event-bus")
+        self.deliver: Optional[Callable[[dict], None]] = None
+        self.wants: Optional[Callable[[str], bool]] = None
+        self.tasks: List[asyncio.Task] = []
+        self.wakeup: Optional[asyncio.Event] = None
+        self.counters = {"published": 0, "rows_written": 0, "rows_read": 0, "received": 0}
+
+    def start(self, deliver: Callable[[dict], None], wants: Callable[[str], bool]):
+        self.deliver = deliver
+        self.wants = wants
+        if not self.tasks:
+            self.wakeup = asyncio.Event()
+            self.tasks = [
+                asyncio.create_task(self._flush_loop()),
+                asyncio.create_task(self._poll_loop()),
+            ]
+
+    def publish(self, message: dict):
+        self.deliver(message)
+        self.pending.append(message)
+        self.counters["published"] += 1
+        if len(self.pending) >= self.batch_size:
+            self.wakeup.set()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self.conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS events ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, origin TEXT, topic TEXT, created_at REAL, payload TEXT)"
+            )
+            row = conn.execute("SELECT MAX(id) FROM events").fetchone()
+            self.last_id = row[0] or 0
+            self.conn = conn
+        return self.conn
+
+    def _write(self, batch: List[dict]):
+        conn = self._connect()
+        by_topic: Dict[str, List[dict]] = {}
+        for msg in batch:
+            by_topic.setdefault(str(msg.get("task_id")), []).append(msg)
+        now = time.time()
+        rows = [
+            (self.origin, topic, now, json.dumps(msgs[i:i + self.batch_size], default=str))
+            for topic, msgs in by_topic.items()
+            for i in range(0, len(msgs), self.batch_size)
+        ]
+        conn.execute("BEGIN")
+        conn.executemany("INSERT INTO events (origin, topic, created_at, payload) VALUES (?, ?, ?, ?)", rows)
+        last = conn.execute("SELECT MAX(id) FROM events").fetchone()[0]
+        # Trim the ring roughly every 256 rows rather than on every flush
+        if last and last % 256 < len(rows):
+            conn.execute("DELETE FROM events WHERE id <= ?", (last - self.ring_size,))
+        conn.execute("COMMIT")
+        self.counters["rows_written"] += len(rows)
+
+    def _read(self) -> List[tuple]:
+        conn = self._connect()
+        return conn.execute(
+            "SELECT id, origin, topic, payload FROM events WHERE id > ? ORDER BY id LIMIT 1000", (self.last_id,)
+        ).fetchall()
+
+    async def _flush(self):
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, []
+        await asyncio.get_running_loop().run_in_executor(self.executor, self._write, batch)
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            try:
+                await self._flush()
+            except sqlite3.Error as e:
+                print(f"Event bus flush failed: {e}")
+
+    async def _poll_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                rows = await loop.run_in_executor(self.executor, self._read)
+            except sqlite3.Error as e:
+                print(f"Event bus poll failed: {e}")
+                continue
+            for row_id, origin, topic, payload in rows:
+                self.last_id = row_id
+                self.counters["rows_read"] += 1
+                if origin == self.origin or not self.wants(topic):
+                    continue
+                for msg in json.loads(payload):
+                    self.counters["received"] += 1
+                    self.deliver(msg)
+
+    async def close(self):
+        for t in self.tasks:
+            t.cancel()
+        self.tasks = []
+        try:
+            await self._flush()
+        except sqlite3.Error:
+            pass
+        if self.conn is not None:
+            conn, self.conn = self.conn, None
+            await asyncio.get_running_loop().run_in_executor(self.executor, conn.close)
+
+    def stats(self) -> dict:
+        return {"backend": self.name, "pending": len(self.pending), **self.counters}
+
+BACKENDS = {
+    InMemoryBackend.name: InMemoryBackend,
+    SQLiteRingBackend.name: SQLiteRingBackend,
+}
+
+def create_backend(name: str = config.EVENT_BUS_BACKEND):
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown event bus backend: {name}")
+    return BACKENDS[name]()
+
+# Global event bus for task logs
+# Messages are routed by task_id, publishing never waits on a consumer.
+# The backend decides whether messages also reach other worker processes.
+class TaskEventBus:
+    def __init__(self, backend=None, queue_size: int = config.EVENT_BUS_QUEUE_SIZE):
+        self.backend = backend or InMemoryBackend()
+        self.queue_size = queue_size
+        self.topics: Dict[str, Set[Subscription]] = {}
+        self.started = False
+
+    def _ensure_started(self):
+        if not self.started:
+            self.backend.start(self.dispatch, self.topics.__contains__)
+            self.started = True
+
+    def subscribe(self, task_id, maxsize: Optional[int] = None) -> Subscription:
+        self._ensure_started()
+        sub = Subscription(task_id, maxsize or self.queue_size)
+        self.topics.setdefault(sub.topic, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        subs = self.topics.get(sub.topic)
+        if subs is None:
+            return
+        subs.discard(sub)
+        if not subs:
+            del self.topics[sub.topic]
+
+    def dispatch(self, message: dict):
+        """Hand a message to the subscribers of its task in this process."""
+        for sub in self.topics.get(str(message.get("task_id")), ()):
+            sub.offer(message)
+
+    def publish_nowait(self, message: dict):
+        self._ensure_started()
+        self.backend.publish(message)
+
+    async def publish(self, message: dict):
+        self.publish_nowait(message)
+
+    async def close(self):
+        await self.backend.close()
+        self.started = False
+
+    def stats(self) -> dict:
+        return {
+            **self.backend.stats(),
+            "topics": len(self.topics),
+            "subscribers": sum(len(s) for s in self.topics.values()),
+            "backlog": sum(sub.queue.qsize() for s in self.topics.values() for sub in s),
+        }
+
+task_event_bus = TaskEventBus(create_backend())
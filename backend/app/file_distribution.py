@@ -0,0 +1,298 @@
+import asyncio
+import datetime
+import hashlib
+import json
+import os
+import posixpath
+import re
+import shlex
+import time
+import uuid
+from typing import AsyncIterator, Awaitable, Callable, Dict, Iterable, List, Optional
+import asyncssh
+from .ssh_pool import ssh_pool
+from . import config
+
+_SHA256 = re.compile(r"^[0-9a-f]{64}$")
+
+# Artifact store: uploaded files named by their sha256, with a JSON sidecar
+
+def artifact_path(sha256: str) -> Optional[str]:
+    if not _SHA256.match(sha256):
+        return None
+    return os.path.join(config.FILE_STORE_DIR, sha256)
+
+def load_artifact(sha256: str) -> Optional[dict]:
+    path = artifact_path(sha256)
+    if path is None or not os.path.exists(path):
+        return None
+    try:
+        with open(path + ".json", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"sha256": sha256, "size": os.path.getsize(path), "name": None}
+
+def list_artifacts() -> List[dict]:
+    if not os.path.isdir(config.FILE_STORE_DIR):
+        return []
+    found = [load_artifact(name) for name in os.listdir(config.FILE_STORE_DIR) if _SHA256.match(name)]
+    return sorted((a for a in found if a), key=lambda a: a.get("uploaded_at") or "", reverse=True)
+
+async def save_artifact(chunks: AsyncIterator[bytes], name: Optional[str]) -> dict:
+    """Stream an upload into the store, hashing as it goes."""
+    os.makedirs(config.FILE_STORE_DIR, exist_ok=True)
+    tmp = os.path.join(config.FILE_STORE_DIR, f".upload-{uuid.uuid4().hex}")
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(tmp, "wb") as f:
+            async for chunk in chunks:
+                digest.update(chunk)
+                size += len(chunk)
+                await asyncio.to_thread(f.write, chunk)
+        sha256 = digest.hexdigest()
+        os.replace(tmp, artifact_path(sha256))
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    artifact = {"sha256": sha256, "size": size, "name": name, "uploaded_at": datetime.datetime.utcnow().isoformat()}
+    with open(artifact_path(sha256) + ".json", "w", encoding="utf-8") as f:
+        json.dump(artifact, f)
+    return artifact
+
+def delete_artifact(sha256: str) -> bool:
+    path = artifact_path(sha256)
+    if path is None or not os.path.exists(path):
+        return False
+    os.remove(path)
+    if os.path.exists(path + ".json"):
+        os.remove(path + ".json")
+    return True
+
+class RelayPool:
+    """
+    Sources for the next copy in relay mode. Every host holding the file
+    serves up to `fanout` copies at once. The platform only serves the first
+    `fanout` hosts, plus any copy nothing else can take (no relay available
+    and nothing in progress that could become one), so its egress stays
+    O(fanout) while the number of sources grows with every finished host.
+    Copies falling back from a failed relay go through the same budget.
+    """
+
+    def __init__(self, fanout: int, max_failures: int = config.FILE_RELAY_MAX_FAILURES):
+        self.fanout = fanout
+        self.max_failures = max_failures
+        self.sources: Dict[int, dict] = {}
+        self.busy: Dict[int, int] = {}
+        self.failures: Dict[int, int] = {}
+        self.direct = 0
+        self.active = 0
+        self.cond = asyncio.Condition()
+
+    async def acquire(self, exclude: Iterable[int] = ()) -> Optional[dict]:
+        """A relay host's info (other than `exclude`), or None for a direct upload from the platform."""
+        async with self.cond:
+            while True:
+                free = [
+                    host_id for host_id, n in self.busy.items()
+                    if n < self.fanout and host_id not in exclude and self.failures.get(host_id, 0) < self.max_failures
+                ]
+                if free:
+                    host_id = min(free, key=self.busy.get)
+                    self.busy[host_id] += 1
+                    self.active += 1
+                    return self.sources[host_id]
+                if self.direct < self.fanout or not self.active:
+                    self.direct += 1
+                    self.active += 1
+                    return None
+                await self.cond.wait()
+
+    async def release(self, source: Optional[dict], target: Optional[dict], failed: bool = False):
+        """`target` is the host just served, if it now holds the file."""
+        async with self.cond:
+            self.active -= 1
+            if source is not None:
+                self.busy[source["host_id"]] -= 1
+                if failed:
+                    # Too many failures and the host stops relaying (see acquire)
+                    self.failures[source["host_id"]] = self.failures.get(source["host_id"], 0) + 1
+            self._add(target)
+            self.cond.notify_all()
+
+    async def add(self, target: dict):
+        async with self.cond:
+            self._add(target)
+            self.cond.notify_all()
+
+    def _add(self, target: Optional[dict]):
+        if target is not None and target["host_id"] not in self.busy:
+            self.sources[target["host_id"]] = target
+            self.busy[target["host_id"]] = 0
+
+def _target(info: dict) -> str:
+    ip = info["ip"]
+    host = f"[{ip}]" if ":" in ip else ip
+    return f"{info['username']}@{host}"
+
+class FileDistribution:
+    """
+    Copies a stored artifact to every host of a file task.
+
+    Hosts whose file already has the artifact's sha256 are skipped. Others
+    get it through a pipelined SFTP upload (many write requests in flight)
+    or, in relay mode, a copy from a host that already has it. For that copy
+    the target authorizes a per-task key that is restricted to the source's
+    address and to writing the temporary file; the private key is only on
+    the source while the copy runs. Either way the file lands in a temporary
+    name next to the destination, is verified and then renamed into place,
+    and the temporary file is removed if anything fails. A failed relay copy
+    is retried through another source or, within the platform's budget,
+    uploaded directly.
+    """
+
+    def __init__(self, task_id: int, spec: dict, publish: Callable[[dict], Awaitable[None]]):
+        self.task_id = task_id
+        self.sha256 = spec["artifact"]
+        self.local_path = artifact_path(self.sha256)
+        self.dest = spec["dest"]
+        self.file_mode = spec.get("file_mode") or "0644"
+        self.relay = RelayPool(spec.get("fanout") or config.FILE_RELAY_FANOUT) if spec.get("relay") else None
+        self.publish = publish
+        self.tmp = f"{self.dest}.ops-tmp-{task_id}"
+        self.key_comment = f"ops-relay-{task_id}"
+        self.key: Optional[asyncssh.SSHKey] = None
+        self.counters = {"direct": 0, "relayed": 0, "skipped": 0, "fallbacks": 0, "direct_bytes": 0}
+
+    async def _line(self, host_id: int, line: str):
+        await self.publish({"task_id": self.task_id, "host_id": host_id, "status": "running", "line": line})
+
+    @staticmethod
+    async def _run(conn, command: str, timeout: Optional[float] = None, input: Optional[str] = None):
+        result = await asyncio.wait_for(conn.run(command, input=input, errors="replace"), timeout)
+        if result.exit_status != 0:
+            raise RuntimeError((result.stderr or result.stdout or f"exit code {result.exit_status}").strip())
+        return result.stdout
+
+    async def _remote_sha256(self, conn, path: str) -> Optional[str]:
+        result = await conn.run(f"sha256sum -- {shlex.quote(path)}", errors="replace")
+        if result.exit_status != 0 or not result.stdout:
+            return None
+        return result.stdout.split()[0]
+
+    async def transfer(self, info: dict) -> int:
+        """Copy the artifact to one host, returns 0; raises on failure."""
+        async with ssh_pool.connection(info["ip"], info["port"], info["username"], info["password"]) as conn:
+            if await self._remote_sha256(conn, self.dest) == self.sha256:
+                self.counters["skipped"] += 1
+                await self._line(info["host_id"], f"--- {self.dest} is up to date, skipped ---")
+                if self.relay is not None:
+                    await self.relay.add(info)
+                return 0
+
+            directory = posixpath.dirname(self.dest)
+            if directory:
+                await self._run(conn, f"mkdir -p -- {shlex.quote(directory)}")
+            held, source, done = False, None, False
+            tried = set()
+            try:
+                while True:
+                    if self.relay is not None:
+                        source = await self.relay.acquire(exclude=tried)
+                        held = True
+                    if source is None:
+                        await self._upload(conn, info["host_id"])
+                        break
+                    try:
+                        await self._relay_copy(source, info, conn)
+                        self.counters["relayed"] += 1
+                        break
+                    except Exception as e:
+                        self.counters["fallbacks"] += 1
+                        await self._line(info["host_id"], f"Relay from {source['ip']} failed ({e}), trying another source")
+                        tried.add(source["host_id"])
+                        held = False
+                        await self.relay.release(source, None, failed=True)
+                        source = None
+                await self._install(conn)
+                done = True
+            except BaseException:
+                await asyncio.shield(self._discard(conn))
+                raise
+            finally:
+                if held:
+                    await self.relay.release(source, info if done else None)
+        return 0
+
+    async def _discard(self, conn):
+        """Remove what a failed or cancelled copy left behind."""
+        try:
+            await conn.run(f"rm -f -- {shlex.quote(self.tmp)}")
+        except Exception as e:
+            print(f"Task {self.task_id}: removing {self.tmp} failed: {e}")
+
+    async def _upload(self, conn, host_id: int):
+        started = time.monotonic()
+        size = os.path.getsize(self.local_path)
+        async with conn.start_sftp_client() as sftp:
+            await sftp.put(
+                self.local_path,
+                self.tmp,
+                block_size=config.FILE_SFTP_BLOCK_SIZE,
+                max_requests=config.FILE_SFTP_MAX_REQUESTS,
+            )
+        elapsed = max(time.monotonic() - started, 1e-6)
+        self.counters["direct"] += 1
+        self.counters["direct_bytes"] += size
+        await self._line(host_id, f"--- Uploaded {size / 1048576:.1f} MiB in {elapsed:.1f}s ({size / 1048576 / elapsed:.1f} MiB/s) ---")
+
+    def _authorized_entry(self, source: dict) -> str:
+        """The task's public key, usable only from `source` and only to write the temporary file."""
+        if self.key is None:
+            self.key = asyncssh.generate_private_key("ssh-ed25519", comment=self.key_comment)
+        command = f"cat > {shlex.quote(self.tmp)}".replace("\\", "\\\\").replace('"', '\\"')
+        public_key = self.key.export_public_key().decode().strip()
+        return f'restrict,from="{source["ip"]}",command="{command}" {public_key}'
+
+    async def _relay_copy(self, source: dict, target: dict, target_conn):
+        authorized = "~/.ssh/authorized_keys"
+        entry = self._authorized_entry(source)
+        await self._run(target_conn, f"mkdir -p ~/.ssh && chmod 700 ~/.ssh && echo {shlex.quote(entry)} >> {authorized}")
+        try:
+            # The private key comes in on stdin and only exists in a temporary file
+            # for the copy; the target's forced command writes what ssh sends
+            script = " ".join([
+                'k=$(mktemp) || exit 1; trap \'rm -f "$k"\' EXIT; cat > "$k";',
+                'ssh -i "$k" -o BatchMode=yes -o IdentitiesOnly=yes',
+                "-o StrictHostKeyChecking=no -o UserKnownHostsFile=/dev/null -o ConnectTimeout=10",
+                f"-p {int(target['port'])}",
+                shlex.quote(_target(target)),
+                f"< {shlex.quote(self.dest)}",
+            ])
+            async with ssh_pool.connection(source["ip"], source["port"], source["username"], source["password"]) as conn:
+                await self._run(conn, f"sh -c {shlex.quote(script)}", config.FILE_RELAY_TIMEOUT, self.key.export_private_key().decode())
+        finally:
+            try:
+                await self._run(target_conn, f"sed -i '/ {self.key_comment}$/d' {authorized}")
+            except Exception as e:
+                # Don't hide why the copy failed; the entry is useless once the temp file is installed
+                print(f"Task {self.task_id}: removing relay key from {target['ip']} failed: {e}")
+        await self._line(target["host_id"], f"--- Copied from {source['ip']} ---")
+
+    async def _install(self, conn):
+        """Verify the temporary file and move it into place."""
+        tmp = shlex.quote(self.tmp)
+        got = await self._remote_sha256(conn, self.tmp)
+        if got != self.sha256:
+            raise RuntimeError(f"Checksum mismatch on {self.tmp}: {got or 'unreadable'}")
+        await self._run(conn, f"chmod {shlex.quote(self.file_mode)} -- {tmp} && mv -f -- {tmp} {shlex.quote(self.dest)}")
+
+    async def close(self):
+        """Report what was done."""
+        c = self.counters
+        await self.publish({
+            "task_id": self.task_id,
+            "status": "running",
+            "line": f"--- Distribution: {c['direct']} uploaded directly ({c['direct_bytes'] / 1048576:.1f} MiB), "
+                    f"{c['relayed']} relayed, {c['skipped']} up to date, {c['fallbacks']} failed relay copies ---",
+        })
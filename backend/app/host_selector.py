@@ -0,0 +1,171 @@
+import ipaddress
+import re
+from typing import Dict, Iterable, Iterator, List, Optional
+from sqlalchemy import and_, or_, not_, select, delete, insert, func
+from sqlalchemy.orm import Session
+from .db import SessionLocal
+from .models import Host, HostTag
+
+_TOKEN = re.compile(r"\s*(\(|\)|&&|\|\||!|[^\s()!&|]+)")
+
+class SelectorError(ValueError):
+    pass
+
+class _TagExpressionParser:
+    """
+    Recursive descent parser for tag expressions such as
+    `prod and (web or api) and not canary`. Operators are and/or/not
+    (or &&, ||, !), adjacent tags are ANDed.
+    """
+
+    def __init__(self, text: str):
+        self.tokens = []
+        pos = 0
+        text = text.strip()
+        while pos < len(text):
+            m = _TOKEN.match(text, pos)
+            if not m:
+                raise SelectorError(f"Invalid tag expression near {text[pos:]!r}")
+            self.tokens.append(m.group(1))
+            pos = m.end()
+        self.pos = 0
+
+    def _peek(self) -> Optional[str]:
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def _take(self) -> str:
+        token = self._peek()
+        if token is None:
+            raise SelectorError("Unexpected end of tag expression")
+        self.pos += 1
+        return token
+
+    @staticmethod
+    def _is(token: Optional[str], *ops: str) -> bool:
+        return token is not None and token.lower() in ops
+
+    def parse(self):
+        if not self.tokens:
+            raise SelectorError("Empty tag expression")
+        clause = self._or()
+        if self._peek() is not None:
+            raise SelectorError(f"Unexpected {self._peek()!r} in tag expression")
+        return clause
+
+    def _or(self):
+        clauses = [self._and()]
+        while self._is(self._peek(), "or", "||"):
+            self._take()
+            clauses.append(self._and())
+        return clauses[0] if len(clauses) == 1 else or_(*clauses)
+
+    def _and(self):
+        clauses = [self._not()]
+        while self._peek() is not None and self._peek() != ")" and not self._is(self._peek(), "or", "||"):
+            if self._is(self._peek(), "and", "&&"):
+                self._take()
+            clauses.append(self._not())
+        return clauses[0] if len(clauses) == 1 else and_(*clauses)
+
+    def _not(self):
+        if self._is(self._peek(), "not", "!"):
+            self._take()
+            return not_(self._not())
+        return self._atom()
+
+    def _atom(self):
+        token = self._take()
+        if token == "(":
+            clause = self._or()
+            if self._take() != ")":
+                raise SelectorError("Missing ')' in tag expression")
+            return clause
+        if token == ")" or self._is(token, "and", "or", "&&", "||"):
+            raise SelectorError(f"Unexpected {token!r} in tag expression")
+        # Served by the (tag, host_id) index
+        return Host.id.in_(select(HostTag.host_id).where(HostTag.tag == token))
+
+def parse_network(cidr: str):
+    try:
+        return ipaddress.ip_network(cidr.strip(), strict=False)
+    except ValueError:
+        raise SelectorError(f"Invalid CIDR {cidr!r}")
+
+def _prefix_range(column, prefix: str):
+    # Range instead of LIKE so the column index is used
+    return and_(column >= prefix, column < prefix + "\uffff")
+
+def _network_prefix(network) -> Optional[str]:
+    """Dotted prefix shared by every address of an IPv4 network, e.g. '10.1.' for 10.1.0.0/16."""
+    if network.version != 4 or network.prefixlen < 8:
+        return None
+    octets = str(network.network_address).split(".")[:network.prefixlen // 8]
+    return ".".join(octets) + ("." if len(octets) < 4 else "")
+
+def build_host_query(db: Session, tags: Optional[str] = None, q: Optional[str] = None, cidr: Optional[str] = None, columns=None):
+    """
+    Hosts matching every given criterion, ordered by id, plus the network the
+    caller still has to check addresses against (None if no CIDR was given).
+    """
+    query = db.query(*(columns or [Host]))
+    if tags:
+        query = query.filter(_TagExpressionParser(tags).parse())
+    if q:
+        query = query.filter(or_(_prefix_range(Host.name, q), _prefix_range(Host.ip, q)))
+    network = None
+    if cidr:
+        network = parse_network(cidr)
+        prefix = _network_prefix(network)
+        if network.prefixlen == network.max_prefixlen:
+            query = query.filter(Host.ip == str(network.network_address))
+        elif prefix:
+            query = query.filter(_prefix_range(Host.ip, prefix))
+    return query.order_by(Host.id), network
+
+def in_network(ip: Optional[str], network) -> bool:
+    try:
+        return ipaddress.ip_address((ip or "").strip()) in network
+    except ValueError:
+        # Hostnames and malformed addresses never match a CIDR
+        return False
+
+def iter_hosts(query, network) -> Iterator:
+    """Stream rows of build_host_query, applying the exact CIDR check."""
+    for row in query.yield_per(1000):
+        if network is None or in_network(row.ip, network):
+            yield row
+
+def resolve_host_ids(db: Session, tags: Optional[str] = None, q: Optional[str] = None, cidr: Optional[str] = None) -> List[int]:
+    query, network = build_host_query(db, tags, q, cidr, columns=[Host.id, Host.ip])
+    return [row.id for row in iter_hosts(query, network)]
+
+def set_host_tags(db: Session, host_id: int, tags: Optional[Iterable[str]]):
+    """Replace the indexed tags of a host, in the caller's transaction."""
+    set_hosts_tags(db, {host_id: tags})
+
+def set_hosts_tags(db: Session, tags_by_host: Dict[int, Optional[Iterable[str]]]):
+    if not tags_by_host:
+        return
+    db.execute(delete(HostTag).where(HostTag.host_id.in_(list(tags_by_host))))
+    rows = [
+        {"host_id": host_id, "tag": tag}
+        for host_id, tags in tags_by_host.items()
+        for tag in dict.fromkeys(tags or ()) if tag
+    ]
+    if rows:
+        db.execute(insert(HostTag), rows)
+
+def backfill_host_tags():
+    """Populate host_tags from Host.tags for databases created before the table existed."""
+    db = SessionLocal()
+    try:
+        if db.query(func.count()).select_from(HostTag).scalar():
+            return
+        rows = []
+        for host_id, tags in db.query(Host.id, Host.tags).filter(Host.tags.isnot(None)):
+            rows.extend({"host_id": host_id, "tag": tag} for tag in dict.fromkeys(tags or ()) if tag)
+        if rows:
+            db.execute(insert(HostTag), rows)
+            db.commit()
+    finally:
+        db.close()
@@ -0,0 +1,174 @@
+import datetime
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from .db import SessionLocal
+from .models import Job, JobStatus, JobControl, TaskHost, TaskHostStatus
+from . import config
+
+class JobQueue:
+    """
+    Persistent queue of task executions stored in the jobs table.
+
+    Workers lease a queued job, extend the lease with heartbeats while it runs
+    and mark it finished afterwards. A job whose lease expires (worker crashed
+    or was killed) is re-queued by `recover`; hosts it left running are marked
+    failed and only pending hosts are executed by the next attempt.
+
+    All methods are blocking, workers call them via asyncio.to_thread.
+    """
+
+    def __init__(self, lease_seconds: float = config.JOB_LEASE_SECONDS, max_attempts: int = config.JOB_MAX_ATTEMPTS):
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+
+    def _lease_until(self) -> datetime.datetime:
+        return datetime.datetime.utcnow() + datetime.timedelta(seconds=self.lease_seconds)
+
+    def enqueue(self, db: Session, task_id: int, kind: str = "run_task") -> Job:
+        """Add a job in the caller's transaction, so the task and its job commit together."""
+        job = Job(kind=kind, task_id=task_id, status=JobStatus.queued, attempts=0)
+        db.add(job)
+        return job
+
+    def lease(self, worker_id: str) -> Optional[dict]:
+        db = SessionLocal()
+        try:
+            candidates = db.query(Job.id, Job.task_id, Job.kind) \
+                .filter(Job.status == JobStatus.queued) \
+                .order_by(Job.id) \
+                .limit(5) \
+                .all()
+            for job_id, task_id, kind in candidates:
+                now = datetime.datetime.utcnow()
+                # Conditional update: only one worker can move the job out of `queued`
+                claimed = db.query(Job) \
+                    .filter(Job.id == job_id, Job.status == JobStatus.queued) \
+                    .update({
+                        "status": JobStatus.running,
+                        "worker_id": worker_id,
+                        "attempts": Job.attempts + 1,
+                        "lease_expires_at": self._lease_until(),
+                        "heartbeat_at": now,
+                        "started_at": now,
+                    }, synchronize_session=False)
+                db.commit()
+                if claimed:
+                    return {"id": job_id, "task_id": task_id, "kind": kind}
+            return None
+        finally:
+            db.close()
+
+    def heartbeat(self, worker_id: str, job_ids: List[int]) -> Dict[int, Optional[JobControl]]:
+        """Extend the leases of a worker's jobs, returns the control requested for each job it still owns."""
+        if not job_ids:
+            return {}
+        db = SessionLocal()
+        try:
+            owned = db.query(Job) \
+                .filter(Job.id.in_(job_ids), Job.worker_id == worker_id, Job.status == JobStatus.running)
+            owned.update({
+                "lease_expires_at": self._lease_until(),
+                "heartbeat_at": datetime.datetime.utcnow(),
+            }, synchronize_session=False)
+            db.commit()
+            return {job_id: control for job_id, control in owned.with_entities(Job.id, Job.control).all()}
+        finally:
+            db.close()
+
+    def complete(self, job_id: int, worker_id: str, status: JobStatus, error: Optional[str] = None):
+        db = SessionLocal()
+        try:
+            db.query(Job) \
+                .filter(Job.id == job_id, Job.worker_id == worker_id) \
+                .update({
+                    "status": status,
+                    "error": error,
+                    "finished_at": datetime.datetime.utcnow(),
+                    "lease_expires_at": None,
+                }, synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+    def requeue(self, job_id: int, worker_id: str):
+        """Hand a job back on graceful shutdown, without counting it as a failed attempt."""
+        db = SessionLocal()
+        try:
+            db.query(Job) \
+                .filter(Job.id == job_id, Job.worker_id == worker_id, Job.status == JobStatus.running) \
+                .update({
+                    "status": JobStatus.queued,
+                    "worker_id": None,
+                    "lease_expires_at": None,
+                    "attempts": Job.attempts - 1,
+                }, synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+    def recover(self) -> int:
+        """Re-queue (or give up on) jobs whose lease expired, returns how many were recovered."""
+        db = SessionLocal()
+        try:
+            now = datetime.datetime.utcnow()
+            expired = db.query(Job) \
+                .filter(Job.status == JobStatus.running, Job.lease_expires_at < now) \
+                .all()
+            for job in expired:
+                # Whatever was running on the lost worker has an unknown outcome
+                db.query(TaskHost) \
+                    .filter(TaskHost.task_id == job.task_id, TaskHost.status == TaskHostStatus.running) \
+                    .update({
+                        "status": TaskHostStatus.failed,
+                        "error": f"Worker {job.worker_id} lost during execution",
+                        "end_time": now,
+                    }, synchronize_session=False)
+                if job.control == JobControl.cancel or job.attempts >= self.max_attempts:
+                    job.status = JobStatus.cancelled if job.control == JobControl.cancel else JobStatus.failed
+                    job.error = job.error or f"Lease expired after {job.attempts} attempt(s)"
+                    job.finished_at = now
+                    db.query(TaskHost) \
+                        .filter(TaskHost.task_id == job.task_id, TaskHost.status == TaskHostStatus.pending) \
+                        .update({"status": TaskHostStatus.cancelled, "end_time": now}, synchronize_session=False)
+                else:
+                    job.status = JobStatus.queued
+                job.worker_id = None
+                job.lease_expires_at = None
+            db.commit()
+            return len(expired)
+        finally:
+            db.close()
+
+    def request_control(self, task_id: int, control: Optional[JobControl]) -> Tuple[Optional[JobStatus], Optional[JobControl]]:
+        """
+        Record a pause / resume (None) / cancel request for a task's latest job.
+        Queued jobs are cancelled right away, running ones pick the request up
+        on their next heartbeat. A requested cancel is final: later pause and
+        resume requests leave it in place. Returns the job status and the
+        control now recorded on it, (None, None) if there is no job.
+        """
+        db = SessionLocal()
+        try:
+            job = db.query(Job).filter(Job.task_id == task_id).order_by(Job.id.desc()).first()
+            if job is None:
+                return None, None
+            if job.status == JobStatus.queued and control == JobControl.cancel:
+                job.status = JobStatus.cancelled
+                job.finished_at = datetime.datetime.utcnow()
+            elif job.status in (JobStatus.queued, JobStatus.running) and job.control != JobControl.cancel:
+                job.control = control
+            db.commit()
+            return job.status, job.control
+        finally:
+            db.close()
+
+    def stats(self) -> dict:
+        db = SessionLocal()
+        try:
+            rows = db.query(Job.status, func.count(Job.id)).group_by(Job.status).all()
+            return {status.value: count for status, count in rows}
+        finally:
+            db.close()
+
+job_queue = JobQueue()
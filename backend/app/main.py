@@ -1,10 +1,16 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from .db import engine, Base
-from .api import hosts, terminal, tasks, auth, users, env_configs
+from .db import ensure_schema
+from .host_selector import backfill_host_tags
+from .api import hosts, terminal, tasks, auth, users, env_configs, stats, files
+from .worker import embedded_worker, close_runtime
+from .ssh_manager import ssh_manager
+from .session_recording import session_recorder
+from . import config
 
-# Create tables
-Base.metadata.create_all(bind=engine)
+# Create tables / add new columns and indexes
+ensure_schema()
+backfill_host_tags()
 
 app = FastAPI(title="Ops Platform API")
 
@@ -15,6 +21,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
 
 app.include_router(auth.router)
@@ -23,6 +30,21 @@ app.include_router(hosts.router)
 app.include_router(terminal.router)
 app.include_router(tasks.router)
 app.include_router(env_configs.router)
+app.include_router(stats.router)
+app.include_router(files.router)
+
+@app.on_event("startup")
+async def startup():
+    if config.EMBEDDED_WORKER:
+        embedded_worker.start()
+
+@app.on_event("shutdown")
+async def shutdown():
+    if config.EMBEDDED_WORKER:
+        await embedded_worker.stop()
+    await ssh_manager.close_all()
+    await session_recorder.close()
+    await close_runtime()
 
 @app.get("/")
 def read_root():
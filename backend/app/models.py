@@ -1,8 +1,9 @@
-from sqlalchemy import Column, Integer, String, DateTime, Text, Enum, ForeignKey, JSON
+from sqlalchemy import Column, Integer, String, DateTime, Text, Enum, ForeignKey, JSON, Index
 from sqlalchemy.orm import relationship
 from .db import Base
 import enum
 import datetime
+import secrets
 
 class AuthType(str, enum.Enum):
     password = "password"
@@ -15,12 +16,15 @@ class User(Base):
     hashed_password = Column(String(255))
     is_active = Column(Integer, default=1) # 1: active, 0: inactive
     is_admin = Column(Integer, default=0)  # 1: admin, 0: regular
+    # Bumped to revoke every token issued so far. Starts random so tokens of a
+    # deleted user never match a new user that reuses its name and id
+    token_version = Column(Integer, default=lambda: secrets.randbits(31))
 
 class Host(Base):
     __tablename__ = "hosts"
     id = Column(Integer, primary_key=True, index=True)
-    name = Column(String(100))
-    ip = Column(String(64))
+    name = Column(String(100), index=True)
+    ip = Column(String(64), index=True)
     ssh_port = Column(Integer, default=22)
     username = Column(String(64))
     auth_type = Column(Enum(AuthType), default=AuthType.password)
@@ -28,10 +32,25 @@ class Host(Base):
     private_key_id = Column(Integer, nullable=True)
     tags = Column(JSON, nullable=True)
 
+class HostTag(Base):
+    # Normalized copy of Host.tags, kept in sync by the hosts API for indexed selection
+    __tablename__ = "host_tags"
+    host_id = Column(Integer, ForeignKey("hosts.id"), primary_key=True)
+    tag = Column(String(100), primary_key=True)
+
+    __table_args__ = (
+        Index("ix_host_tags_tag_host_id", "tag", "host_id"),
+    )
+
 class TaskMode(str, enum.Enum):
     single = "single"
     broadcast = "broadcast"
     batch = "batch"
+    rolling = "rolling"  # sliding window of batch_size hosts in flight
+
+class TaskType(str, enum.Enum):
+    command = "command"
+    file = "file"  # distribute an artifact from the file store, see file_distribution.py
 
 class BatchFailStrategy(str, enum.Enum):
     continue_ = "continue"
@@ -43,14 +62,27 @@ class Task(Base):
     name = Column(String(200))
     command = Column(Text)
     mode = Column(Enum(TaskMode), default=TaskMode.broadcast)
+    task_type = Column(Enum(TaskType), default=TaskType.command)  # NULL on tasks created before file tasks: command
+    file_spec = Column(JSON, nullable=True)  # file tasks: artifact, dest, file_mode, relay, fanout
     batch_size = Column(Integer, nullable=True)
     batch_interval = Column(Integer, nullable=True)
     on_batch_fail_strategy = Column(Enum(BatchFailStrategy), nullable=True)
+    max_failures = Column(Integer, nullable=True)  # pause_on_fail threshold, failed hosts
+    max_failure_percent = Column(Integer, nullable=True)  # pause_on_fail threshold, % of all hosts
+    concurrency = Column(Integer, nullable=True)  # hosts in flight for this task
+    weight = Column(Integer, nullable=True)  # share of scheduler slots relative to other tasks
     creator_id = Column(Integer, default=1)
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    archived_at = Column(DateTime, nullable=True)  # task_hosts rows moved to the archive (see retention.py)
+    host_summary = Column(JSON, nullable=True)  # host count per status, kept once rows are archived
     
     task_hosts = relationship("TaskHost", back_populates="task")
 
+    __table_args__ = (
+        # Keyset pagination of the task list, newest first
+        Index("ix_tasks_created_at_id", "created_at", "id"),
+    )
+
 class TaskHostStatus(str, enum.Enum):
     pending = "pending"
     running = "running"
@@ -61,8 +93,8 @@ class TaskHostStatus(str, enum.Enum):
 class TaskHost(Base):
     __tablename__ = "task_hosts"
     id = Column(Integer, primary_key=True)
-    task_id = Column(Integer, ForeignKey("tasks.id"))
-    host_id = Column(Integer, ForeignKey("hosts.id"))
+    task_id = Column(Integer, ForeignKey("tasks.id"))  # indexed by ix_task_hosts_task_id_status
+    host_id = Column(Integer, ForeignKey("hosts.id"), index=True)
     status = Column(Enum(TaskHostStatus), default=TaskHostStatus.pending)
     exit_code = Column(Integer, nullable=True)
     error = Column(Text, nullable=True)
@@ -71,6 +103,39 @@ class TaskHost(Base):
     
     task = relationship("Task", back_populates="task_hosts")
 
+    __table_args__ = (
+        # Covers the per-task status counts of the task list
+        Index("ix_task_hosts_task_id_status", "task_id", "status"),
+    )
+
+class JobStatus(str, enum.Enum):
+    queued = "queued"
+    running = "running"
+    done = "done"
+    failed = "failed"
+    cancelled = "cancelled"
+
+class JobControl(str, enum.Enum):
+    pause = "pause"
+    cancel = "cancel"
+
+class Job(Base):
+    # Durable execution queue, leased by workers (see job_queue.py / worker.py)
+    __tablename__ = "jobs"
+    id = Column(Integer, primary_key=True)
+    kind = Column(String(32), default="run_task")
+    task_id = Column(Integer, ForeignKey("tasks.id"), index=True)
+    status = Column(Enum(JobStatus), default=JobStatus.queued, index=True)
+    control = Column(Enum(JobControl), nullable=True)  # requested by the API, applied by the owning worker
+    attempts = Column(Integer, default=0)
+    worker_id = Column(String(64), nullable=True)
+    lease_expires_at = Column(DateTime, nullable=True)
+    heartbeat_at = Column(DateTime, nullable=True)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
 class EnvConfigType(str, enum.Enum):
     account = "account"
     topology = "topology"
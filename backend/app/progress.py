@@ -0,0 +1,161 @@
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+from sqlalchemy import func
+from .db import SessionLocal
+from .models import Task, TaskHost, TaskHostStatus
+from . import config
+
+def count_statuses(task_id: int) -> Optional[Dict[str, int]]:
+    """Host count per status of a task, None if the task doesn't exist."""
+    db = SessionLocal()
+    try:
+        rows = db.query(TaskHost.status, func.count(TaskHost.id)) \
+            .filter(TaskHost.task_id == task_id) \
+            .group_by(TaskHost.status) \
+            .all()
+        counts = {s.value: 0 for s in TaskHostStatus}
+        if not rows:
+            task = db.query(Task.id, Task.host_summary).filter(Task.id == task_id).first()
+            if task is None:
+                return None
+            # Host rows archived by retention
+            counts.update(task.host_summary or {})
+        for status, count in rows:
+            counts[status.value] = count
+        return counts
+    finally:
+        db.close()
+
+class TaskProgress:
+    def __init__(self, task_id: int, counts: Dict[str, int]):
+        self.task_id = task_id
+        self.counts = counts
+        self.local = False  # counts are kept exact by a runner in this process
+        self.refreshed_at = time.monotonic()
+        self.changed = asyncio.Event()
+        self.etag = self._etag()
+
+    def _etag(self) -> str:
+        # Derived from the counts only, so it is the same in every API process
+        digest = hashlib.md5(json.dumps(self.counts, sort_keys=True).encode()).hexdigest()
+        return f'"{digest[:16]}"'
+
+    def set_counts(self, counts: Dict[str, int]):
+        self.counts = counts
+        self.refreshed_at = time.monotonic()
+        etag = self._etag()
+        if etag != self.etag:
+            self.etag = etag
+            # Wake every waiter of the old version
+            self.changed.set()
+            self.changed = asyncio.Event()
+
+    def snapshot(self) -> dict:
+        total = sum(self.counts.values())
+        finished = self.counts["success"] + self.counts["failed"] + self.counts["cancelled"]
+        return {
+            "task_id": self.task_id,
+            "total": total,
+            **self.counts,
+            "progress": int(finished * 100 / total) if total else 0,
+            "status": "completed" if total and finished == total else "running",
+        }
+
+class ProgressCache:
+    """
+    Live host counts per task for the progress endpoint.
+
+    Tasks executed by this process are updated in place by the runner on every
+    host transition. Other tasks (finished, or running in another worker) are
+    re-read with one aggregate query at most once per refresh interval, no
+    matter how many clients are polling them.
+    """
+
+    def __init__(self, refresh_interval: float = config.PROGRESS_REFRESH_INTERVAL, max_entries: int = config.PROGRESS_CACHE_SIZE):
+        self.refresh_interval = refresh_interval
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[int, TaskProgress]" = OrderedDict()
+        self.refreshing: Dict[int, asyncio.Task] = {}
+
+    def _store(self, task_id: int, counts: Dict[str, int]) -> TaskProgress:
+        entry = self.entries.get(task_id)
+        if entry is None:
+            entry = self.entries[task_id] = TaskProgress(task_id, counts)
+            for key in list(self.entries):
+                if len(self.entries) <= self.max_entries:
+                    break
+                if not self.entries[key].local:
+                    del self.entries[key]
+        else:
+            entry.set_counts(counts)
+        self.entries.move_to_end(task_id)
+        return entry
+
+    async def track(self, task_id: int):
+        """Called by the runner before its first host transition."""
+        counts = await asyncio.to_thread(count_statuses, task_id)
+        if counts is not None:
+            self._store(task_id, counts).local = True
+
+    def untrack(self, task_id: int):
+        entry = self.entries.get(task_id)
+        if entry is not None:
+            entry.local = False
+            entry.refreshed_at = time.monotonic()
+
+    def transition(self, task_id: int, old: TaskHostStatus, new: TaskHostStatus, count: int = 1):
+        entry = self.entries.get(task_id)
+        if entry is None or not count:
+            return
+        counts = dict(entry.counts)
+        counts[old.value] -= count
+        counts[new.value] += count
+        entry.set_counts(counts)
+
+    async def _refresh(self, task_id: int) -> Optional[TaskProgress]:
+        counts = await asyncio.to_thread(count_statuses, task_id)
+        if counts is None:
+            self.entries.pop(task_id, None)
+            return None
+        return self._store(task_id, counts)
+
+    async def get(self, task_id: int) -> Optional[TaskProgress]:
+        entry = self.entries.get(task_id)
+        if entry is not None and (entry.local or time.monotonic() - entry.refreshed_at < self.refresh_interval):
+            self.entries.move_to_end(task_id)
+            return entry
+        # Concurrent pollers share one query
+        refresh = self.refreshing.get(task_id)
+        if refresh is None:
+            refresh = self.refreshing[task_id] = asyncio.create_task(self._refresh(task_id))
+            refresh.add_done_callback(lambda _: self.refreshing.pop(task_id, None))
+        return await asyncio.shield(refresh)
+
+    async def wait(self, task_id: int, etag: str, timeout: float) -> Optional[TaskProgress]:
+        """Long-poll: return once the task's ETag differs from `etag` or the timeout expires."""
+        deadline = time.monotonic() + timeout
+        entry = await self.get(task_id)
+        while entry is not None and entry.etag == etag:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            if not entry.local:
+                remaining = min(remaining, self.refresh_interval)
+            try:
+                await asyncio.wait_for(entry.changed.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+            entry = await self.get(task_id)
+        return entry
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self.entries),
+            "local": sum(1 for e in self.entries.values() if e.local),
+        }
+
+progress_cache = ProgressCache()
@@ -0,0 +1,168 @@
+import datetime
+import gzip
+import json
+import os
+import time
+from typing import Dict, List, Optional
+from sqlalchemy import delete, select, text
+from .db import SessionLocal, engine
+from .models import Task, TaskHost, TaskHostStatus, Job, JobStatus
+from . import config
+
+ARCHIVE_COLUMNS = ["id", "host_id", "status", "exit_code", "error", "start_time", "end_time"]
+
+class RetentionManager:
+    """
+    Keeps task history from growing without bound.
+
+    Tasks older than the age limit, or outside the newest `keep_tasks`, get
+    their TaskHost rows rolled up into `Task.host_summary`, written to a gzip
+    JSONL archive and deleted in small transactions. Freed SQLite pages are
+    returned a few at a time with incremental_vacuum.
+
+    Several workers may run it at once: archiving a task is claimed with a
+    conditional update and deleting is idempotent.
+    """
+
+    def __init__(
+        self,
+        archive_dir: str = config.RETENTION_ARCHIVE_DIR,
+        max_age_days: float = config.RETENTION_MAX_AGE_DAYS,
+        keep_tasks: int = config.RETENTION_KEEP_TASKS,
+        chunk_rows: int = config.RETENTION_CHUNK_ROWS,
+        chunk_pause: float = config.RETENTION_CHUNK_PAUSE,
+        vacuum_pages: int = config.RETENTION_VACUUM_PAGES,
+    ):
+        self.archive_dir = archive_dir
+        self.max_age_days = max_age_days
+        self.keep_tasks = keep_tasks
+        self.chunk_rows = chunk_rows
+        self.chunk_pause = chunk_pause
+        self.vacuum_pages = vacuum_pages
+        self.last_run: Optional[dict] = None
+
+    def archive_path(self, task_id: int, created_at: datetime.datetime) -> str:
+        return os.path.join(self.archive_dir, created_at.strftime("%Y-%m"), f"task_{task_id}.jsonl.gz")
+
+    def _candidates(self, db, limit: int) -> List[tuple]:
+        """Finished tasks past the age or count limit whose rows are not archived yet."""
+        cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=self.max_age_days)
+        newest = select(Task.id).order_by(Task.created_at.desc(), Task.id.desc()).limit(self.keep_tasks)
+        active = select(Job.task_id).where(Job.status.in_([JobStatus.queued, JobStatus.running]))
+        return db.query(Task.id, Task.created_at) \
+            .filter(Task.archived_at.is_(None)) \
+            .filter((Task.created_at < cutoff) | Task.id.notin_(newest)) \
+            .filter(Task.id.notin_(active)) \
+            .order_by(Task.id) \
+            .limit(limit) \
+            .all()
+
+    def _export(self, db, task_id: int, path: str) -> Dict[str, int]:
+        """Write the task's host rows to the archive and return their per-status counts."""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        counts = {s.value: 0 for s in TaskHostStatus}
+        rows = db.query(*[getattr(TaskHost, c) for c in ARCHIVE_COLUMNS]) \
+            .filter(TaskHost.task_id == task_id) \
+            .order_by(TaskHost.id) \
+            .yield_per(self.chunk_rows)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with gzip.open(tmp, "wt", encoding="utf-8") as f:
+            for row in rows:
+                record = dict(zip(ARCHIVE_COLUMNS, row))
+                counts[record["status"].value] += 1
+                f.write(json.dumps(record, default=str) + "\n")
+        os.replace(tmp, path)
+        return counts
+
+    def _delete_rows(self, task_id: int) -> int:
+        deleted = 0
+        while True:
+            db = SessionLocal()
+            try:
+                chunk = select(TaskHost.id).where(TaskHost.task_id == task_id).limit(self.chunk_rows)
+                count = db.execute(delete(TaskHost).where(TaskHost.id.in_(chunk))).rowcount
+                db.commit()
+            finally:
+                db.close()
+            deleted += count
+            if count < self.chunk_rows:
+                return deleted
+            # Let other writers in between chunks
+            time.sleep(self.chunk_pause)
+
+    def archive_task(self, task_id: int, created_at: datetime.datetime) -> int:
+        """Archive one task's host rows, returns the number of rows deleted (0 if another worker claimed it)."""
+        path = self.archive_path(task_id, created_at)
+        db = SessionLocal()
+        try:
+            counts = self._export(db, task_id, path)
+            claimed = db.query(Task) \
+                .filter(Task.id == task_id, Task.archived_at.is_(None)) \
+                .update({"archived_at": datetime.datetime.utcnow(), "host_summary": counts}, synchronize_session=False)
+            # Jobs are kept: one small row per run, and the history of who ran it when
+            db.commit()
+        finally:
+            db.close()
+        return self._delete_rows(task_id) if claimed else 0
+
+    def _resume_deletes(self) -> int:
+        """Finish deleting rows of tasks archived by a run that was interrupted."""
+        db = SessionLocal()
+        try:
+            task_ids = [task_id for (task_id,) in db.query(Task.id)
+                .filter(Task.archived_at.isnot(None))
+                .filter(select(TaskHost.id).where(TaskHost.task_id == Task.id).exists())]
+        finally:
+            db.close()
+        return sum(self._delete_rows(task_id) for task_id in task_ids)
+
+    def _incremental_vacuum(self) -> int:
+        if engine.dialect.name != "sqlite":
+            return 0
+        with engine.connect() as conn:
+            if conn.execute(text("PRAGMA auto_vacuum")).scalar() != 2:
+                # Not in incremental mode (database created before it was enabled):
+                # freed pages are reused by new rows instead of being returned
+                return 0
+            freed = 0
+            while True:
+                free = conn.execute(text("PRAGMA freelist_count")).scalar()
+                if not free:
+                    return freed
+                step = min(free, self.vacuum_pages)
+                conn.execute(text(f"PRAGMA incremental_vacuum({step})"))
+                conn.commit()
+                freed += step
+                time.sleep(self.chunk_pause)
+
+    def run_once(self, max_tasks: int = config.RETENTION_TASKS_PER_RUN) -> dict:
+        started = time.monotonic()
+        report = {"tasks": 0, "rows": self._resume_deletes()}
+        db = SessionLocal()
+        try:
+            candidates = self._candidates(db, max_tasks)
+        finally:
+            db.close()
+        for task_id, created_at in candidates:
+            try:
+                report["rows"] += self.archive_task(task_id, created_at)
+                report["tasks"] += 1
+            except OSError as e:
+                print(f"Retention: archiving task {task_id} failed: {e}")
+        report["vacuumed_pages"] = self._incremental_vacuum()
+        report["seconds"] = round(time.monotonic() - started, 3)
+        report["finished_at"] = datetime.datetime.utcnow().isoformat()
+        self.last_run = report
+        return report
+
+    def read_archive(self, task_id: int, created_at: datetime.datetime) -> List[dict]:
+        path = self.archive_path(task_id, created_at)
+        if not os.path.exists(path):
+            return []
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            return [json.loads(line) for line in f]
+
+    def stats(self) -> dict:
+        return {"last_run": self.last_run}
+
+retention = RetentionManager()
@@ -0,0 +1,175 @@
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict, Iterable, List, Optional
+from . import config
+
+class _Request:
+    __slots__ = ("host_id", "tags", "future")
+
+    def __init__(self, host_id: int, tags: List[str], future: asyncio.Future):
+        self.host_id = host_id
+        self.tags = tags
+        self.future = future
+
+class _TaskQueue:
+    def __init__(self, task_id, concurrency: int, weight: int):
+        self.task_id = task_id
+        self.concurrency = max(1, concurrency)
+        self.weight = max(1, weight)
+        self.credit = self.weight
+        self.active = 0
+        self.waiting: Deque[_Request] = deque()
+
+class ExecutionScheduler:
+    """
+    Admission control shared by every running task.
+
+    A host execution runs only while it holds a slot. Slots are limited by a
+    fleet-wide in-flight cap, a per-host cap (so two tasks don't hit the same
+    box at once), optional per-tag caps and each task's own concurrency.
+    Free slots are handed out to tasks by weighted round-robin, so a big task
+    can use idle capacity without starving smaller ones.
+    """
+
+    def __init__(
+        self,
+        max_in_flight: int = config.SCHEDULER_MAX_IN_FLIGHT,
+        per_host_limit: int = config.SCHEDULER_PER_HOST_LIMIT,
+        tag_limits: Optional[Dict[str, int]] = None,
+        scan_depth: int = 64,
+    ):
+        self.max_in_flight = max_in_flight
+        self.per_host_limit = per_host_limit
+        self.tag_limits = config.SCHEDULER_TAG_LIMITS if tag_limits is None else tag_limits
+        # How far into a task's queue we look for a host that isn't blocked by host/tag limits
+        self.scan_depth = scan_depth
+
+        self.in_flight = 0
+        self.host_active: Dict[int, int] = {}
+        self.tag_active: Dict[str, int] = {}
+        self.tasks: Dict[object, _TaskQueue] = {}
+        self.order: List[object] = []  # round-robin ring of task ids
+        self.cursor = 0
+
+    def register_task(self, task_id, concurrency: int = config.TASK_DEFAULT_CONCURRENCY, weight: int = 1) -> _TaskQueue:
+        tq = self.tasks.get(task_id)
+        if tq is None:
+            tq = _TaskQueue(task_id, concurrency, weight)
+            self.tasks[task_id] = tq
+            self.order.append(task_id)
+        else:
+            tq.concurrency, tq.weight = max(1, concurrency), max(1, weight)
+        return tq
+
+    def unregister_task(self, task_id):
+        tq = self.tasks.pop(task_id, None)
+        if tq is None:
+            return
+        idx = self.order.index(task_id)
+        self.order.pop(idx)
+        if idx < self.cursor:
+            self.cursor -= 1
+        if self.order:
+            self.cursor %= len(self.order)
+        else:
+            self.cursor = 0
+        for req in tq.waiting:
+            if not req.future.done():
+                req.future.cancel()
+
+    def _allowed(self, req: _Request) -> bool:
+        if self.host_active.get(req.host_id, 0) >= self.per_host_limit:
+            return False
+        return all(self.tag_active.get(tag, 0) < self.tag_limits[tag] for tag in req.tags)
+
+    def _next_eligible(self, tq: _TaskQueue) -> Optional[_Request]:
+        if tq.active >= tq.concurrency:
+            return None
+        for i, req in enumerate(tq.waiting):
+            if i >= self.scan_depth:
+                break
+            if self._allowed(req):
+                del tq.waiting[i]
+                return req
+        return None
+
+    def _grant(self, tq: _TaskQueue, req: _Request):
+        self.in_flight += 1
+        tq.active += 1
+        self.host_active[req.host_id] = self.host_active.get(req.host_id, 0) + 1
+        for tag in req.tags:
+            self.tag_active[tag] = self.tag_active.get(tag, 0) + 1
+        req.future.set_result(None)
+
+    def _release(self, tq: _TaskQueue, req: _Request):
+        self.in_flight -= 1
+        tq.active -= 1
+        self.host_active[req.host_id] -= 1
+        if not self.host_active[req.host_id]:
+            del self.host_active[req.host_id]
+        for tag in req.tags:
+            self.tag_active[tag] -= 1
+            if not self.tag_active[tag]:
+                del self.tag_active[tag]
+        self._dispatch()
+
+    def _advance(self, tq: _TaskQueue):
+        tq.credit = tq.weight
+        self.cursor = (self.cursor + 1) % len(self.order)
+
+    def _dispatch(self):
+        idle = 0
+        while self.in_flight < self.max_in_flight and self.order and idle < len(self.order):
+            tq = self.tasks[self.order[self.cursor]]
+            req = self._next_eligible(tq)
+            if req is None:
+                self._advance(tq)
+                idle += 1
+                continue
+            self._grant(tq, req)
+            idle = 0
+            tq.credit -= 1
+            if tq.credit <= 0:
+                self._advance(tq)
+
+    @asynccontextmanager
+    async def slot(self, task_id, host_id: int, tags: Optional[Iterable[str]] = None):
+        """Hold an execution slot for one host of a task."""
+        tq = self.tasks.get(task_id) or self.register_task(task_id)
+        limited = [t for t in (tags or ()) if t in self.tag_limits]
+        req = _Request(host_id, limited, asyncio.get_running_loop().create_future())
+        tq.waiting.append(req)
+        self._dispatch()
+        try:
+            await req.future
+        except asyncio.CancelledError:
+            if req.future.done() and not req.future.cancelled():
+                # Granted just before we were cancelled
+                self._release(tq, req)
+            elif req in tq.waiting:
+                tq.waiting.remove(req)
+            raise
+        try:
+            yield
+        finally:
+            self._release(tq, req)
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "busy_hosts": len(self.host_active),
+            "tags": dict(self.tag_active),
+            "tasks": {
+                str(tq.task_id): {
+                    "active": tq.active,
+                    "waiting": len(tq.waiting),
+                    "concurrency": tq.concurrency,
+                    "weight": tq.weight,
+                }
+                for tq in self.tasks.values()
+            },
+        }
+
+scheduler = ExecutionScheduler()
@@ -0,0 +1,342 @@
+import asyncio
+import bisect
+import codecs
+import gzip
+import json
+import os
+import re
+import shutil
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+from . import config
+
+Chunk = Union[str, bytes]
+
+_RECORDING_ID = re.compile(r"^[0-9a-f]{32}$")
+
+class Recording:
+    """
+    Timestamped events of one terminal session, buffered until the recorder
+    writes them. Events are (offset, code, data) with asciicast codes:
+    "o" output, "i" input, "r" resize. A ("segment", ...) item starts a new
+    segment; it carries a keyframe, the tail of the scrollback, so replay
+    can start at that segment without the ones before it.
+    """
+
+    def __init__(self, recorder: "SessionRecorder", session_id: str, host_id: int, title: str, size: Tuple[int, int], scrollback):
+        self.recorder = recorder
+        self.id = uuid.uuid4().hex
+        self.session_id = session_id
+        self.host_id = host_id
+        self.title = title
+        self.started_at = time.time()
+        self.t0 = time.monotonic()
+        self.size = size
+        self.scrollback = scrollback
+        self.decoders = {code: codecs.getincrementaldecoder("utf-8")("replace") for code in ("o", "i")}
+        self.segment_start = 0.0
+        self.segment_bytes = 0
+        self.closed = False
+        self.recorder.queue(self, ("segment", 0.0, self.size, ""))
+
+    def _offset(self) -> float:
+        return round(time.monotonic() - self.t0, 6)
+
+    def _event(self, code: str, data: Chunk):
+        if self.closed:
+            return
+        if isinstance(data, bytes):
+            data = self.decoders[code].decode(data)
+        if not data:
+            return
+        offset = self._offset()
+        if offset - self.segment_start >= self.recorder.segment_seconds or self.segment_bytes >= self.recorder.segment_bytes:
+            self.segment_start, self.segment_bytes = offset, 0
+            self.recorder.queue(self, ("segment", offset, self.size, self._keyframe()))
+        self.segment_bytes += len(data)
+        self.recorder.queue(self, (offset, code, data))
+
+    def _keyframe(self) -> str:
+        tail = self.scrollback.snapshot() or ""
+        tail = tail[-self.recorder.keyframe_bytes:]
+        return tail.decode("utf-8", "replace") if isinstance(tail, bytes) else tail
+
+    def output(self, data: Chunk):
+        self._event("o", data)
+
+    def input(self, data: Chunk):
+        if self.recorder.record_input:
+            self._event("i", data)
+
+    def resize(self, cols: int, rows: int):
+        self.size = (cols, rows)
+        self._event("r", f"{cols}x{rows}")
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.recorder.queue(self, ("close", self._offset()))
+
+class SessionRecorder:
+    """
+    Writes terminal recordings as asciicast v2 files for audit and replay.
+
+    Each recording is a directory of gzip segments, every one a playable
+    asciicast file of its own, plus index.json listing each segment's time
+    range. Events are buffered in memory and appended as gzip members by a
+    background flush on a dedicated thread, so the terminal path never
+    touches the disk. Replay picks the segment to start from via the index.
+    """
+
+    def __init__(
+        self,
+        root: str = config.TERMINAL_RECORDING_DIR,
+        flush_interval: float = config.TERMINAL_RECORDING_FLUSH_INTERVAL,
+        segment_seconds: float = config.TERMINAL_RECORDING_SEGMENT_SECONDS,
+        segment_bytes: int = config.TERMINAL_RECORDING_SEGMENT_BYTES,
+        keyframe_bytes: int = config.TERMINAL_RECORDING_KEYFRAME_BYTES,
+        max_pending: int = config.TERMINAL_RECORDING_MAX_PENDING,
+        retention_days: float = config.TERMINAL_RECORDING_RETENTION_DAYS,
+        record_input: bool = config.TERMINAL_RECORDING_INPUT,
+    ):
+        self.root = root
+        self.flush_interval = flush_interval
+        self.segment_seconds = segment_seconds
+        self.segment_bytes = segment_bytes
+        self.keyframe_bytes = keyframe_bytes
+        self.max_pending = max_pending
+        self.retention_days = retention_days
+        self.record_input = record_input
+
+        self.pending: Dict[str, list] = {}
+        self.pending_bytes = 0
+        self.recordings: Dict[str, Recording] = {}
+        self.indexes: Dict[str, dict] = {}  # only touched by the writer thread
+        self.counters = {"events": 0, "dropped": 0, "flushes": 0}
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="recording")
+        self.flusher: Optional[asyncio.Task] = None
+        self.last_expire = 0.0
+
+    def start(self, session_id: str, host_id: int, title: str, size: Tuple[int, int], scrollback) -> Recording:
+        recording = Recording(self, session_id, host_id, title, size, scrollback)
+        self.recordings[recording.id] = recording
+        return recording
+
+    def queue(self, recording: Recording, item: tuple):
+        if isinstance(item[0], float):
+            size = len(item[2])
+            if self.pending_bytes + size > self.max_pending:
+                # Writer can't keep up, never block the terminal for it
+                self.counters["dropped"] += 1
+                return
+            self.pending_bytes += size
+            self.counters["events"] += 1
+        elif item[0] == "close":
+            self.recordings.pop(recording.id, None)
+        self.pending.setdefault(recording.id, []).append((recording, item))
+        if self.flusher is None or self.flusher.done():
+            self.flusher = asyncio.create_task(self._flush_loop())
+
+    def _dir(self, recording_id: str) -> str:
+        return os.path.join(self.root, recording_id)
+
+    def _save_index(self, index: dict):
+        path = os.path.join(self._dir(index["id"]), "index.json")
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(index, f)
+        os.replace(path + ".tmp", path)
+
+    def _append(self, index: dict, lines: List[str]):
+        """Append lines to the current segment, as one more gzip member of it."""
+        if lines and index["segments"]:
+            path = os.path.join(self._dir(index["id"]), index["segments"][-1]["file"])
+            with gzip.open(path, "at", encoding="utf-8") as f:
+                f.write("".join(lines))
+            lines.clear()
+
+    def _write(self, batches: Dict[str, list]):
+        for recording_id, items in batches.items():
+            recording = items[0][0]
+            index = self.indexes.get(recording_id)
+            if index is None:
+                os.makedirs(self._dir(recording_id), exist_ok=True)
+                index = self.indexes[recording_id] = {
+                    "id": recording_id,
+                    "session_id": recording.session_id,
+                    "host_id": recording.host_id,
+                    "title": recording.title,
+                    "started_at": recording.started_at,
+                    "duration": 0.0,
+                    "closed": False,
+                    "segments": [],
+                }
+            lines: List[str] = []
+            for _, item in items:
+                if item[0] == "segment":
+                    self._append(index, lines)
+                    _, offset, (cols, rows), keyframe = item
+                    segment = {"file": f"{len(index['segments']):06d}.cast.gz", "start": offset, "end": offset, "events": 0}
+                    index["segments"].append(segment)
+                    lines.append(json.dumps({
+                        "version": 2,
+                        "width": cols,
+                        "height": rows,
+                        "timestamp": int(recording.started_at + offset),
+                        "title": recording.title,
+                        "env": {"TERM": "xterm"},
+                        "keyframe": keyframe,
+                    }) + "\n")
+                elif item[0] == "close":
+                    index["closed"] = True
+                    index["duration"] = max(index["duration"], item[1])
+                else:
+                    offset, code, data = item
+                    segment = index["segments"][-1]
+                    segment["end"] = offset
+                    segment["events"] += 1
+                    index["duration"] = offset
+                    lines.append(json.dumps([round(offset - segment["start"], 6), code, data]) + "\n")
+            self._append(index, lines)
+            self._save_index(index)
+            if index["closed"]:
+                del self.indexes[recording_id]
+
+    def _expire(self):
+        if not os.path.isdir(self.root):
+            return
+        cutoff = time.time() - self.retention_days * 86400
+        for name in os.listdir(self.root):
+            path = self._dir(name)
+            if name in self.indexes or not os.path.isdir(path):
+                continue
+            if os.path.getmtime(path) < cutoff:
+                shutil.rmtree(path, ignore_errors=True)
+
+    async def flush(self):
+        if not self.pending:
+            return
+        batches, self.pending = self.pending, {}
+        self.pending_bytes = 0
+        self.counters["flushes"] += 1
+        await asyncio.get_running_loop().run_in_executor(self.executor, self._write, batches)
+
+    async def _flush_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+                if time.time() - self.last_expire > 3600:
+                    self.last_expire = time.time()
+                    await loop.run_in_executor(self.executor, self._expire)
+            except OSError as e:
+                print(f"Recording flush failed: {e}")
+
+    def load_index(self, recording_id: str) -> Optional[dict]:
+        if not _RECORDING_ID.match(recording_id):
+            return None
+        try:
+            with open(os.path.join(self._dir(recording_id), "index.json"), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def list(self, host_id: Optional[int] = None, limit: int = 100) -> List[dict]:
+        """Newest recordings first, without their segment lists."""
+        if not os.path.isdir(self.root):
+            return []
+        found = []
+        for name in os.listdir(self.root):
+            index = self.load_index(name)
+            if index is None or (host_id is not None and index["host_id"] != host_id):
+                continue
+            index.pop("segments")
+            found.append(index)
+        found.sort(key=lambda r: r["started_at"], reverse=True)
+        return found[:limit]
+
+    def _records(self, index: dict, first: int) -> Iterator[tuple]:
+        """
+        (offset, code, data) of every event from segment `first` on, offsets
+        relative to the recording start; that segment's header comes first as
+        (start, "header", header).
+        """
+        for n, segment in enumerate(index["segments"][first:]):
+            path = os.path.join(self._dir(index["id"]), segment["file"])
+            try:
+                with gzip.open(path, "rt", encoding="utf-8") as f:
+                    for line in f:
+                        record = json.loads(line)
+                        if isinstance(record, dict):
+                            if n == 0:
+                                yield segment["start"], "header", record
+                            continue
+                        yield record[0] + segment["start"], record[1], record[2]
+            except (EOFError, ValueError, FileNotFoundError):
+                # Truncated by a crash mid-flush, or expired meanwhile
+                return
+
+    @staticmethod
+    def _head(header: dict, catch_up: List[str]) -> Iterator[str]:
+        yield json.dumps(header) + "\n"
+        if catch_up:
+            yield json.dumps([0.0, "o", "".join(catch_up)]) + "\n"
+
+    def replay(self, index: dict, start: float = 0.0, duration: Optional[float] = None) -> Iterator[str]:
+        """
+        Asciicast v2 lines of the recording from `start` seconds on. Only the
+        segment containing `start` and the ones after it are decompressed:
+        its keyframe and the output before `start` are sent at time 0 to
+        redraw the screen, later events keep their timing.
+        """
+        segments = index["segments"]
+        if not segments:
+            return
+        first = max(bisect.bisect_right([s["start"] for s in segments], start) - 1, 0)
+        end = start + duration if duration is not None else None
+        header, catch_up, started = None, [], False
+        for offset, code, data in self._records(index, first):
+            if code == "header":
+                header = {
+                    "version": 2,
+                    "width": data["width"],
+                    "height": data["height"],
+                    "timestamp": int(index["started_at"] + start),
+                    "title": index.get("title"),
+                }
+                if start > 0 and data.get("keyframe"):
+                    catch_up.append(data["keyframe"])
+                continue
+            if offset < start:
+                if code == "o":
+                    catch_up.append(data)
+                elif code == "r":
+                    header["width"], header["height"] = (int(v) for v in data.split("x"))
+                continue
+            if end is not None and offset > end:
+                break
+            if not started:
+                yield from self._head(header, catch_up)
+                started = True
+            yield json.dumps([round(offset - start, 6), code, data]) + "\n"
+        if not started and header is not None:
+            yield from self._head(header, catch_up)
+
+    def stats(self) -> dict:
+        return {
+            **self.counters,
+            "active": len(self.recordings),
+            "pending_bytes": self.pending_bytes,
+        }
+
+    async def close(self):
+        for recording in list(self.recordings.values()):
+            recording.close()
+        if self.flusher is not None:
+            self.flusher.cancel()
+            self.flusher = None
+        await self.flush()
+
+session_recorder = SessionRecorder()
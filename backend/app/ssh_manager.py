@@ -1,56 +1,154 @@
-import asyncssh
-from typing import Dict, Tuple, Optional
 import asyncio
+import time
+from typing import Dict, List, Optional, Tuple, Union
+from .ssh_pool import ssh_pool
+from .terminal_stream import TerminalSession
+from .session_recording import session_recorder
+from . import config
 
 class SSHManager:
+    """
+    Interactive terminal sessions by session id. A session survives its
+    WebSocket for the detach grace period so a reconnecting client can
+    reattach; the reaper closes expired sessions and the oldest detached ones
+    once their count or scrollback memory exceeds the configured limits.
+    """
+
     def __init__(self):
-        # key: session_id, value: (ssh_conn, ssh_process)
-        self.sessions: Dict[str, Tuple[asyncssh.SSHClientConnection, asyncssh.SSHClientProcess]] = {}
-        self.lock = asyncio.Lock()
+        self.sessions: Dict[str, TerminalSession] = {}
+        # Opens in flight by session id; different sessions never wait on each other
+        self.opening: Dict[str, asyncio.Task] = {}
+        self.reaper: Optional[asyncio.Task] = None
 
-    async def create_session(self, session_id: str, host, term_type="xterm", cols=80, rows=24):
-        async with self.lock:
-            if session_id in self.sessions:
-                return self.sessions[session_id]
+    async def create_session(self, session_id: str, host, term_type="xterm", cols=80, rows=24, encoding: Optional[str] = "utf-8") -> TerminalSession:
+        """Existing session with this id, or a new one. encoding=None gives a session of raw bytes."""
+        if self.reaper is None or self.reaper.done():
+            self.reaper = asyncio.create_task(self._reap_loop())
+        session = self.sessions.get(session_id)
+        if session is not None and not session.closed:
+            return session
+        opening = self.opening.get(session_id)
+        if opening is None:
+            opening = self.opening[session_id] = asyncio.create_task(
+                self._open(session_id, host, term_type, cols, rows, encoding)
+            )
+            opening.add_done_callback(lambda _: self.opening.pop(session_id, None))
+        # A client giving up doesn't abort an open other clients of the session wait for
+        return await asyncio.shield(opening)
 
-            try:
-                conn = await asyncssh.connect(
-                    host.ip,
-                    port=host.ssh_port,
-                    username=host.username,
-                    password=host.password if host.auth_type == "password" else None,
-                    known_hosts=None # Insecure for demo, in prod use known_hosts
-                )
-                process = await conn.create_process(term_type=term_type, term_size=(cols, rows))
-                self.sessions[session_id] = (conn, process)
-                return conn, process
-            except Exception as e:
-                print(f"SSH Connection failed: {e}")
-                raise e
+    async def _open(self, session_id: str, host, term_type: str, cols: int, rows: int, encoding: Optional[str]) -> TerminalSession:
+        stale = self.sessions.pop(session_id, None)
+        if stale is not None:
+            # Shell exited while detached
+            await self._close(stale)
+        try:
+            # One deadline for the connection and the shell together
+            lease, process = await asyncio.wait_for(
+                self._connect(host, term_type, cols, rows, encoding),
+                config.TERMINAL_OPEN_TIMEOUT,
+            )
+        except asyncio.TimeoutError as e:
+            print(f"SSH Connection failed: {str(e) or 'timed out'}")
+            raise asyncio.TimeoutError(str(e) or f"Opening a terminal on {host.ip} timed out") from None
+        except Exception as e:
+            print(f"SSH Connection failed: {e}")
+            raise e
+        session = TerminalSession(session_id, host.id, lease, process, binary=encoding is None, size=(cols, rows))
+        if config.TERMINAL_RECORDING:
+            session.recording = session_recorder.start(
+                session_id, host.id, f"{host.name} ({host.username}@{host.ip})", (cols, rows), session.scrollback
+            )
+        session.start()
+        self.sessions[session_id] = session
+        return session
+
+    async def _connect(self, host, term_type: str, cols: int, rows: int, encoding: Optional[str]):
+        # Channels share the pooled connection to (host, user); concurrent
+        # opens to the same host share its handshake
+        lease = await ssh_pool.acquire(
+            host.ip,
+            host.ssh_port,
+            host.username,
+            host.password if host.auth_type == "password" else None,
+        )
+        try:
+            process = await lease.conn.create_process(term_type=term_type, term_size=(cols, rows), encoding=encoding)
+        except BaseException:
+            await ssh_pool.release(lease)
+            raise
+        return lease, process
+
+    async def _close(self, session: TerminalSession):
+        await session.close()
+        # Hand the connection back to the pool instead of closing it
+        await ssh_pool.release(session.lease)
 
     async def close_session(self, session_id: str):
-        async with self.lock:
-            conn, process = self.sessions.pop(session_id, (None, None))
-        if process:
-            try:
-                process.terminate()
-            except:
-                pass
-        if conn:
-            conn.close()
-
-    async def write(self, session_id: str, data: str):
-        if session_id not in self.sessions:
-            return
-        conn, process = self.sessions[session_id]
-        process.stdin.write(data)
+        session = self.sessions.pop(session_id, None)
+        if session:
+            await self._close(session)
+
+    async def write(self, session_id: str, data: Union[str, bytes]):
+        session = self.sessions.get(session_id)
+        if session is not None:
+            session.write(data)
 
     async def resize(self, session_id: str, cols: int, rows: int):
-        if session_id not in self.sessions:
-            return
-        conn, process = self.sessions[session_id]
-        process.terminal_size = (cols, rows)
-        # asyncssh might handle resize automatically if supported, 
-        # otherwise we might need to send signal, but term_size property setter should work
+        session = self.sessions.get(session_id)
+        if session is not None:
+            session.resize(cols, rows)
+
+    def _expired(self) -> List[Tuple[TerminalSession, float]]:
+        now = time.monotonic()
+        detached = sorted(
+            (s for s in self.sessions.values() if s.client is None),
+            key=lambda s: s.detached_at,
+        )
+        expired = [s for s in detached if s.closed or now - s.detached_at > config.TERMINAL_DETACH_GRACE]
+        kept = [s for s in detached if s not in expired]
+        memory = sum(s.scrollback.size for s in kept)
+        # Over the limits: oldest detached sessions go first
+        while kept and (len(kept) > config.TERMINAL_MAX_DETACHED or memory > config.TERMINAL_DETACHED_MAX_BYTES):
+            session = kept.pop(0)
+            memory -= session.scrollback.size
+            expired.append(session)
+        return [(s, s.detached_at) for s in expired]
+
+    async def reap(self) -> int:
+        reaped = 0
+        for session, detached_at in self._expired():
+            # Closing the ones before it yields: skip a session reattached (or
+            # replaced) meanwhile, even if it has been detached again since
+            if self.sessions.get(session.session_id) is not session or session.detached_at != detached_at:
+                continue
+            del self.sessions[session.session_id]
+            await self._close(session)
+            reaped += 1
+        return reaped
+
+    async def _reap_loop(self):
+        while True:
+            await asyncio.sleep(config.TERMINAL_REAP_INTERVAL)
+            try:
+                await self.reap()
+            except Exception as e:
+                print(f"Terminal reaper failed: {e}")
+
+    async def close_all(self):
+        if self.reaper is not None:
+            self.reaper.cancel()
+            self.reaper = None
+        for session_id in list(self.sessions):
+            await self.close_session(session_id)
+
+    def stats(self) -> dict:
+        detached = [s for s in self.sessions.values() if s.client is None]
+        return {
+            "sessions": len(self.sessions),
+            "attached": len(self.sessions) - len(detached),
+            "detached": len(detached),
+            "scrollback_bytes": sum(s.scrollback.size for s in self.sessions.values()),
+            "detached_scrollback_bytes": sum(s.scrollback.size for s in detached),
+        }
 
 ssh_manager = SSHManager()
@@ -0,0 +1,280 @@
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional, Tuple
+
+import asyncssh
+
+from . import config
+
+# (ip, port, username, credential digest)
+PoolKey = Tuple[str, int, str, str]
+
+
+def make_pool_key(ip: str, port: int, username: str, password: Optional[str]) -> PoolKey:
+    # Keep only a digest of the credentials so keys are safe to log / expose
+    digest = hashlib.sha256((password or "").encode()).hexdigest()[:16]
+    return (ip, int(port or 22), username or "", digest)
+
+
+class PooledConnection:
+    def __init__(self, key: PoolKey, conn: asyncssh.SSHClientConnection):
+        self.key = key
+        self.conn = conn
+        self.channels = 0  # open channels (exec / shell) leased on this connection
+        self.broken = False
+        self.last_used = time.monotonic()
+
+    def is_healthy(self) -> bool:
+        return not self.broken and not self.conn.is_closed()
+
+
+class SSHConnectionPool:
+    """
+    Reusable SSH connections keyed by (ip, port, user, credentials).
+
+    A connection carries up to `max_channels` concurrent channels, at most
+    `max_per_host` connections are opened per key, and idle connections are
+    expired after `idle_ttl` seconds or evicted in LRU order once `max_total`
+    is reached.
+
+    Callers arriving while a connection to their key is being opened join
+    that handshake (as many as it will have free channels) instead of
+    opening connections of their own, and share its failure.
+    """
+
+    def __init__(
+        self,
+        max_per_host: int = config.SSH_POOL_MAX_PER_HOST,
+        max_channels: int = config.SSH_POOL_MAX_CHANNELS,
+        max_total: int = config.SSH_POOL_MAX_TOTAL,
+        idle_ttl: float = config.SSH_POOL_IDLE_TTL,
+        keepalive: float = config.SSH_POOL_KEEPALIVE,
+        connect_timeout: float = config.SSH_CONNECT_TIMEOUT,
+    ):
+        self.max_per_host = max_per_host
+        self.max_channels = max_channels
+        self.max_total = max_total
+        self.idle_ttl = idle_ttl
+        self.keepalive = keepalive
+        self.connect_timeout = connect_timeout
+
+        self.conns: Dict[PoolKey, List[PooledConnection]] = {}
+        # Connections without open channels, least recently used first
+        self.idle: "OrderedDict[PooledConnection, None]" = OrderedDict()
+        self.connecting: Dict[PoolKey, int] = {}
+        # Handshake other callers can join, and how many have joined it
+        self.handshakes: Dict[PoolKey, asyncio.Future] = {}
+        self.joined: Dict[PoolKey, int] = {}
+        self.total = 0  # open + connecting
+        self.counters = {"hits": 0, "misses": 0, "shared": 0, "evictions": 0, "expired": 0, "unhealthy": 0, "timeouts": 0}
+
+        # Created lazily so they bind to the running event loop
+        self._cond: Optional[asyncio.Condition] = None
+        self._reaper: Optional[asyncio.Task] = None
+
+    def _get_cond(self) -> asyncio.Condition:
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        return self._cond
+
+    def _ensure_reaper(self):
+        if self._reaper is None or self._reaper.done():
+            self._reaper = asyncio.create_task(self._reap_loop())
+
+    async def _reap_loop(self):
+        interval = max(1.0, min(self.idle_ttl / 2, 30.0))
+        while True:
+            await asyncio.sleep(interval)
+            async with self._get_cond():
+                now = time.monotonic()
+                for entry in list(self.idle):
+                    if not entry.is_healthy():
+                        self.counters["unhealthy"] += 1
+                        self._drop(entry)
+                    elif now - entry.last_used > self.idle_ttl:
+                        self.counters["expired"] += 1
+                        self._drop(entry)
+                self._get_cond().notify_all()
+
+    def _drop(self, entry: PooledConnection):
+        entries = self.conns.get(entry.key)
+        if entries and entry in entries:
+            entries.remove(entry)
+            if not entries:
+                del self.conns[entry.key]
+            self.total -= 1
+        self.idle.pop(entry, None)
+        entry.conn.close()
+
+    def _checkout_existing(self, key: PoolKey) -> Optional[PooledConnection]:
+        best = None
+        for entry in list(self.conns.get(key, [])):
+            if not entry.is_healthy():
+                if entry.channels == 0:
+                    self.counters["unhealthy"] += 1
+                    self._drop(entry)
+                continue
+            if entry.channels < self.max_channels and (best is None or entry.channels < best.channels):
+                best = entry
+        if best is not None:
+            self.idle.pop(best, None)
+            best.channels += 1
+            best.last_used = time.monotonic()
+        return best
+
+    def _can_open(self, key: PoolKey) -> bool:
+        per_host = len(self.conns.get(key, [])) + self.connecting.get(key, 0)
+        if per_host >= self.max_per_host:
+            return False
+        if self.total < self.max_total:
+            return True
+        if self.idle:
+            # Make room by evicting the least recently used idle connection
+            lru = next(iter(self.idle))
+            self.counters["evictions"] += 1
+            self._drop(lru)
+            return True
+        return False
+
+    def _connecting_done(self, key: PoolKey):
+        self.connecting[key] -= 1
+        if not self.connecting[key]:
+            del self.connecting[key]
+
+    async def acquire(self, ip: str, port: int, username: str, password: Optional[str]) -> PooledConnection:
+        """Lease one channel slot on a pooled connection, connecting if needed."""
+        key = make_pool_key(ip, port, username, password)
+        cond = self._get_cond()
+        self._ensure_reaper()
+
+        while True:
+            async with cond:
+                while True:
+                    entry = self._checkout_existing(key)
+                    if entry is not None:
+                        self.counters["hits"] += 1
+                        return entry
+                    handshake = self.handshakes.get(key)
+                    if handshake is not None and self.joined.get(key, 0) < self.max_channels - 1:
+                        self.joined[key] = self.joined.get(key, 0) + 1
+                        opening = False
+                        break
+                    if self._can_open(key):
+                        self.connecting[key] = self.connecting.get(key, 0) + 1
+                        self.total += 1
+                        # Only the first of concurrent connects to a key can be joined
+                        handshake = None
+                        if key not in self.handshakes:
+                            handshake = self.handshakes[key] = asyncio.get_running_loop().create_future()
+                        opening = True
+                        break
+                    await cond.wait()
+            if opening:
+                return await self._open(key, ip, port, username, password, handshake)
+            try:
+                # Raises if the shared handshake failed
+                await asyncio.shield(handshake)
+                self.counters["shared"] += 1
+            finally:
+                self.joined[key] -= 1
+                if not self.joined[key]:
+                    del self.joined[key]
+
+    def _handshake_done(self, key: PoolKey, handshake: Optional[asyncio.Future], error: Optional[BaseException] = None):
+        if handshake is None:
+            return
+        del self.handshakes[key]
+        if isinstance(error, Exception):
+            handshake.set_exception(error)
+            # Mark retrieved, nobody may have joined
+            handshake.exception()
+        else:
+            # Success, or the opener was cancelled: joiners retry on their own
+            handshake.set_result(None)
+
+    async def _open(self, key: PoolKey, ip: str, port: int, username: str, password: Optional[str], handshake: Optional[asyncio.Future]) -> PooledConnection:
+        cond = self._get_cond()
+        try:
+            try:
+                conn = await asyncio.wait_for(asyncssh.connect(
+                    ip,
+                    port=port,
+                    username=username,
+                    password=password,
+                    known_hosts=None,  # Insecure for demo, in prod use known_hosts
+                    keepalive_interval=self.keepalive,
+                ), self.connect_timeout)
+            except asyncio.TimeoutError:
+                self.counters["timeouts"] += 1
+                raise asyncio.TimeoutError(f"SSH connect to {ip}:{port} timed out after {self.connect_timeout:g}s") from None
+        except BaseException as e:
+            async with cond:
+                self._connecting_done(key)
+                self.total -= 1
+                self._handshake_done(key, handshake, e)
+                cond.notify_all()
+            raise
+
+        entry = PooledConnection(key, conn)
+        entry.channels = 1
+        async with cond:
+            self._connecting_done(key)
+            self.conns.setdefault(key, []).append(entry)
+            self.counters["misses"] += 1
+            self._handshake_done(key, handshake)
+            # Wake callers that joined this handshake
+            cond.notify_all()
+        return entry
+
+    async def release(self, entry: PooledConnection, discard: bool = False):
+        cond = self._get_cond()
+        async with cond:
+            entry.channels -= 1
+            entry.last_used = time.monotonic()
+            if discard:
+                entry.broken = True
+            if entry.channels == 0:
+                if entry.is_healthy():
+                    self.idle[entry] = None
+                else:
+                    self._drop(entry)
+            cond.notify_all()
+
+    @asynccontextmanager
+    async def connection(self, ip: str, port: int, username: str, password: Optional[str]):
+        entry = await self.acquire(ip, port, username, password)
+        discard = False
+        try:
+            yield entry.conn
+        except (asyncssh.DisconnectError, OSError):
+            discard = True
+            raise
+        finally:
+            await self.release(entry, discard=discard)
+
+    def stats(self) -> dict:
+        open_conns = sum(len(v) for v in self.conns.values())
+        return {
+            **self.counters,
+            "open": open_conns,
+            "idle": len(self.idle),
+            "connecting": sum(self.connecting.values()),
+            "joining": sum(self.joined.values()),
+            "channels": sum(e.channels for v in self.conns.values() for e in v),
+            "hosts": len(self.conns),
+        }
+
+    async def close_all(self):
+        if self._reaper is not None:
+            self._reaper.cancel()
+            self._reaper = None
+        async with self._get_cond():
+            for entries in list(self.conns.values()):
+                for entry in list(entries):
+                    self._drop(entry)
+
+
+ssh_pool = SSHConnectionPool()
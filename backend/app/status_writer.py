@@ -0,0 +1,154 @@
+import asyncio
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, Optional
+from sqlalchemy import update
+from .db import SessionLocal
+from .models import TaskHost
+from . import config
+
+class StatusWriter:
+    """
+    Collects TaskHost state changes and writes them in batched transactions
+    on a dedicated thread, so the event loop never waits on the database.
+
+    Updates for the same row within one batch are merged, the last value of
+    each field wins. A batch that fails to commit (e.g. "database is locked")
+    is kept and retried with backoff, merged with whatever arrives meanwhile;
+    after the last retry its rows are written one transaction each.
+    """
+
+    def __init__(
+        self,
+        flush_interval: float = config.STATUS_WRITER_FLUSH_INTERVAL,
+        batch_size: int = config.STATUS_WRITER_BATCH_SIZE,
+        retries: int = config.STATUS_WRITER_RETRIES,
+        retry_delay: float = config.STATUS_WRITER_RETRY_DELAY,
+    ):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.queue: "queue.Queue" = queue.Queue()
+        self.thread: Optional[threading.Thread] = None
+        self.lock = threading.Lock()
+        self.counters = {"updates": 0, "batches": 0, "errors": 0, "retries": 0, "row_fallbacks": 0, "dropped": 0}
+
+    def _ensure_thread(self):
+        if self.thread is None or not self.thread.is_alive():
+            with self.lock:
+                if self.thread is None or not self.thread.is_alive():
+                    self.thread = threading.Thread(target=self._run, name="status-writer", daemon=True)
+                    self.thread.start()
+
+    def submit(self, task_host_id: int, **fields):
+        """Queue an update of one TaskHost row, e.g. submit(7, status=TaskHostStatus.running)."""
+        self._ensure_thread()
+        self.queue.put((task_host_id, fields))
+
+    async def flush(self):
+        """Wait until everything submitted so far is committed."""
+        if self.thread is None:
+            return
+        done: Future = Future()
+        self.queue.put(("flush", done))
+        await asyncio.wrap_future(done)
+
+    def _run(self):
+        pending: Dict[int, dict] = {}
+        waiters = []
+        deadline = None
+        attempts = 0  # failed writes of the current batch
+        stopping = False
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if item is not None:
+                key, value = item
+                if key == "flush":
+                    waiters.append(value)
+                elif key == "stop":
+                    waiters.append(value)
+                    stopping = True
+                else:
+                    pending.setdefault(key, {}).update(value)
+                    if deadline is None:
+                        deadline = time.monotonic() + self.flush_interval
+
+            if attempts:
+                # Backing off after a failed write, whoever is waiting
+                due = time.monotonic() >= deadline
+            else:
+                due = stopping or waiters or len(pending) >= self.batch_size or (pending and time.monotonic() >= deadline)
+            if pending and due:
+                if self._write(pending):
+                    pending, attempts = {}, 0
+                elif attempts < self.retries:
+                    attempts += 1
+                    self.counters["retries"] += 1
+                    deadline = time.monotonic() + self.retry_delay * 2 ** (attempts - 1)
+                else:
+                    self._write_rows(pending)
+                    pending, attempts = {}, 0
+            if not pending:
+                deadline = None
+                for w in waiters:
+                    w.set_result(None)
+                waiters = []
+                if stopping:
+                    return
+
+    def _write(self, pending: Dict[int, dict]) -> bool:
+        # Group rows by the set of columns they touch, one executemany per group
+        groups: Dict[tuple, list] = {}
+        for task_host_id, fields in pending.items():
+            groups.setdefault(tuple(sorted(fields)), []).append({"id": task_host_id, **fields})
+        db = SessionLocal()
+        try:
+            for rows in groups.values():
+                db.execute(update(TaskHost), rows)
+            db.commit()
+            self.counters["updates"] += len(pending)
+            self.counters["batches"] += 1
+            return True
+        except Exception as e:
+            db.rollback()
+            self.counters["errors"] += 1
+            print(f"Status writer failed to write {len(pending)} rows: {e}")
+            return False
+        finally:
+            db.close()
+
+    def _write_rows(self, pending: Dict[int, dict]):
+        """Last resort for a batch that kept failing: one transaction per row, so one bad row can't lose the rest."""
+        self.counters["row_fallbacks"] += 1
+        for task_host_id, fields in pending.items():
+            db = SessionLocal()
+            try:
+                db.execute(update(TaskHost), [{"id": task_host_id, **fields}])
+                db.commit()
+                self.counters["updates"] += 1
+            except Exception as e:
+                db.rollback()
+                self.counters["dropped"] += 1
+                print(f"Status writer dropped the update of task host {task_host_id}: {e}")
+            finally:
+                db.close()
+
+    async def close(self):
+        if self.thread is None or not self.thread.is_alive():
+            return
+        done: Future = Future()
+        self.queue.put(("stop", done))
+        await asyncio.wrap_future(done)
+
+    def stats(self) -> dict:
+        return {"queued": self.queue.qsize(), **self.counters}
+
+status_writer = StatusWriter()
@@ -0,0 +1,212 @@
+import asyncio
+import gzip
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+from . import config
+
+class TaskLogStore:
+    """
+    Persistent per-task event log with monotonically increasing sequence numbers.
+
+    Each task gets a directory of append-only JSONL segments named after the
+    first seq they contain. Appends are buffered in memory and written by a
+    background flush on a dedicated thread; full or finished segments are
+    gzip-compressed, and task directories are expired after the retention period.
+    """
+
+    def __init__(
+        self,
+        root: str = config.TASK_LOG_DIR,
+        segment_bytes: int = config.TASK_LOG_SEGMENT_BYTES,
+        flush_interval: float = config.TASK_LOG_FLUSH_INTERVAL,
+        retention_days: float = config.TASK_LOG_RETENTION_DAYS,
+    ):
+        self.root = root
+        self.segment_bytes = segment_bytes
+        self.flush_interval = flush_interval
+        self.retention_days = retention_days
+
+        self.next_seq: Dict[str, int] = {}
+        self.pending: Dict[str, List[dict]] = {}
+        self.inflight: Dict[str, List[dict]] = {}  # handed to the writer thread, not yet on disk
+        self.closing: List[str] = []
+        self.loading: Dict[str, asyncio.Future] = {}
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="task-log")
+        self.flusher: Optional[asyncio.Task] = None
+        self.last_expire = 0.0
+
+    def _task_dir(self, key: str) -> str:
+        return os.path.join(self.root, key)
+
+    def _segments(self, key: str) -> List[tuple]:
+        """(first_seq, path) of every segment of a task, oldest first."""
+        try:
+            names = os.listdir(self._task_dir(key))
+        except FileNotFoundError:
+            return []
+        segments = []
+        for name in names:
+            base = name.split(".", 1)[0]
+            if base.isdigit() and name.endswith((".jsonl", ".jsonl.gz")):
+                segments.append((int(base), os.path.join(self._task_dir(key), name)))
+        segments.sort()
+        return segments
+
+    @staticmethod
+    def _read_segment(path: str) -> List[dict]:
+        opener = gzip.open if path.endswith(".gz") else open
+        events = []
+        with opener(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    events.append(json.loads(line))
+                except ValueError:
+                    # Partially written trailing line
+                    break
+        return events
+
+    def _last_seq_on_disk(self, key: str) -> int:
+        segments = self._segments(key)
+        if not segments:
+            return 0
+        events = self._read_segment(segments[-1][1])
+        return events[-1]["seq"] if events else segments[-1][0] - 1
+
+    async def _load_seq(self, key: str):
+        """Find where a task's seq continues, reading its last segment on the writer thread."""
+        loading = self.loading.get(key)
+        if loading is None:
+            loading = self.loading[key] = asyncio.ensure_future(
+                asyncio.get_running_loop().run_in_executor(self.executor, self._last_seq_on_disk, key)
+            )
+            loading.add_done_callback(lambda _: self.loading.pop(key, None))
+        last = await asyncio.shield(loading)
+        if key not in self.next_seq:
+            # Events of a closed task that are not on disk yet
+            unflushed = list(self.inflight.get(key, ())) + list(self.pending.get(key, ()))
+            self.next_seq[key] = max([last] + [e["seq"] for e in unflushed]) + 1
+
+    async def append(self, message: dict) -> int:
+        """Assign the next seq of the message's task and queue it for writing."""
+        key = str(message["task_id"])
+        if key not in self.next_seq:
+            await self._load_seq(key)
+        seq = self.next_seq[key]
+        self.next_seq[key] = seq + 1
+        message["seq"] = seq
+        self.pending.setdefault(key, []).append(message)
+        if self.flusher is None or self.flusher.done():
+            self.flusher = asyncio.create_task(self._flush_loop())
+        return seq
+
+    def close_task(self, task_id):
+        """Called once a task stops producing output, its last segment gets compacted."""
+        key = str(task_id)
+        self.next_seq.pop(key, None)
+        self.closing.append(key)
+
+    def _write(self, batches: Dict[str, List[dict]], closing: List[str]):
+        for key, events in batches.items():
+            os.makedirs(self._task_dir(key), exist_ok=True)
+            segments = self._segments(key)
+            path = segments[-1][1] if segments else None
+            if path is None or path.endswith(".gz") or os.path.getsize(path) >= self.segment_bytes:
+                if path is not None and not path.endswith(".gz"):
+                    self._compress(path)
+                path = os.path.join(self._task_dir(key), f"{events[0]['seq']:012d}.jsonl")
+            with open(path, "a", encoding="utf-8") as f:
+                f.write("".join(json.dumps(e, default=str) + "\n" for e in events))
+        for key in closing:
+            segments = self._segments(key)
+            if segments and not segments[-1][1].endswith(".gz"):
+                self._compress(segments[-1][1])
+
+    @staticmethod
+    def _compress(path: str):
+        with open(path, "rb") as src, gzip.open(path + ".gz.tmp", "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.replace(path + ".gz.tmp", path + ".gz")
+        os.remove(path)
+
+    def _expire(self):
+        if not os.path.isdir(self.root):
+            return
+        cutoff = time.time() - self.retention_days * 86400
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if name in self.next_seq or not os.path.isdir(path):
+                continue
+            if os.path.getmtime(path) < cutoff:
+                shutil.rmtree(path, ignore_errors=True)
+
+    async def flush(self):
+        if not self.pending and not self.closing:
+            return
+        batches, self.pending = self.pending, {}
+        closing, self.closing = self.closing, []
+        self.inflight = batches
+        try:
+            await asyncio.get_running_loop().run_in_executor(self.executor, self._write, batches, closing)
+        finally:
+            self.inflight = {}
+
+    async def _flush_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+                if time.time() - self.last_expire > 3600:
+                    self.last_expire = time.time()
+                    await loop.run_in_executor(self.executor, self._expire)
+            except OSError as e:
+                print(f"Task log flush failed: {e}")
+
+    def _read_disk(self, key: str, after: int, limit: int) -> List[dict]:
+        segments = self._segments(key)
+        # Skip segments that end before `after`
+        start = 0
+        for i, (first_seq, _) in enumerate(segments):
+            if first_seq <= after + 1:
+                start = i
+        events = []
+        for _, path in segments[start:]:
+            try:
+                segment = self._read_segment(path)
+            except FileNotFoundError:
+                if path.endswith(".gz"):
+                    # Expired meanwhile
+                    return events
+                try:
+                    # Compressed by the writer since it was listed
+                    segment = self._read_segment(path + ".gz")
+                except FileNotFoundError:
+                    return events
+            for e in segment:
+                if e["seq"] > after:
+                    events.append(e)
+                    if len(events) >= limit:
+                        return events
+        return events
+
+    async def read(self, task_id, after: int = 0, limit: int = config.TASK_LOG_REPLAY_PAGE) -> List[dict]:
+        """Events of a task with seq > after, in order, including ones not yet flushed by this process."""
+        key = str(task_id)
+        unflushed = list(self.inflight.get(key, ())) + list(self.pending.get(key, ()))
+        events = await asyncio.get_running_loop().run_in_executor(None, self._read_disk, key, after, limit)
+        last = events[-1]["seq"] if events else after
+        if len(events) < limit:
+            events.extend(e for e in unflushed if e["seq"] > last)
+        return events[:limit]
+
+    async def close(self):
+        if self.flusher is not None:
+            self.flusher.cancel()
+            self.flusher = None
+        await self.flush()
+
+task_log_store = TaskLogStore()
@@ -0,0 +1,75 @@
+import asyncio
+from typing import Dict, Optional
+
+class TaskControl:
+    """Runtime handle of a task executing in this process."""
+
+    def __init__(self, task_id: int):
+        self.task_id = task_id
+        self.runner: Optional[asyncio.Task] = None
+        self.cancelled = False
+        self.halted = False  # failure threshold crossed: hosts not started yet stay pending
+        self.handed_over = False  # stopped by a worker shutdown, the job is requeued for another worker
+        self.resumed = asyncio.Event()
+        self.resumed.set()
+
+    @property
+    def paused(self) -> bool:
+        return not self.resumed.is_set()
+
+    async def wait_resumed(self):
+        """Called by the runner at batch / window boundaries."""
+        await self.resumed.wait()
+
+class TaskRegistry:
+    def __init__(self):
+        self.controls: Dict[int, TaskControl] = {}
+
+    def register(self, task_id: int) -> TaskControl:
+        control = TaskControl(task_id)
+        self.controls[task_id] = control
+        return control
+
+    def unregister(self, task_id: int):
+        self.controls.pop(task_id, None)
+
+    def get(self, task_id: int) -> Optional[TaskControl]:
+        return self.controls.get(task_id)
+
+    def cancel(self, task_id: int) -> bool:
+        control = self.controls.get(task_id)
+        if control is None or control.runner is None:
+            return False
+        control.cancelled = True
+        # Let a paused runner wake up and observe the cancellation
+        control.resumed.set()
+        control.runner.cancel()
+        return True
+
+    def hand_over(self, task_id: int):
+        """Mark a task as interrupted by shutdown rather than cancelled, before its runner is cancelled."""
+        control = self.controls.get(task_id)
+        if control is not None:
+            control.handed_over = True
+
+    def pause(self, task_id: int) -> bool:
+        control = self.controls.get(task_id)
+        if control is None:
+            return False
+        control.resumed.clear()
+        return True
+
+    def resume(self, task_id: int) -> bool:
+        control = self.controls.get(task_id)
+        if control is None:
+            return False
+        control.resumed.set()
+        return True
+
+    def stats(self) -> dict:
+        return {
+            str(task_id): {"paused": control.paused, "cancelled": control.cancelled}
+            for task_id, control in self.controls.items()
+        }
+
+task_registry = TaskRegistry()
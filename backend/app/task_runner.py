@@ -1,162 +1,364 @@
 import asyncio
-from typing import List, Callable
-from sqlalchemy.orm import Session
-from .models import Task, TaskHost, TaskHostStatus, Host, BatchFailStrategy
-from .db import SessionLocal
-import asyncssh
-
-# Global event bus for task logs (Simple in-memory implementation)
-# In production, use Redis Pub/Sub
-class TaskEventBus:
-    def __init__(self):
-        self.subscribers: List[Callable] = []
-
-    def subscribe(self, callback: Callable):
-        self.subscribers.append(callback)
-
-    def unsubscribe(self, callback: Callable):
-        if callback in self.subscribers:
-            self.subscribers.remove(callback)
-
-    async def publish(self, message: dict):
-        for sub in self.subscribers:
-            if asyncio.iscoroutinefunction(sub):
-                await sub(message)
-            else:
-                sub(message)
+import datetime
+from typing import Optional
+from sqlalchemy import select, update
+from .models import Task, TaskHost, TaskHostStatus, Host, BatchFailStrategy, TaskMode, TaskType
+from .db import AsyncSessionLocal
+from .ssh_pool import ssh_pool
+from .event_bus import task_event_bus
+from .task_log import task_log_store
+from .status_writer import status_writer
+from .scheduler import scheduler
+from .task_registry import task_registry, TaskControl
+from .progress import progress_cache
+from .file_distribution import FileDistribution
+from . import config
 
-task_event_bus = TaskEventBus()
+async def publish_event(message: dict):
+    # Persist first so the event carries its seq when it reaches live subscribers
+    await task_log_store.append(message)
+    await task_event_bus.publish(message)
 
-async def execute_command_on_host(task_id: int, task_host_id: int, host_ip: str, host_port: int, host_user: str, host_pass: str, command: str):
-    db: Session = SessionLocal()
-    task_host = db.query(TaskHost).get(task_host_id)
-    if not task_host:
-        db.close()
-        return
+class OutputBudget:
+    """Per-host cap on published output, shared by stdout and stderr."""
 
-    try:
-        task_host.status = TaskHostStatus.running
-        db.commit()
-        
-        await task_event_bus.publish({
-            "task_id": task_id,
-            "host_id": task_host.host_id,
-            "status": "running",
-            "line": f"--- Start executing on {host_ip} ---"
-        })
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.remaining = limit
+        self.truncated = False
+
+async def publish_output(task_id: int, host_id: int, stream: str, text: str, budget: OutputBudget):
+    """Publish text as events of at most TASK_OUTPUT_CHUNK_SIZE, split on line boundaries where possible."""
+    chunk_size = config.TASK_OUTPUT_CHUNK_SIZE
+    start = 0
+    while start < len(text) and not budget.truncated:
+        end = min(start + chunk_size, len(text))
+        if end < len(text):
+            cut = text.rfind("\n", start, end)
+            if cut > start:
+                end = cut + 1
+        piece = text[start:end]
+        start = end
 
-        async with asyncssh.connect(host_ip, port=host_port, username=host_user, password=host_pass, known_hosts=None) as conn:
-            result = await conn.run(command)
-            
-            # Send stdout
-            if result.stdout:
-                await task_event_bus.publish({
-                    "task_id": task_id,
-                    "host_id": task_host.host_id,
-                    "status": "running",
-                    "line": result.stdout
-                })
-            
-            # Send stderr
-            if result.stderr:
-                await task_event_bus.publish({
-                    "task_id": task_id,
-                    "host_id": task_host.host_id,
-                    "status": "running",
-                    "line": result.stderr
-                })
-
-            task_host.exit_code = result.exit_status
-            task_host.status = TaskHostStatus.success if result.exit_status == 0 else TaskHostStatus.failed
-            
-            await task_event_bus.publish({
+        size = len(piece.encode("utf-8", "replace"))
+        if size > budget.remaining:
+            piece = piece.encode("utf-8", "replace")[:budget.remaining].decode("utf-8", "ignore")
+            budget.truncated = True
+        budget.remaining -= min(size, budget.remaining)
+
+        if piece:
+            await publish_event({
                 "task_id": task_id,
-                "host_id": task_host.host_id,
-                "status": task_host.status.value,
-                "line": f"--- Finished with exit code {result.exit_status} ---"
+                "host_id": host_id,
+                "status": "running",
+                "stream": stream,
+                "line": piece.rstrip("\n")
             })
+        if budget.truncated:
+            await publish_event({
+                "task_id": task_id,
+                "host_id": host_id,
+                "status": "running",
+                "stream": stream,
+                "line": f"--- Output truncated after {budget.limit} bytes ---"
+            })
+
+async def pump_output(reader, task_id: int, host_id: int, stream: str, budget: OutputBudget):
+    pending = ""
+    while True:
+        data = await reader.read(config.TASK_OUTPUT_READ_SIZE)
+        if not data:
+            break
+        if budget.truncated:
+            # Keep draining so the remote process isn't stalled by SSH flow control
+            continue
+        pending += data
+        # Publish complete lines as soon as they arrive, hold back a trailing partial line
+        cut = pending.rfind("\n")
+        if cut >= 0:
+            ready, pending = pending[:cut + 1], pending[cut + 1:]
+            await publish_output(task_id, host_id, stream, ready, budget)
+        if len(pending) >= config.TASK_OUTPUT_CHUNK_SIZE:
+            ready, pending = pending, ""
+            await publish_output(task_id, host_id, stream, ready, budget)
+    if pending and not budget.truncated:
+        await publish_output(task_id, host_id, stream, pending, budget)
+
+async def stream_command(conn, task_id: int, host_id: int, command: str) -> int:
+    """Run command and publish stdout/stderr incrementally, returns the exit status."""
+    budget = OutputBudget(config.TASK_OUTPUT_MAX_BYTES)
+    process = await conn.create_process(command, errors="replace")
+    try:
+        await asyncio.gather(
+            pump_output(process.stdout, task_id, host_id, "stdout", budget),
+            pump_output(process.stderr, task_id, host_id, "stderr", budget),
+        )
+        await process.wait_closed()
+    except asyncio.CancelledError:
+        # Task cancelled: ask the remote side to stop instead of leaving the command running
+        try:
+            process.send_signal("TERM")
+        except Exception:
+            pass
+        raise
+    finally:
+        process.close()
+    return process.exit_status
+
+async def run_command_buffered(conn, task_id: int, host_id: int, command: str) -> int:
+    """Legacy mode: run to completion, then publish stdout and stderr."""
+    budget = OutputBudget(config.TASK_OUTPUT_MAX_BYTES)
+    result = await conn.run(command, errors="replace")
+    if result.stdout:
+        await publish_output(task_id, host_id, "stdout", result.stdout, budget)
+    if result.stderr:
+        await publish_output(task_id, host_id, "stderr", result.stderr, budget)
+    return result.exit_status
+
+async def execute_on_host(task_id: int, task_host_id: int, host_id: int, host_ip: str, work) -> TaskHostStatus:
+    """Run `work()` for one host of a task, recording its status; work returns an exit status."""
+    status_writer.submit(task_host_id, status=TaskHostStatus.running, start_time=datetime.datetime.utcnow())
+    progress_cache.transition(task_id, TaskHostStatus.pending, TaskHostStatus.running)
 
+    await publish_event({
+        "task_id": task_id,
+        "host_id": host_id,
+        "status": "running",
+        "line": f"--- Start executing on {host_ip} ---"
+    })
+
+    try:
+        exit_status = await work()
+        status = TaskHostStatus.success if exit_status == 0 else TaskHostStatus.failed
+        status_writer.submit(task_host_id, status=status, exit_code=exit_status, end_time=datetime.datetime.utcnow())
+        progress_cache.transition(task_id, TaskHostStatus.running, status)
+
+        await publish_event({
+            "task_id": task_id,
+            "host_id": host_id,
+            "status": status.value,
+            "line": f"--- Finished with exit code {exit_status} ---"
+        })
+
+    except asyncio.CancelledError:
+        control = task_registry.get(task_id)
+        if control is not None and control.handed_over:
+            # Worker shutting down: the host runs again with the requeued job
+            status_writer.submit(task_host_id, status=TaskHostStatus.pending, start_time=None)
+            progress_cache.transition(task_id, TaskHostStatus.running, TaskHostStatus.pending)
+            raise
+        status_writer.submit(task_host_id, status=TaskHostStatus.cancelled, end_time=datetime.datetime.utcnow())
+        progress_cache.transition(task_id, TaskHostStatus.running, TaskHostStatus.cancelled)
+        await publish_event({
+            "task_id": task_id,
+            "host_id": host_id,
+            "status": "cancelled",
+            "line": "--- Cancelled ---"
+        })
+        raise
     except Exception as e:
-        task_host.status = TaskHostStatus.failed
-        task_host.error = str(e)
-        await task_event_bus.publish({
+        status = TaskHostStatus.failed
+        status_writer.submit(task_host_id, status=status, error=str(e), end_time=datetime.datetime.utcnow())
+        progress_cache.transition(task_id, TaskHostStatus.running, status)
+        await publish_event({
             "task_id": task_id,
-            "host_id": task_host.host_id,
+            "host_id": host_id,
             "status": "failed",
             "line": f"Error: {str(e)}"
         })
-    finally:
-        db.commit()
-        db.close()
+    return status
 
-async def run_task(task_id: int, concurrency: int = 5):
-    db: Session = SessionLocal()
-    task = db.query(Task).get(task_id)
-    if not task:
-        db.close()
-        return
+async def execute_command_on_host(task_id: int, task_host_id: int, host_id: int, host_ip: str, host_port: int, host_user: str, host_pass: str, command: str) -> TaskHostStatus:
+    async def work() -> int:
+        async with ssh_pool.connection(host_ip, host_port, host_user, host_pass) as conn:
+            if config.TASK_OUTPUT_STREAMING:
+                return await stream_command(conn, task_id, host_id, command)
+            return await run_command_buffered(conn, task_id, host_id, command)
 
-    task_hosts = db.query(TaskHost).filter(TaskHost.task_id == task_id).all()
-    
-    # Prepare host info to avoid db session issues in async
-    hosts_info = []
-    for th in task_hosts:
-        host = db.query(Host).get(th.host_id)
-        hosts_info.append({
-            "task_host_id": th.id,
-            "host_id": host.id,
-            "ip": host.ip,
-            "port": host.ssh_port,
-            "username": host.username,
-            "password": host.password,
-            "auth_type": host.auth_type
-        })
-    
-    db.close()
+    return await execute_on_host(task_id, task_host_id, host_id, host_ip, work)
+
+async def load_task(task_id: int):
+    async with AsyncSessionLocal() as db:
+        task = await db.get(Task, task_id)
+        if not task:
+            return None, []
+        db.expunge(task)
+
+        # Prepare host info to avoid db session issues in async.
+        # Only pending hosts: a job re-leased after a worker crash resumes where it stopped
+        rows = await db.execute(
+            select(TaskHost.id, Host.id, Host.ip, Host.ssh_port, Host.username, Host.password, Host.auth_type, Host.tags)
+            .join(Host, Host.id == TaskHost.host_id)
+            .where(TaskHost.task_id == task_id, TaskHost.status == TaskHostStatus.pending)
+            .order_by(TaskHost.id)
+        )
+        hosts_info = [{
+            "task_host_id": task_host_id,
+            "host_id": host_id,
+            "ip": ip,
+            "port": port,
+            "username": username,
+            "password": password,
+            "auth_type": auth_type,
+            "tags": tags or []
+        } for task_host_id, host_id, ip, port, username, password, auth_type, tags in rows]
+        return task, hosts_info
 
+def failure_threshold_crossed(task: Task, failed: int, total: int) -> bool:
+    if task.on_batch_fail_strategy != BatchFailStrategy.pause_on_fail:
+        return False
+    if task.max_failures is None and task.max_failure_percent is None:
+        # No threshold configured: any failure pauses the task
+        return failed > 0
+    if task.max_failures is not None and failed > task.max_failures:
+        return True
+    if task.max_failure_percent is not None and total and failed * 100 > task.max_failure_percent * total:
+        return True
+    return False
+
+async def publish_paused(task_id: int, reason: str):
+    await publish_event({
+        "task_id": task_id,
+        "status": "paused",
+        "line": f"--- {reason}, pausing task ---"
+    })
+
+async def run_batches(task: Task, hosts_info: list, run_host, control: TaskControl):
     batch_size = task.batch_size if task.mode == "batch" and task.batch_size else len(hosts_info)
     batches = [hosts_info[i:i + batch_size] for i in range(0, len(hosts_info), batch_size)]
+    failed = 0
 
     for batch in batches:
-        sem = asyncio.Semaphore(concurrency)
-        tasks = []
-
-        async def worker(info):
-            async with sem:
-                # We assume password auth for simplicity in this demo
-                await execute_command_on_host(
-                    task_id, 
-                    info["task_host_id"], 
-                    info["ip"], 
-                    info["port"], 
-                    info["username"], 
-                    info["password"], 
-                    task.command
-                )
-
-        for info in batch:
-            tasks.append(asyncio.create_task(worker(info)))
-
-        await asyncio.gather(*tasks)
+        await control.wait_resumed()
+        # Concurrency within the batch is enforced by the scheduler
+        statuses = await asyncio.gather(*(run_host(info) for info in batch))
+        failed += statuses.count(TaskHostStatus.failed)
 
         # Check for failures if strategy is pause_on_fail
-        if task.on_batch_fail_strategy == BatchFailStrategy.pause_on_fail:
-            # Re-check status from DB
-            db_check = SessionLocal()
-            has_failure = db_check.query(TaskHost).filter(
-                TaskHost.task_id == task_id,
-                TaskHost.host_id.in_([h["host_id"] for h in batch]),
-                TaskHost.status == TaskHostStatus.failed
-            ).count() > 0
-            db_check.close()
-            
-            if has_failure:
-                await task_event_bus.publish({
-                    "task_id": task_id,
-                    "status": "paused",
-                    "line": "--- Batch failed, pausing task ---"
-                })
-                break
+        if failure_threshold_crossed(task, failed, len(hosts_info)):
+            await publish_paused(task.id, "Batch failed")
+            break
 
         if task.batch_interval and task.batch_interval > 0:
             await asyncio.sleep(task.batch_interval)
+
+async def run_rolling(task: Task, hosts_info: list, run_host, window: int, control: TaskControl):
+    """
+    Keep `window` hosts in flight and start the next one as soon as any finishes,
+    so one slow host only occupies its own slot instead of holding a whole batch.
+    """
+    pending = iter(hosts_info)
+    in_flight = set()
+    failed = 0
+    stopped = False
+
+    try:
+        while True:
+            while not stopped and not control.paused and len(in_flight) < window:
+                info = next(pending, None)
+                if info is None:
+                    break
+                in_flight.add(asyncio.create_task(run_host(info)))
+            if not in_flight:
+                if stopped or not control.paused:
+                    break
+                # Paused with nothing running: hold the window until resumed
+                await control.wait_resumed()
+                continue
+
+            done, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+            failed += sum(1 for t in done if t.result() == TaskHostStatus.failed)
+
+            if not stopped and failure_threshold_crossed(task, failed, len(hosts_info)):
+                # Hosts already running are allowed to finish, the rest stay pending
+                stopped = control.halted = True
+                await publish_paused(task.id, f"{failed} host(s) failed")
+    except asyncio.CancelledError:
+        for t in in_flight:
+            t.cancel()
+        await asyncio.gather(*in_flight, return_exceptions=True)
+        raise
+
+async def cancel_pending_hosts(task_id: int) -> int:
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            update(TaskHost)
+            .where(TaskHost.task_id == task_id, TaskHost.status == TaskHostStatus.pending)
+            .values(status=TaskHostStatus.cancelled, end_time=datetime.datetime.utcnow())
+        )
+        await db.commit()
+        return result.rowcount
+
+async def run_task(task_id: int, concurrency: int = config.TASK_DEFAULT_CONCURRENCY) -> TaskControl:
+    control = task_registry.register(task_id)
+    try:
+        control.runner = asyncio.create_task(execute_task(task_id, concurrency, control))
+        await control.runner
+        return control
+    finally:
+        task_registry.unregister(task_id)
+
+async def execute_task(task_id: int, concurrency: int, control: TaskControl):
+    task, hosts_info = await load_task(task_id)
+    if not task:
+        return
+
+    # Seed the live counts before the first host transition
+    await progress_cache.track(task_id)
+    concurrency = task.concurrency or concurrency
+    window = task.batch_size or concurrency
+    # A rolling window wider than the task's concurrency would have its extra hosts
+    # queue in the scheduler, counted as in flight while not running
+    scheduler.register_task(task_id, max(concurrency, window) if task.mode == TaskMode.rolling else concurrency, task.weight or 1)
+
+    distribution = FileDistribution(task_id, task.file_spec, publish_event) if task.task_type == TaskType.file else None
+
+    async def run_host(info) -> Optional[TaskHostStatus]:
+        async with scheduler.slot(task_id, info["host_id"], info["tags"]):
+            if control.halted:
+                # Queued behind other tasks while the threshold was crossed
+                return None
+            if distribution is not None:
+                return await execute_on_host(
+                    task_id, info["task_host_id"], info["host_id"], info["ip"],
+                    lambda: distribution.transfer(info),
+                )
+            # We assume password auth for simplicity in this demo
+            return await execute_command_on_host(
+                task_id,
+                info["task_host_id"],
+                info["host_id"],
+                info["ip"],
+                info["port"],
+                info["username"],
+                info["password"],
+                task.command
+            )
+
+    try:
+        try:
+            if task.mode == TaskMode.rolling:
+                await run_rolling(task, hosts_info, run_host, window, control)
+            else:
+                await run_batches(task, hosts_info, run_host, control)
+        except asyncio.CancelledError:
+            if not control.cancelled:
+                raise
+        finally:
+            scheduler.unregister_task(task_id)
+            if distribution is not None:
+                await distribution.close()
+
+        await status_writer.flush()
+        if control.cancelled:
+            # Hosts that never started are cancelled in one statement
+            cancelled = await cancel_pending_hosts(task_id)
+            progress_cache.transition(task_id, TaskHostStatus.pending, TaskHostStatus.cancelled, cancelled)
+            await publish_event({
+                "task_id": task_id,
+                "status": "cancelled",
+                "line": "--- Task cancelled ---"
+            })
+        task_log_store.close_task(task_id)
+    finally:
+        progress_cache.untrack(task_id)
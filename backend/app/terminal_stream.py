@@ -0,0 +1,203 @@
+import asyncio
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Optional, Tuple, Union
+from . import config
+
+Chunk = Union[str, bytes]
+
+class Scrollback:
+    """Most recent terminal output, whole chunks are dropped once over `max_bytes`."""
+
+    def __init__(self, max_bytes: int = config.TERMINAL_SCROLLBACK_BYTES):
+        self.max_bytes = max_bytes
+        self.chunks: Deque[Chunk] = deque()
+        self.size = 0
+
+    def append(self, chunk: Chunk):
+        if len(chunk) > self.max_bytes:
+            chunk = chunk[-self.max_bytes:]
+        self.chunks.append(chunk)
+        self.size += len(chunk)
+        while self.size > self.max_bytes:
+            self.size -= len(self.chunks.popleft())
+
+    def snapshot(self) -> Optional[Chunk]:
+        if not self.chunks:
+            return None
+        return self.chunks[0][:0].join(self.chunks)
+
+class TerminalSession:
+    """
+    An interactive shell that outlives the WebSocket it was opened from.
+
+    Output is read for the whole life of the session into a bounded
+    scrollback and, while a client is attached, into that client's queue.
+    Reads grow while SSH keeps filling them and shrink again for interactive
+    traffic. The client queue is bounded: when the socket can't keep up the
+    reader blocks and SSH flow control stalls the remote side. Detached
+    sessions keep reading into the scrollback only, until they are
+    reattached or reaped.
+    """
+
+    def __init__(
+        self,
+        session_id: str,
+        host_id: int,
+        lease,
+        process,
+        binary: bool,
+        size: Tuple[int, int] = (80, 24),
+        scrollback_bytes: int = config.TERMINAL_SCROLLBACK_BYTES,
+        read_min: int = config.TERMINAL_READ_MIN,
+        read_max: int = config.TERMINAL_READ_MAX,
+        queue_chunks: int = config.TERMINAL_QUEUE_CHUNKS,
+    ):
+        self.session_id = session_id
+        self.host_id = host_id
+        self.lease = lease
+        self.process = process
+        self.binary = binary
+        self.size = size
+        self.scrollback = Scrollback(scrollback_bytes)
+        self.read_min = read_min
+        self.read_max = read_max
+        self.queue_chunks = queue_chunks
+        self.client: Optional["asyncio.Queue[Optional[Chunk]]"] = None
+        self.detached_at: Optional[float] = time.monotonic()
+        self.closed = False
+        self.reader: Optional[asyncio.Task] = None
+        self.recording = None  # set by SSHManager when recording is enabled
+
+    def start(self):
+        self.reader = asyncio.create_task(self._read())
+
+    async def _read(self):
+        size = self.read_min
+        try:
+            while True:
+                chunk = await self.process.stdout.read(size)
+                if not chunk:
+                    break
+                if self.recording is not None:
+                    # Before the scrollback, which a new segment's keyframe is taken from
+                    self.recording.output(chunk)
+                self.scrollback.append(chunk)
+                client = self.client
+                if client is not None:
+                    # Blocks while the attached client is behind
+                    await client.put(chunk)
+                if len(chunk) >= size:
+                    size = min(size * 2, self.read_max)
+                elif len(chunk) < size // 4:
+                    size = max(size // 2, self.read_min)
+        except Exception as e:
+            print(f"Terminal {self.session_id} read error: {e}")
+        self.closed = True
+        if self.client is not None:
+            await self.client.put(None)
+
+    @staticmethod
+    def _end(queue: "asyncio.Queue[Optional[Chunk]]"):
+        # Drop what the client will never send and unblock a reader waiting on it
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait(None)
+
+    def attach(self) -> Tuple[Optional[Chunk], "asyncio.Queue[Optional[Chunk]]"]:
+        """Scrollback to replay and the queue of output that follows it; takes over from a previous client."""
+        if self.client is not None:
+            self._end(self.client)
+        queue: "asyncio.Queue[Optional[Chunk]]" = asyncio.Queue(maxsize=self.queue_chunks)
+        self.client = queue
+        self.detached_at = None
+        if self.closed:
+            queue.put_nowait(None)
+        return self.scrollback.snapshot(), queue
+
+    def detach(self, queue: "asyncio.Queue[Optional[Chunk]]"):
+        if self.client is not queue:
+            # Already taken over by another client
+            return
+        self.client = None
+        self.detached_at = time.monotonic()
+        self._end(queue)
+
+    def write(self, data: Chunk):
+        self.process.stdin.write(data)
+        if self.recording is not None:
+            self.recording.input(data)
+
+    def resize(self, cols: int, rows: int):
+        if (cols, rows) != self.size:
+            self.size = (cols, rows)
+            self.process.change_terminal_size(cols, rows)
+            if self.recording is not None:
+                self.recording.resize(cols, rows)
+
+    async def close(self):
+        if self.reader is not None:
+            self.reader.cancel()
+            await asyncio.gather(self.reader, return_exceptions=True)
+        try:
+            self.process.terminate()
+        except Exception:
+            pass
+        self.process.close()
+        if self.recording is not None:
+            self.recording.close()
+        if self.client is not None:
+            self._end(self.client)
+
+class TerminalOutputPump:
+    """
+    Sends a session's output queue to a WebSocket. Output arriving within the
+    flush interval is sent as one frame, so bulk output like `cat` of a large
+    log becomes a few large frames instead of thousands of small ones.
+    """
+
+    def __init__(
+        self,
+        queue: "asyncio.Queue[Optional[Chunk]]",
+        send: Callable[[Chunk], Awaitable[None]],
+        flush_interval: float = config.TERMINAL_FLUSH_INTERVAL,
+        flush_bytes: int = config.TERMINAL_FLUSH_BYTES,
+    ):
+        self.queue = queue
+        self.send = send
+        self.flush_interval = flush_interval
+        self.flush_bytes = flush_bytes
+        self.frames = 0
+
+    async def _next(self, timeout: float) -> Optional[Chunk]:
+        try:
+            return self.queue.get_nowait()
+        except asyncio.QueueEmpty:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+
+    async def run(self):
+        """Send until the queue yields None (session closed or detached)."""
+        loop = asyncio.get_running_loop()
+        while True:
+            chunk = await self.queue.get()
+            if chunk is None:
+                return
+            parts, size, eof = [chunk], len(chunk), False
+            deadline = loop.time() + self.flush_interval
+            while size < self.flush_bytes:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    chunk = await self._next(remaining)
+                except asyncio.TimeoutError:
+                    break
+                if chunk is None:
+                    eof = True
+                    break
+                parts.append(chunk)
+                size += len(chunk)
+            await self.send(parts[0][:0].join(parts))
+            self.frames += 1
+            if eof:
+                return
@@ -0,0 +1,189 @@
+import asyncio
+import os
+import signal
+import socket
+import uuid
+from typing import Dict, Optional
+from .db import ensure_schema, dispose_async_engine
+from .models import JobStatus, JobControl
+from .job_queue import job_queue
+from .retention import retention
+from .task_runner import run_task, publish_event
+from .task_registry import task_registry
+from .ssh_pool import ssh_pool
+from .event_bus import task_event_bus
+from .task_log import task_log_store
+from .status_writer import status_writer
+from . import config
+
+class Worker:
+    """
+    Leases jobs from the job queue and runs them.
+
+    Runs embedded in the API process (OPS_EMBEDDED_WORKER=1, the default) or
+    standalone via `python -m app.worker`; any number of workers can share
+    the same database. Pause / cancel requests made through the API are
+    stored on the job and applied at the next heartbeat.
+    """
+
+    def __init__(self, worker_id: Optional[str] = None, max_jobs: int = config.WORKER_MAX_JOBS):
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.max_jobs = max_jobs
+        self.jobs: Dict[int, asyncio.Task] = {}
+        self.job_tasks: Dict[int, int] = {}  # job id -> task id
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.wakeup: Optional[asyncio.Event] = None
+        self.runner: Optional[asyncio.Task] = None
+        self.stopping = False
+
+    def start(self):
+        self.runner = asyncio.create_task(self.run())
+
+    def wake(self):
+        """Poll for new jobs now instead of at the next interval, safe to call from any thread."""
+        if self.loop is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.wakeup.set)
+
+    async def run(self):
+        self.loop = asyncio.get_running_loop()
+        self.wakeup = asyncio.Event()
+        recovered = await asyncio.to_thread(job_queue.recover)
+        if recovered:
+            print(f"Worker {self.worker_id} recovered {recovered} job(s) with expired leases")
+        heartbeat = asyncio.create_task(self._heartbeat_loop())
+        housekeeping = asyncio.create_task(self._retention_loop()) if config.RETENTION_ENABLED else None
+        try:
+            while not self.stopping:
+                await self._fill()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), config.WORKER_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                self.wakeup.clear()
+        finally:
+            heartbeat.cancel()
+            if housekeeping is not None:
+                housekeeping.cancel()
+
+    async def _fill(self):
+        while not self.stopping and len(self.jobs) < self.max_jobs:
+            job = await asyncio.to_thread(job_queue.lease, self.worker_id)
+            if job is None:
+                return
+            self.job_tasks[job["id"]] = job["task_id"]
+            self.jobs[job["id"]] = asyncio.create_task(self._run_job(job))
+
+    async def _run_job(self, job: dict):
+        status, error = JobStatus.done, None
+        try:
+            control = await run_task(job["task_id"])
+            if control.cancelled:
+                status = JobStatus.cancelled
+        except asyncio.CancelledError:
+            # Worker shutting down or lease lost: leave the job to another worker,
+            # once the hosts that were interrupted are pending again
+            await asyncio.shield(status_writer.flush())
+            await asyncio.shield(asyncio.to_thread(job_queue.requeue, job["id"], self.worker_id))
+            raise
+        except Exception as e:
+            status, error = JobStatus.failed, str(e)
+            print(f"Job {job['id']} (task {job['task_id']}) failed: {e}")
+        finally:
+            self.jobs.pop(job["id"], None)
+            self.job_tasks.pop(job["id"], None)
+            if self.wakeup is not None:
+                self.wakeup.set()
+        await asyncio.to_thread(job_queue.complete, job["id"], self.worker_id, status, error)
+
+    async def _apply_control(self, task_id: int, control: Optional[JobControl]):
+        local = task_registry.get(task_id)
+        if local is None:
+            return
+        if control == JobControl.cancel and not local.cancelled:
+            task_registry.cancel(task_id)
+        elif control == JobControl.pause and not local.paused:
+            task_registry.pause(task_id)
+            await publish_event({
+                "task_id": task_id,
+                "status": "paused",
+                "line": "--- Task paused, running hosts will finish ---"
+            })
+        elif control is None and local.paused:
+            task_registry.resume(task_id)
+            await publish_event({
+                "task_id": task_id,
+                "status": "running",
+                "line": "--- Task resumed ---"
+            })
+
+    async def _heartbeat_loop(self):
+        beats = 0
+        while True:
+            await asyncio.sleep(config.WORKER_HEARTBEAT_INTERVAL)
+            beats += 1
+            try:
+                owned = await asyncio.to_thread(job_queue.heartbeat, self.worker_id, list(self.jobs))
+                for job_id, runner in list(self.jobs.items()):
+                    if job_id not in owned:
+                        # Our lease expired and the job was recovered elsewhere
+                        runner.cancel()
+                        continue
+                    await self._apply_control(self.job_tasks[job_id], owned[job_id])
+                # Recovery is cheap but doesn't need to run on every beat
+                if beats % 10 == 0:
+                    await asyncio.to_thread(job_queue.recover)
+            except Exception as e:
+                print(f"Worker {self.worker_id} heartbeat failed: {e}")
+
+    async def _retention_loop(self):
+        while True:
+            await asyncio.sleep(config.RETENTION_INTERVAL)
+            try:
+                report = await asyncio.to_thread(retention.run_once)
+                if report["tasks"] or report["rows"]:
+                    print(f"Retention archived {report['tasks']} task(s), {report['rows']} host rows")
+            except Exception as e:
+                print(f"Retention run failed: {e}")
+
+    async def stop(self):
+        self.stopping = True
+        self.wake()
+        if self.runner is not None:
+            await asyncio.gather(self.runner, return_exceptions=True)
+        jobs = list(self.jobs.values())
+        for task_id in list(self.job_tasks.values()):
+            task_registry.hand_over(task_id)
+        for job in jobs:
+            job.cancel()
+        await asyncio.gather(*jobs, return_exceptions=True)
+
+async def close_runtime():
+    """Flush and close the shared execution services, used by both the API and the worker."""
+    await ssh_pool.close_all()
+    await task_event_bus.close()
+    await task_log_store.close()
+    await status_writer.close()
+    await dispose_async_engine()
+
+embedded_worker = Worker()
+
+async def _serve(worker: Worker):
+    stopped = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stopped.set)
+    worker.start()
+    print(f"Worker {worker.worker_id} started, max {worker.max_jobs} jobs")
+    try:
+        await stopped.wait()
+        # Running jobs are cancelled and handed back to the queue
+        await worker.stop()
+    finally:
+        await close_runtime()
+
+def main():
+    ensure_schema()
+    asyncio.run(_serve(Worker()))
+
+if __name__ == "__main__":
+    main()
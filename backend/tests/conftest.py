@@ -0,0 +1,20 @@
+import os
+import tempfile
+
+# Point the app at a throwaway database and data dirs before it reads its config
+_root = tempfile.mkdtemp(prefix="ops-tests-")
+os.environ["OPS_DATABASE_URL"] = f"sqlite:///{os.path.join(_root, 'ops_platform.db')}"
+os.environ["OPS_EMBEDDED_WORKER"] = "0"
+os.environ["OPS_FILE_STORE_DIR"] = os.path.join(_root, "file_store")
+os.environ["OPS_TASK_LOG_DIR"] = os.path.join(_root, "task_logs")
+os.environ["OPS_TERMINAL_RECORDING_DIR"] = os.path.join(_root, "terminal_recordings")
+os.environ["OPS_RETENTION_ARCHIVE_DIR"] = os.path.join(_root, "task_archive")
+
+import pytest
+from fastapi.testclient import TestClient
+
+@pytest.fixture
+def client():
+    from app.main import app
+    with TestClient(app) as c:
+        yield c
@@ -0,0 +1,125 @@
+import asyncio
+import random
+from contextlib import asynccontextmanager
+import pytest
+from app import file_distribution
+from app.file_distribution import FileDistribution
+
+ARTIFACT = "0" * 64
+
+def _info(host_id):
+    return {"host_id": host_id, "ip": f"10.25.0.{host_id}", "port": 22, "username": "root", "password": "pw"}
+
+class FakeConn:
+    def __init__(self, host_id, commands):
+        self.host_id = host_id
+        self.commands = commands
+
+    async def run(self, command, **kwargs):
+        self.commands.append((self.host_id, command))
+
+class FakeHosts:
+    """Stands in for the SSH side of a FileDistribution and records what it did."""
+
+    def __init__(self, monkeypatch, dist, relay_fails=lambda source, target: False, up_to_date=()):
+        self.relay_fails = relay_fails
+        self.up_to_date = set(up_to_date)
+        self.uploads, self.relays, self.commands = [], [], []
+        self.uploading = self.max_uploading = 0
+
+        @asynccontextmanager
+        async def connection(ip, *args):
+            yield FakeConn(int(ip.rsplit(".", 1)[1]), self.commands)
+        monkeypatch.setattr(file_distribution.ssh_pool, "connection", connection)
+        dist._remote_sha256, dist._run, dist._relay_copy, dist._upload, dist._install = (
+            self.remote_sha256, self.run, self.relay_copy, self.upload, self.install)
+
+    async def remote_sha256(self, conn, path):
+        return ARTIFACT if conn.host_id in self.up_to_date else None
+
+    async def run(self, conn, command, timeout=None, input=None):
+        return ""
+
+    async def relay_copy(self, source, target, conn):
+        self.relays.append((source["host_id"], target["host_id"]))
+        await asyncio.sleep(0)
+        if self.relay_fails(source["host_id"], target["host_id"]):
+            raise RuntimeError("connection refused")
+
+    async def upload(self, conn, host_id):
+        self.uploading += 1
+        self.max_uploading = max(self.max_uploading, self.uploading)
+        await asyncio.sleep(0.001)
+        self.uploading -= 1
+        self.uploads.append(host_id)
+
+    async def install(self, conn):
+        pass
+
+async def _publish(message):
+    pass
+
+def _distribution(fanout, relay=True):
+    return FileDistribution(7, {"artifact": ARTIFACT, "dest": "/opt/app.bin", "relay": relay, "fanout": fanout}, _publish)
+
+def test_failed_relay_is_retried_elsewhere_and_frees_the_relay(monkeypatch):
+    async def main():
+        dist = _distribution(1)
+        hosts = FakeHosts(monkeypatch, dist, relay_fails=lambda source, target: True)
+        await dist.relay.add(_info(99))
+        assert await dist.transfer(_info(1)) == 0
+        # The relay's slot is free again and the failure counts against it
+        assert dist.relay.busy == {99: 0, 1: 0}
+        assert dist.relay.failures == {99: 1}
+        await asyncio.wait_for(dist.transfer(_info(2)), 1)
+        # Host 2 tried every relay once before going direct
+        assert sorted(source for source, target in hosts.relays if target == 2) == [1, 99]
+        assert hosts.uploads == [1, 2]
+        assert dist.counters["fallbacks"] == 3
+        assert dist.relay.busy == {99: 0, 1: 0, 2: 0}
+        assert dist.relay.active == 0
+
+    asyncio.run(main())
+
+@pytest.mark.parametrize("failure_rate", [0.0, 0.5, 1.0])
+def test_direct_uploads_stay_within_fanout(monkeypatch, failure_rate):
+    async def main():
+        rng = random.Random(25)
+        dist = _distribution(3)
+        hosts = FakeHosts(monkeypatch, dist, relay_fails=lambda source, target: rng.random() < failure_rate)
+        await asyncio.wait_for(asyncio.gather(*(dist.transfer(_info(i)) for i in range(1, 61))), 10)
+        assert len(hosts.uploads) + dist.counters["relayed"] == 60
+        assert sorted(dist.relay.sources) == list(range(1, 61))
+        assert hosts.max_uploading <= 3
+        assert dist.relay.active == 0
+        if failure_rate == 0.0:
+            assert sorted(hosts.uploads) == [1, 2, 3]
+
+    asyncio.run(main())
+
+def test_up_to_date_hosts_are_skipped_and_serve_as_relays(monkeypatch):
+    async def main():
+        dist = _distribution(2)
+        hosts = FakeHosts(monkeypatch, dist, up_to_date={1, 2})
+        await asyncio.gather(*(dist.transfer(_info(i)) for i in (1, 2)))
+        await asyncio.gather(*(dist.transfer(_info(i)) for i in range(3, 7)))
+        assert dist.counters["skipped"] == 2
+        assert hosts.uploads == []
+        assert dist.counters["relayed"] == 4
+        assert {source for source, target in hosts.relays if target in (3, 4, 5, 6)} == {1, 2}
+
+    asyncio.run(main())
+
+def test_failed_copy_removes_the_temporary_file(monkeypatch):
+    async def main():
+        dist = _distribution(1, relay=False)
+        hosts = FakeHosts(monkeypatch, dist)
+
+        async def upload(conn, host_id):
+            raise OSError("disk full")
+        dist._upload = upload
+        with pytest.raises(OSError):
+            await dist.transfer(_info(1))
+        assert hosts.commands == [(1, f"rm -f -- {dist.tmp}")]
+
+    asyncio.run(main())
@@ -0,0 +1,34 @@
+import json
+from app.db import SessionLocal
+from app.models import Host, AuthType
+
+def _hosts(prefix):
+    db = SessionLocal()
+    try:
+        return {h.ip: (h.name, h.username, h.password, h.auth_type, h.tags) for h in db.query(Host).filter(Host.ip.like(prefix + "%"))}
+    finally:
+        db.close()
+
+def _create(client, prefix):
+    for i in range(3):
+        r = client.post("/hosts/", json={
+            "name": f"web{i}", "ip": f"{prefix}{i}", "username": "root",
+            "auth_type": "password", "password": "secret", "tags": ["prod", "web"],
+        })
+        assert r.status_code == 200
+
+def test_export_import_round_trip_keeps_credentials(client):
+    _create(client, "10.16.1.")
+    before = _hosts("10.16.1.")
+    for fmt in ("jsonl", "csv"):
+        exported = client.get("/hosts/bulk", params={"format": fmt, "q": "10.16.1."}).text
+        assert "secret" not in exported
+        r = client.post("/hosts/bulk", params={"format": fmt}, content=exported.encode())
+        assert r.json() == {"created": 0, "updated": 3, "failed": 0, "errors": []}
+        assert _hosts("10.16.1.") == before
+
+def test_import_only_changes_given_columns(client):
+    _create(client, "10.16.2.")
+    body = json.dumps({"name": "web0-renamed", "ip": "10.16.2.0", "username": "deploy"}) + "\n"
+    client.post("/hosts/bulk", params={"format": "jsonl"}, content=body.encode())
+    assert _hosts("10.16.2.")["10.16.2.0"] == ("web0-renamed", "deploy", "secret", AuthType.password, ["prod", "web"])
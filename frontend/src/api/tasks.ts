@@ -56,6 +56,6 @@ export const deleteTask = (id: number) => {
     return request.delete<any, any>(`/tasks/${id}`)
 }
 
-export const runTaskAgain = (id: number) => {
-    return request.post<any, { task_id: number }>(`/tasks/${id}/run`)
+export const runTaskAgain = (id: number, failedOnly = false) => {
+    return request.post<any, { task_id: number }>(`/tasks/${id}/run`, null, { params: { failed_only: failedOnly } })
 }